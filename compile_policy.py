@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import optparse
+import numpy as np
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+from stable_baselines3 import PPO
+from marl_tls.env import TLSEnv
+from marl_tls.lookup_policy import LookupTablePolicy, save_lookup_policy
+from marl_tls.policy_compiler import compile_policy, sample_agreement, model_actions, MAX_TABLE_ENTRIES
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--load_model", action="store", type="string", default="data/trained_model_ppo", help="file to load the model")
+    optParser.add_option("--simulation", action="store", type="string", default="cross/cross", help="path to the simulation")
+    optParser.add_option("--output", action="store", type="string", default=None, help="compiled policy file (default: <load_model>_table.json)")
+    optParser.add_option("--boundaries", action="store", type="string", default="1,2,4,7,11,16", help="lower bounds of the queue weight bins after the first one")
+    optParser.add_option("--samples", action="store", type="int", default=10000, help="random observations per TLS to compare the table with the model")
+    optParser.add_option("--traffic_scale", action="store", type="float", default=1, help="Scale Traffic of the evaluation episode")
+    optParser.add_option("--end", action="store", type="int", default=1000, help="simulation end time of the evaluation episode (0: skip it)")
+    options, args = optParser.parse_args()
+    return options
+
+
+def simulation_agreement(model, policy, env):
+    """ Agreement of the table with the model along one episode controlled by the model: (all agent-steps, decisions) """
+    observations, infos = env.reset()
+    agree, total, decision_agree, decisions = 0, 0, 0, 0
+    for _ in range(env.end):
+        actions = {}
+        for tls_id, observation in observations.items():
+            tls = env.list_tls[tls_id]
+            action = int(model_actions(model, observation[None].astype(np.float32), tls.num_actions)[0])
+            actions[tls_id] = action
+            if tls_id not in policy.tables:
+                continue    # skipped by the compiler
+            match = action == policy.act(tls_id, observation.tolist())
+            agree += match
+            total += 1
+            if infos[tls_id]["needs_decision"]:
+                decision_agree += match
+                decisions += 1
+        observations, _, _, _, infos = env.step(actions)
+    return agree / max(total, 1), decision_agree / max(decisions, 1)
+
+
+if __name__ == "__main__":
+    options = get_options()
+    if os.path.exists(options.load_model + "_obs_stats.npz"):
+        sys.exit("models trained with observation normalization or frame stacking cannot be compiled")
+
+    output = options.output if options.output is not None else options.load_model + "_table.json"
+    boundaries = [int(boundary) for boundary in options.boundaries.split(",")]
+
+    model = PPO.load(options.load_model, device="cpu")
+    env = TLSEnv(simulation_path=options.simulation, traffic_scale=options.traffic_scale, end=options.end or None, simulation_label="Compile")
+    tls_shapes = {tls_id: (tls.num_detectors, tls.num_phases) for tls_id, tls in env.list_tls.items()}
+
+    start = time.time()
+    tables, skipped = compile_policy(model, tls_shapes, boundaries)
+    save_lookup_policy(output, tables, boundaries)
+    print(f"Compiled {sum(len(table) for _, _, table in tables.values())} entries in {time.time() - start:.1f} s: {output} ({os.path.getsize(output)} bytes)")
+    for tls_id, num_entries in skipped.items():
+        print(f"  {tls_id}: skipped, {tls_shapes[tls_id][0]} detectors need {num_entries} entries (maximum {MAX_TABLE_ENTRIES}, use fewer --boundaries or the model)")
+    if not tables:
+        sys.exit("no TLS could be compiled")
+
+    policy = LookupTablePolicy(output)
+    compiled_shapes = {tls_id: tls_shapes[tls_id] for tls_id in tables}
+    for tls_id, agreement in sample_agreement(model, policy, compiled_shapes, options.samples).items():
+        print(f"  {tls_id}: {tls_shapes[tls_id][0]} detectors, {len(tables[tls_id][2])} entries, random observations agreement {agreement:.1%}")
+
+    if options.end > 0:
+        agreement, decision_agreement = simulation_agreement(model, policy, env)
+        print(f"Simulation agreement: {agreement:.1%} of the agent-steps, {decision_agreement:.1%} of the decisions")
+
+    ## Decision time of one agent
+    tls_id, observation = next((tls_id, observation) for tls_id, observation in env.observe().items() if tls_id in policy.tables)
+    start = time.time()
+    for _ in range(1000):
+        policy.act(tls_id, observation.tolist())
+    table_time = (time.time() - start) / 1000
+    start = time.time()
+    for _ in range(100):
+        model.predict(np.pad(observation, (0, model.observation_space.shape[0] - len(observation)))[None], deterministic=True)
+    model_time = (time.time() - start) / 100
+    print(f"Decision time: table {table_time * 1e6:.1f} us, model {model_time * 1e6:.1f} us")
+    env.close()
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import optparse
+import tempfile
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import traci
+from stable_baselines3 import PPO
+from marl_tls.env import TLSEnv
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--simulation", action="store", type="string", default="aveiro_traffic/osm", help="path to the simulation")
+    optParser.add_option("--traffic_scale", action="store", type="float", default=2.5, help="Scale Traffic")
+    optParser.add_option("--end", action="store", type="int", default=2250, help="simulation end time of the training episodes")
+    optParser.add_option("--chunk_timesteps", action="store", type="int", default=20000, help="timesteps between two evaluations")
+    optParser.add_option("--chunks", action="store", type="int", default=10, help="number of training chunks")
+    optParser.add_option("--meso_chunks", action="store", type="int", default=5, help="chunks trained with the mesoscopic simulation (multi-fidelity run)")
+    optParser.add_option("--eval_end", action="store", type="int", default=1000, help="simulation end time of the (microscopic) evaluation episode")
+    optParser.add_option("--target_reward", action="store", type="float", default=None, help="evaluation reward to reach (default: best reward of the microscopic run)")
+    options, args = optParser.parse_args()
+    return options
+
+
+def evaluate(model, eval_env):
+    """ Total reward of one deterministic microscopic episode """
+    traci.switch(eval_env.tls_env.simulation_label)
+    obs = eval_env.reset()
+    total_reward = 0
+    for _ in range(eval_env.tls_env.end - 1):   # the env resets itself at the end
+        actions, _ = model.predict(obs, deterministic=True)
+        obs, rewards, dones, infos = eval_env.step(actions)
+        total_reward += rewards.sum()
+    return total_reward
+
+
+def train(options, fidelities):
+    """ Train one chunk per fidelity and evaluate after each one: [(training wall-clock, reward)] """
+    eval_env = TLSEnv.get_vec_env(TLSEnv, simulation_path=options.simulation, traffic_scale=options.traffic_scale, end=options.eval_end, simulation_label="Fidelity_eval")
+    model_file = os.path.join(tempfile.mkdtemp(), "model")
+
+    curve = []
+    training_time = 0
+    model = None
+    vec_env = None
+    for chunk, fidelity in enumerate(fidelities):
+        start = time.time()
+        if vec_env is None or vec_env.tls_env.fidelity != fidelity:
+            if vec_env is not None:
+                traci.switch(vec_env.tls_env.simulation_label)
+                vec_env.close()
+            vec_env = TLSEnv.get_vec_env(TLSEnv, simulation_path=options.simulation, traffic_scale=options.traffic_scale, end=options.end, simulation_label="Fidelity_" + fidelity, fidelity=fidelity)
+            if model is None:
+                model = PPO("MlpPolicy", vec_env, verbose=0)
+            else:
+                # Same path as train.py --retrain_model
+                model.save(model_file)
+                model = PPO.load(model_file)
+                model.set_env(vec_env)
+
+        traci.switch(vec_env.tls_env.simulation_label)
+        model.learn(total_timesteps=options.chunk_timesteps, reset_num_timesteps=chunk == 0)
+        training_time += time.time() - start
+
+        reward = evaluate(model, eval_env)
+        curve.append((training_time, reward))
+        print(f"  chunk {chunk} ({fidelity}): {training_time:8.1f} s, evaluation reward {reward:.1f}")
+        sys.stdout.flush()
+
+    traci.switch(vec_env.tls_env.simulation_label)
+    vec_env.close()
+    traci.switch(eval_env.tls_env.simulation_label)
+    eval_env.close()
+    return curve
+
+
+def time_to_target(curve, target):
+    for training_time, reward in curve:
+        if reward >= target:
+            return training_time
+    return None
+
+
+if __name__ == "__main__":
+    options = get_options()
+
+    print("Microscopic training")
+    micro = train(options, ["micro"] * options.chunks)
+    print("Mesoscopic pre-training + microscopic fine-tuning")
+    multi = train(options, ["meso"] * options.meso_chunks + ["micro"] * (options.chunks - options.meso_chunks))
+
+    target = options.target_reward if options.target_reward is not None else max(reward for _, reward in micro)
+    print(f"Wall-clock to reach the evaluation reward {target:.1f}:")
+    for name, curve in [("micro", micro), ("meso + micro", multi)]:
+        training_time = time_to_target(curve, target)
+        print(f"  {name:12s} " + (f"{training_time:.1f} s" if training_time is not None else "not reached"))
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import optparse
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import traci
+from marl_tls.env import TLSEnv
+from sumo_config.sumo_utils import generate_grid_network
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--grids", action="store", type="string", default="2x5,5x10,10x20", help="comma separated grid sizes (<x>x<y> junctions)")
+    optParser.add_option("--steps", action="store", type="int", default=300, help="measured steps per run")
+    optParser.add_option("--warmup", action="store", type="int", default=200, help="steps before measuring (vehicles entering the grid)")
+    options, args = optParser.parse_args()
+    return options
+
+
+def benchmark(simulation_path, steps, warmup, city_scale):
+    """ Mean step time and mean env overhead (step time minus simulationStep time) in ms """
+    env = TLSEnv(simulation_path=simulation_path, traffic_scale=1, end=warmup + steps + 1, simulation_label="GridBenchmark", city_scale=city_scale)
+    env.reset()
+    actions = {tls_id: 0 for tls_id in env.list_tls_id}
+
+    ## Time traci.simulationStep inside env.step
+    simulation_step = traci.simulationStep
+    simulation_time = [0.0]
+    def timed_simulation_step(*args, **kwargs):
+        start = time.perf_counter()
+        result = simulation_step(*args, **kwargs)
+        simulation_time[0] += time.perf_counter() - start
+        return result
+
+    traci.simulationStep = timed_simulation_step
+    try:
+        for _ in range(warmup):
+            env.step(actions)
+        simulation_time[0] = 0.0
+        start = time.perf_counter()
+        for _ in range(steps):
+            env.step(actions)
+        step_time = time.perf_counter() - start
+    finally:
+        traci.simulationStep = simulation_step
+
+    num_detectors = sum(tls.num_detectors for tls in env.list_tls.values())
+    num_tls = len(env.list_tls)
+    env.close()
+    return num_tls, num_detectors, 1000 * step_time / steps, 1000 * (step_time - simulation_time[0]) / steps
+
+
+if __name__ == "__main__":
+    options = get_options()
+
+    print("%6s %9s %11s %10s %12s %17s" % ("tls", "detectors", "mode", "step ms", "overhead ms", "overhead us/tls"))
+    for grid in options.grids.split(","):
+        x_number, y_number = [int(n) for n in grid.split("x")]
+        # Simulations are read from sumo_config/<simulation_path>.sumocfg
+        generate_grid_network("sumo_config/grid_benchmark/" + grid, x_number, y_number, end=options.warmup + options.steps + 1)
+
+        for city_scale in [False, True]:
+            num_tls, num_detectors, step_ms, overhead_ms = benchmark("grid_benchmark/%s/grid" % grid, options.steps, options.warmup, city_scale)
+            print("%6i %9i %11s %10.2f %12.2f %17.1f" % (
+                num_tls, num_detectors, "city_scale" if city_scale else "default", step_ms, overhead_ms, 1000 * overhead_ms / num_tls))
+    sys.stdout.flush()
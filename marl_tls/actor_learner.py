@@ -0,0 +1,273 @@
+import time
+import queue
+import traceback
+import numpy as np
+import torch as th
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.utils import obs_as_tensor, configure_logger
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+
+class SharedRolloutRing:
+    """
+    Ring of rollout fragments in shared memory (one ring per actor).
+    Every field is a numpy view on the same SharedMemory block, so no data is pickled.
+    """
+
+    def __init__(self, num_slots, fragment_steps, num_agents, obs_dim, name=None):
+        """ Create (name=None) or attach to the shared memory block """
+        self.num_slots = num_slots
+        self.fragment_steps = fragment_steps
+        self.num_agents = num_agents
+        self.obs_dim = obs_dim
+
+        T, n = fragment_steps, num_agents
+        self.fields = [
+            ("observations", (num_slots, T + 1, n, obs_dim), np.float32),  # + observation after the last step
+            ("actions", (num_slots, T, n), np.int64),
+            ("rewards", (num_slots, T, n), np.float32),
+            ("episode_starts", (num_slots, T + 1, n), np.float32),        # + dones of the last step
+            ("log_probs", (num_slots, T, n), np.float32),
+            ("waiting", (num_slots, T, n, 2), np.float32),                # [private_wt, public_wt] infos
+        ]
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in self.fields)
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        offset = 0
+        for field, shape, dtype in self.fields:
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    @property
+    def args(self):
+        """ Arguments to attach to this ring from another process """
+        return (self.num_slots, self.fragment_steps, self.num_agents, self.obs_dim, self.shm.name)
+
+    def close(self, unlink=False):
+        for field, _, _ in self.fields:
+            delattr(self, field)    # release the views before closing the block
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _actor(actor_id, env_kwargs, policy_class, policy_kwargs, ring_args, weights_args, weights_version, weights_lock, free_slots, ready_slots, stop_event):
+    """ Actor process: report its error to the learner (the ready queue carries the traceback instead of a slot) """
+    try:
+        _run_actor(actor_id, env_kwargs, policy_class, policy_kwargs, ring_args, weights_args, weights_version, weights_lock, free_slots, ready_slots, stop_event)
+    except Exception:
+        ready_slots.put((actor_id, traceback.format_exc()))
+        raise
+
+
+def _run_actor(actor_id, env_kwargs, policy_class, policy_kwargs, ring_args, weights_args, weights_version, weights_lock, free_slots, ready_slots, stop_event):
+    """ Step a local TLSEnv with the last published policy and fill the ring """
+    from marl_tls.env import TLSEnv
+
+    vec_env = TLSEnv.get_vec_env(TLSEnv, simulation_label="AveiroCity_actor%d" % actor_id, **env_kwargs)
+    policy = policy_class(vec_env.observation_space, vec_env.action_space, lambda _: 0.0, **policy_kwargs)
+    policy.set_training_mode(False)
+
+    ring = SharedRolloutRing(*ring_args)
+    weights_shm = shared_memory.SharedMemory(name=weights_args[0])
+    weights = np.ndarray((weights_args[1],), dtype=np.float32, buffer=weights_shm.buf)
+
+    version = -1
+    slot = 0
+    obs = vec_env.reset()
+    episode_starts = np.ones(vec_env.num_envs, dtype=np.float32)
+
+    while not stop_event.is_set():
+        ## Pull the last weights published by the learner
+        if weights_version.value != version:
+            with weights_lock:
+                version = weights_version.value
+                vector_to_parameters(th.as_tensor(weights.copy()), policy.parameters())
+
+        if not free_slots.acquire(timeout=1):
+            continue
+        if stop_event.is_set():
+            break
+
+        for t in range(ring.fragment_steps):
+            with th.no_grad():
+                actions, _, log_probs = policy(obs_as_tensor(obs, policy.device))
+            actions = actions.cpu().numpy()
+
+            ring.observations[slot, t] = obs
+            ring.actions[slot, t] = actions
+            ring.episode_starts[slot, t] = episode_starts
+            ring.log_probs[slot, t] = log_probs.cpu().numpy()
+
+            obs, rewards, dones, infos = vec_env.step(actions)
+
+            ring.rewards[slot, t] = rewards
+            ring.waiting[slot, t] = [info["total_accumulated_waiting"] for info in infos]
+            episode_starts = dones.astype(np.float32)
+
+        ring.observations[slot, -1] = obs
+        ring.episode_starts[slot, -1] = episode_starts
+        ready_slots.put((actor_id, slot))
+        slot = (slot + 1) % ring.num_slots
+
+    del weights
+    weights_shm.close()
+    ring.close()
+    vec_env.close()
+
+
+def _next_fragment(ready_slots, actors, poll_interval=5):
+    """ Wait for the next (actor_id, slot), raising the error of an actor that failed or died """
+    while True:
+        try:
+            actor_id, slot = ready_slots.get(timeout=poll_interval)
+        except queue.Empty:
+            for actor_id, actor in enumerate(actors):
+                if not actor.is_alive():
+                    raise RuntimeError("actor %d exited with code %s" % (actor_id, actor.exitcode))
+            continue
+        if isinstance(slot, str):
+            raise RuntimeError("actor %d failed:\n%s" % (actor_id, slot))
+        return actor_id, slot
+
+
+def learn_actor_learner(
+    model,                          # PPO model (the env is only used for its spaces)
+    env_kwargs,                     # TLSEnv arguments of the actors
+    total_timesteps,
+    num_actors=2,                   # Number of actor processes (one SUMO each)
+    num_slots=2,                    # Rollout fragments per actor ring
+    fragments_per_update=None,      # Fragments per PPO update (default: num_actors)
+    reset_num_timesteps=True,
+    tb_log_name="PPO_actor_learner"
+    ):
+    """
+    Train `model` with asynchronous actors: SUMO keeps stepping in the actor processes while the
+    learner computes the PPO updates. The policy of the actors lags behind by at most a few updates
+    (their log probabilities are used as the behaviour policy in the PPO ratio).
+    """
+    fragments_per_update = fragments_per_update or num_actors
+    fragment_steps = model.n_steps
+    num_agents = model.n_envs
+    obs_dim = int(np.prod(model.observation_space.shape))
+
+    if reset_num_timesteps:
+        model.num_timesteps = 0
+    model._num_timesteps_at_start = model.num_timesteps     # time/fps counts the timesteps of this call
+    total_timesteps += model.num_timesteps
+    model.set_logger(configure_logger(model.verbose, model.tensorboard_log, tb_log_name, reset_num_timesteps))
+
+    ## One fragment of each actor fills the columns of the learner buffer
+    model.rollout_buffer = RolloutBuffer(
+        fragment_steps,
+        model.observation_space,
+        model.action_space,
+        device=model.device,
+        gamma=model.gamma,
+        gae_lambda=model.gae_lambda,
+        n_envs=num_agents * fragments_per_update,
+    )
+
+    ## Shared memory: one rollout ring per actor and the policy weights
+    ctx = mp.get_context("spawn")
+    rings = [SharedRolloutRing(num_slots, fragment_steps, num_agents, obs_dim) for _ in range(num_actors)]
+    parameters = parameters_to_vector(model.policy.parameters()).detach().cpu().numpy().astype(np.float32)
+    weights_shm = shared_memory.SharedMemory(create=True, size=parameters.nbytes)
+    weights = np.ndarray(parameters.shape, dtype=np.float32, buffer=weights_shm.buf)
+    weights[:] = parameters
+    weights_version = ctx.Value("l", 0)
+    weights_lock = ctx.Lock()
+
+    free_slots = [ctx.Semaphore(num_slots) for _ in range(num_actors)]
+    ready_slots = ctx.Queue()
+    stop_event = ctx.Event()
+
+    actors = [
+        ctx.Process(
+            target=_actor,
+            args=(actor_id, env_kwargs, model.policy_class, model.policy_kwargs, rings[actor_id].args,
+                  (weights_shm.name, parameters.size), weights_version, weights_lock,
+                  free_slots[actor_id], ready_slots, stop_event),
+            daemon=True,
+        )
+        for actor_id in range(num_actors)
+    ]
+    for actor in actors:
+        actor.start()
+
+    start_time = time.time()
+    learner_time = 0
+    try:
+        while model.num_timesteps < total_timesteps:
+            fragments = [_next_fragment(ready_slots, actors) for _ in range(fragments_per_update)]
+            update_start = time.time()
+
+            ## Columns of the learner buffer: [fragment 0 agents, fragment 1 agents, ...]
+            buffer = model.rollout_buffer
+            buffer.reset()
+            observations = np.concatenate([rings[a].observations[s] for a, s in fragments], axis=1)
+            actions = np.concatenate([rings[a].actions[s] for a, s in fragments], axis=1)
+            rewards = np.concatenate([rings[a].rewards[s] for a, s in fragments], axis=1)
+            episode_starts = np.concatenate([rings[a].episode_starts[s] for a, s in fragments], axis=1)
+            log_probs = np.concatenate([rings[a].log_probs[s] for a, s in fragments], axis=1)
+            waiting = np.concatenate([rings[a].waiting[s] for a, s in fragments], axis=1)
+
+            ## The slots can be reused while the learner trains
+            for actor_id, _ in fragments:
+                free_slots[actor_id].release()
+
+            ## Values with the current policy (one batch for the whole fragment)
+            with th.no_grad():
+                values = model.policy.predict_values(obs_as_tensor(observations.reshape(-1, obs_dim), model.device))
+            values = values.reshape(fragment_steps + 1, -1)
+
+            for t in range(fragment_steps):
+                buffer.add(observations[t], actions[t], rewards[t], episode_starts[t], values[t], th.as_tensor(log_probs[t]))
+            buffer.compute_returns_and_advantage(last_values=values[-1], dones=episode_starts[-1])
+
+            model.num_timesteps += fragment_steps * buffer.n_envs
+            model._update_current_progress_remaining(model.num_timesteps, total_timesteps)
+            model.train()
+
+            ## Publish the new weights
+            with weights_lock:
+                weights[:] = parameters_to_vector(model.policy.parameters()).detach().cpu().numpy()
+                weights_version.value += 1
+
+            learner_time += time.time() - update_start
+            elapsed = time.time() - start_time
+            waiting_time = waiting[-1].reshape(fragments_per_update, num_agents, 2).sum(axis=1).mean(axis=0)
+            model.logger.record("analysis/waiting_private_transport", waiting_time[0])
+            model.logger.record("analysis/waiting_public_transport", waiting_time[1])
+            model.logger.record("analysis/last_reward", rewards[-1].sum() / fragments_per_update)
+            model.logger.record("time/fps", int((model.num_timesteps - model._num_timesteps_at_start) / elapsed))
+            model.logger.record("time/learner_busy", learner_time / elapsed)
+            model.logger.record("time/weights_version", weights_version.value)
+            model.logger.record("time/total_timesteps", model.num_timesteps)
+            model.logger.dump(step=model.num_timesteps)
+    finally:
+        stop_event.set()
+        for semaphore in free_slots:
+            semaphore.release()
+        while True:
+            try:
+                ready_slots.get_nowait()
+            except queue.Empty:
+                break
+        for actor in actors:
+            actor.join(timeout=30)
+            if actor.is_alive():
+                actor.terminate()
+        del weights
+        weights_shm.close()
+        weights_shm.unlink()
+        for ring in rings:
+            ring.close(unlink=True)
+
+    return model
@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+import traci
+import traci.constants as tc
+
+
+class BaselineController(ABC):
+    """
+    Decide the action of every TLS of a TLSEnv in one vectorized pass over the detector vehicle counts.
+    The counts of all the detectors come from one TraCI subscription (no per-vehicle queries), made by the
+    DetectorIndex of the env together with its own detector data.
+    """
+
+    def __init__(self, env):
+        """ Index the detectors and the lanes served by each action of every TLS """
+        self.env = env
+        self.tls_ids = env.list_tls_id[:]
+        self.num_tls = len(self.tls_ids)
+
+        self.detectors = [detector_id for tls_id in self.tls_ids for detector_id in env.list_tls[tls_id].lane_detectors]
+        self.num_actions = np.array([env.list_tls[tls_id].num_actions for tls_id in self.tls_ids])
+        self.max_actions = int(self.num_actions.max())
+
+        ## served[tls, action, detector] = 1 if the action (phase action * 2) gives green to the detector lane
+        served = np.zeros((self.num_tls, self.max_actions, len(self.detectors)), dtype=np.float32)
+        detector_lanes = [traci.lanearea.getLaneID(detector_id) for detector_id in self.detectors]
+        for tls_idx, tls_id in enumerate(self.tls_ids):
+            phases = traci.trafficlight.getAllProgramLogics(tls_id)[0].getPhases()
+            links = traci.trafficlight.getControlledLinks(tls_id)
+            for action in range(self.num_actions[tls_idx]):
+                state = phases[action * 2].state
+                green_lanes = {link[0][0] for link, signal in zip(links, state) if link and signal in "Gg"}
+                for detector_idx, lane in enumerate(detector_lanes):
+                    if lane in green_lanes:
+                        served[tls_idx, action, detector_idx] = 1
+        self.served = served.reshape(self.num_tls * self.max_actions, len(self.detectors))
+        self.valid_actions = np.arange(self.max_actions)[None, :] < self.num_actions[:, None]
+
+        self.counts = np.zeros(len(self.detectors), dtype=np.float32)
+        self.halting = np.zeros(len(self.detectors), dtype=np.float32)
+        self.actions = np.zeros(self.num_tls, dtype=np.int64)
+        self.halting_time = 0   # vehicle-seconds stopped on the detectors
+        env.detector_index.subscribe_counts()
+
+    def reset(self):
+        """ Start a new episode (after env.reset, which subscribes to the detector counts) """
+        self.actions[:] = 0
+        self.halting_time = 0
+
+    def _read_counts(self):
+        results = traci.lanearea.getAllSubscriptionResults()
+        for detector_idx, detector_id in enumerate(self.detectors):
+            self.counts[detector_idx] = results[detector_id][tc.LAST_STEP_VEHICLE_NUMBER]
+            self.halting[detector_idx] = results[detector_id][tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+        self.halting_time += self.halting.sum() * traci.simulation.getDeltaT()
+
+    def _queues(self):
+        """ Vehicles waiting for each action of every TLS (num_tls, max_actions), -inf for invalid actions """
+        queues = (self.served @ self.counts).reshape(self.num_tls, self.max_actions)
+        queues[~self.valid_actions] = -np.inf
+        return queues
+
+    @abstractmethod
+    def _decide(self, step):
+        """ Actions of every TLS (num_tls,) from the counts of the step """
+
+    def act(self, step):
+        """ Actions of every TLS ({tls_id: action}) """
+        self._read_counts()
+        self.actions = self._decide(step)
+        return dict(zip(self.tls_ids, self.actions.tolist()))
+
+
+class FixedTimeController(BaselineController):
+    """ Cycle through the actions, `green_time` steps each """
+
+    def __init__(self, env, green_time=30):
+        super().__init__(env)
+        self.green_time = green_time
+
+    def _decide(self, step):
+        return (step // self.green_time) % self.num_actions    # the counts are only used for the statistics
+
+
+class MaxPressureController(BaselineController):
+    """ Give green to the action with the largest pressure: vehicles on its incoming detectors minus vehicles on its outgoing lanes """
+
+    def __init__(self, env):
+        super().__init__(env)
+
+        ## released[tls, action, lane] = 1 if the action gives green to a link leaving into the outgoing lane
+        self.outgoing_lanes = []
+        lane_index = {}
+        released = []
+        for tls_idx, tls_id in enumerate(self.tls_ids):
+            phases = traci.trafficlight.getAllProgramLogics(tls_id)[0].getPhases()
+            links = traci.trafficlight.getControlledLinks(tls_id)
+            for action in range(self.num_actions[tls_idx]):
+                state = phases[action * 2].state
+                for link, signal in zip(links, state):
+                    if link and signal in "Gg":
+                        lane = link[0][1]
+                        if lane not in lane_index:
+                            lane_index[lane] = len(self.outgoing_lanes)
+                            self.outgoing_lanes.append(lane)
+                        released.append((tls_idx * self.max_actions + action, lane_index[lane]))
+        self.released = np.zeros((self.num_tls * self.max_actions, len(self.outgoing_lanes)), dtype=np.float32)
+        for row, lane_idx in released:
+            self.released[row, lane_idx] = 1
+        self.outgoing_counts = np.zeros(len(self.outgoing_lanes), dtype=np.float32)
+
+    def reset(self):
+        """ Subscribe to the detector and outgoing lane counts of the (new) simulation """
+        super().reset()
+        for lane in self.outgoing_lanes:
+            traci.lane.subscribe(lane, [tc.LAST_STEP_VEHICLE_NUMBER])
+
+    def _read_counts(self):
+        super()._read_counts()
+        results = traci.lane.getAllSubscriptionResults()
+        for lane_idx, lane in enumerate(self.outgoing_lanes):
+            self.outgoing_counts[lane_idx] = results[lane][tc.LAST_STEP_VEHICLE_NUMBER]
+
+    def _decide(self, step):
+        pressure = self._queues() - (self.released @ self.outgoing_counts).reshape(self.num_tls, self.max_actions)
+        return np.argmax(pressure, axis=1)
+
+
+class QueueThresholdController(BaselineController):
+    """ Keep the current action while it serves at least `threshold` vehicles, otherwise switch to the longest queue """
+
+    def __init__(self, env, threshold=3):
+        super().__init__(env)
+        self.threshold = threshold
+
+    def _decide(self, step):
+        queues = self._queues()
+        current = queues[np.arange(self.num_tls), self.actions]
+        return np.where(current >= self.threshold, self.actions, np.argmax(queues, axis=1))
+
+
+CONTROLLERS = {
+    "fixed": FixedTimeController,
+    "max_pressure": MaxPressureController,
+    "queue_threshold": QueueThresholdController,
+}
+
+
+def run_baseline(env, controller, collect=False):
+    """
+    Run one episode of `env` with a baseline controller.
+    With `collect=False` the env only advances the simulation (no observations nor rewards), otherwise
+    it is stepped as for the RL policy (e.g. to record a behaviour cloning dataset).
+    """
+    env.reset()
+    controller.reset()
+
+    start = time.time()
+    while env.current_step < env.end:
+        actions = controller.act(env.current_step)
+        if collect:
+            env.step(actions)
+        else:
+            env.advance(actions)
+    elapsed = time.time() - start
+
+    stats = {
+        "steps": env.current_step,
+        "steps_per_second": env.current_step / elapsed,
+        "halting_time": float(controller.halting_time),
+    }
+    if collect:
+        # Accumulated waiting times of the reward (only tracked when the env is stepped)
+        stats["waiting_private_transport"], stats["waiting_public_transport"] = env._get_accumulated_waiting_time()
+    return stats
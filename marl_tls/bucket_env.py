@@ -0,0 +1,210 @@
+import time
+import numpy as np
+import torch as th
+from collections import defaultdict
+from stable_baselines3 import PPO
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.utils import obs_as_tensor
+
+
+class BucketEnv:
+    """
+    Group the agents of a TLSEnv by (num_detectors, num_actions) instead of padding every agent
+    to the largest intersection. Each bucket is exposed as a dense SB3 VecEnv (see `vec_envs`);
+    the simulation steps once all the buckets submitted their actions.
+    """
+
+    def __init__(self, env):
+        """ Build the buckets of the environment agents """
+        self.env = env
+
+        buckets = defaultdict(list)
+        for tls_id, tls in env.list_tls.items():
+            buckets[(tls.num_detectors, tls.num_actions)].append(tls_id)
+        self.buckets = dict(sorted(buckets.items()))
+
+        self.pending_actions = {}
+        self.step_results = {}
+        self.reset_results = {}
+
+        self.vec_envs = {bucket: BucketVecEnv(self, bucket) for bucket in self.buckets}
+
+    def summary(self):
+        """ Observation floats per step with buckets vs. global padding """
+        num_agents = len(self.env.list_tls)
+        max_obs_dim = max(self.env.observation_space(tls_id).shape[0] for tls_id in self.env.list_tls)
+        return {
+            "buckets": {"%dx%d" % bucket: len(tls_ids) for bucket, tls_ids in self.buckets.items()},
+            "observation_floats": sum(vec_env.num_envs * vec_env.observation_space.shape[0] for vec_env in self.vec_envs.values()),
+            "padded_observation_floats": num_agents * max_obs_dim,
+        }
+
+    def _split(self, observations, rewards=None, dones=None, infos=None):
+        """ Per bucket arrays of the agent dicts """
+        results = {}
+        for bucket, tls_ids in self.buckets.items():
+            results[bucket] = (
+                np.array([observations[tls_id] for tls_id in tls_ids]),
+                None if rewards is None else np.array([rewards[tls_id] for tls_id in tls_ids], dtype=np.float32),
+                None if dones is None else np.array([dones[tls_id] for tls_id in tls_ids], dtype=bool),
+                [infos[tls_id] for tls_id in tls_ids],
+            )
+        return results
+
+    def reset(self, bucket):
+        """ Reset the simulation once for all the buckets """
+        if bucket not in self.reset_results:
+            observations, infos = self.env.reset()
+            self.reset_results = self._split(observations, infos=infos)
+        observations, _, _, infos = self.reset_results.pop(bucket)
+        return observations, infos
+
+    def submit(self, bucket, actions):
+        self.pending_actions[bucket] = actions
+
+    def result(self, bucket):
+        """ Step the simulation (once every bucket submitted its actions) and get the bucket results """
+        if bucket not in self.step_results:
+            assert len(self.pending_actions) == len(self.buckets), "every bucket must submit its actions before stepping"
+            actions = {}
+            for action_bucket, tls_ids in self.buckets.items():
+                for tls_id, action in zip(tls_ids, self.pending_actions[action_bucket]):
+                    actions[tls_id] = int(action)
+            self.pending_actions = {}
+
+            observations, rewards, terminations, truncations, infos = self.env.step(actions)
+            dones = {tls_id: terminations[tls_id] or truncations[tls_id] for tls_id in terminations}
+
+            ## Every agent terminates at the same time: automatic reset as in the SB3 VecEnvs
+            if all(dones.values()):
+                for tls_id in infos:
+                    infos[tls_id]["terminal_observation"] = observations[tls_id]
+                observations, reset_infos = self.env.reset()
+                for tls_id in infos:
+                    infos[tls_id]["needs_decision"] = reset_infos[tls_id]["needs_decision"]
+
+            self.step_results = self._split(observations, rewards, dones, infos)
+        return self.step_results.pop(bucket)
+
+
+class BucketVecEnv(VecEnv):
+    """ Dense SB3 VecEnv over the agents of one bucket """
+
+    def __init__(self, bucket_env, bucket):
+        self.bucket_env = bucket_env
+        self.bucket = bucket
+        self.tls_ids = bucket_env.buckets[bucket]
+        self.render_mode = bucket_env.env.render_mode
+
+        env = bucket_env.env
+        super().__init__(len(self.tls_ids), env.observation_space(self.tls_ids[0]), env.action_space(self.tls_ids[0]))
+
+    def reset(self):
+        observations, infos = self.bucket_env.reset(self.bucket)
+        self.reset_infos = infos
+        return observations
+
+    def step_async(self, actions):
+        self.bucket_env.submit(self.bucket, actions)
+
+    def step_wait(self):
+        return self.bucket_env.result(self.bucket)
+
+    def close(self):
+        pass    # the TLSEnv is shared by the buckets
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.bucket_env.env, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.bucket_env.env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.bucket_env.env, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class BucketPPO:
+    """ One PPO policy per bucket, each one evaluated and trained as a dense batch """
+
+    def __init__(self, env, policy="MlpPolicy", models=None, **ppo_kwargs):
+        """ Create the bucket models (or use the loaded `models`) """
+        self.bucket_env = BucketEnv(env)
+        if models is None:
+            models = {bucket: PPO(policy, vec_env, **ppo_kwargs) for bucket, vec_env in self.bucket_env.vec_envs.items()}
+        else:
+            for bucket, model in models.items():
+                model.set_env(self.bucket_env.vec_envs[bucket])
+        self.models = models
+
+    @staticmethod
+    def _bucket_path(path, bucket):
+        return "%s_bucket%dx%d" % (path, *bucket)
+
+    def save(self, path):
+        for bucket, model in self.models.items():
+            model.save(self._bucket_path(path, bucket))
+
+    @classmethod
+    def load(cls, path, env, **kwargs):
+        bucket_env = BucketEnv(env)
+        models = {bucket: PPO.load(cls._bucket_path(path, bucket), **kwargs) for bucket in bucket_env.buckets}
+        return cls(env, models=models)
+
+    def predict(self, observations, deterministic=False):
+        """ Actions of every bucket ({bucket: observations} -> {bucket: actions}) """
+        return {bucket: self.models[bucket].predict(obs, deterministic=deterministic)[0] for bucket, obs in observations.items()}
+
+    def learn(self, total_timesteps, reset_num_timesteps=True, tb_log_name="PPO_bucket"):
+        """ Synchronous rollouts of all the buckets, then one PPO update per bucket """
+        num_agents = sum(model.n_envs for model in self.models.values())
+        for bucket, model in self.models.items():
+            model._setup_learn(
+                total_timesteps * model.n_envs // num_agents,
+                reset_num_timesteps=reset_num_timesteps,
+                tb_log_name="%s_%dx%d" % (tb_log_name, *bucket),
+            )
+
+        n_steps = min(model.n_steps for model in self.models.values())
+        start_time = time.time()
+        while any(model.num_timesteps < model._total_timesteps for model in self.models.values()):
+            for model in self.models.values():
+                model.policy.set_training_mode(False)
+                model.rollout_buffer.reset()
+
+            for _ in range(n_steps):
+                step_data = {}
+                for bucket, model in self.models.items():
+                    with th.no_grad():
+                        actions, values, log_probs = model.policy(obs_as_tensor(model._last_obs, model.device))
+                    actions = actions.cpu().numpy()
+                    step_data[bucket] = (actions, values, log_probs)
+                    model.env.step_async(actions)
+
+                for bucket, model in self.models.items():
+                    actions, values, log_probs = step_data[bucket]
+                    new_obs, rewards, dones, infos = model.env.step_wait()
+                    model.num_timesteps += model.n_envs
+                    model._update_info_buffer(infos, dones)
+                    model.rollout_buffer.add(model._last_obs, actions.reshape(-1, 1), rewards, model._last_episode_starts, values, log_probs)
+                    model._last_obs = new_obs
+                    model._last_episode_starts = dones
+                    model._last_infos = infos
+
+            for bucket, model in self.models.items():
+                with th.no_grad():
+                    values = model.policy.predict_values(obs_as_tensor(model._last_obs, model.device))
+                model.rollout_buffer.compute_returns_and_advantage(last_values=values, dones=model._last_episode_starts)
+                model._update_current_progress_remaining(model.num_timesteps, model._total_timesteps)
+
+                waiting_time = np.sum([info["total_accumulated_waiting"] for info in model._last_infos], axis=0)
+                model.logger.record("analysis/waiting_private_transport", waiting_time[0])
+                model.logger.record("analysis/waiting_public_transport", waiting_time[1])
+                model.logger.record("time/fps", int((model.num_timesteps - model._num_timesteps_at_start) / (time.time() - start_time)))
+                model.logger.record("time/total_timesteps", model.num_timesteps)
+                model.train()
+                model.logger.dump(step=model.num_timesteps)
+
+        return self
@@ -0,0 +1,207 @@
+import numpy as np
+import torch as th
+from stable_baselines3 import PPO
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.utils import obs_as_tensor
+
+
+def get_decision_mask(infos, dones):
+    """ Agents (vec env rows) whose next action will be used by the environment """
+    needs_decision = np.array([info.get("needs_decision", True) for info in infos], dtype=bool)
+    return needs_decision | np.asarray(dones, dtype=bool)    # a new episode starts with every agent deciding
+
+
+class DecisionRolloutBuffer(RolloutBuffer):
+    """
+    Rollout buffer that only stores the transitions of agents that made a decision.
+    The decisions of every agent (column) are appended to flat arrays that grow with the number of
+    decisions (no (n_steps, n_envs) storage). The rewards obtained while an agent is locked are
+    discounted into its last decision (semi-MDP transition of k env steps).
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def reset(self):
+        self.size = 0
+        self._allocate(max(getattr(self, "capacity", 0), self.INITIAL_CAPACITY, self.n_envs))   # keeps the capacity of the previous rollouts
+        self.last_decision = np.full(self.n_envs, -1, dtype=np.int64)     # flat index of the last decision of every agent
+        self.pending_episode_starts = np.ones(self.n_envs, dtype=np.float32)
+        self.generator_ready = False
+        self.pos = 0
+        self.full = False
+
+    def _allocate(self, capacity):
+        """ (Re)allocate the flat arrays, keeping the stored decisions """
+        arrays = {
+            "observations": ((capacity, *self.obs_shape), np.float32),
+            "actions": ((capacity, self.action_dim), np.float32),
+            "rewards": ((capacity,), np.float32),
+            "steps": ((capacity,), np.int64),           # env steps between the decision and the next one of the agent
+            "columns": ((capacity,), np.int64),
+            "episode_starts": ((capacity,), np.float32),
+            "values": ((capacity,), np.float32),
+            "log_probs": ((capacity,), np.float32),
+        }
+        for name, (shape, dtype) in arrays.items():
+            array = np.zeros(shape, dtype=dtype)
+            if self.size:
+                array[:self.size] = self.__dict__[name][:self.size]
+            self.__dict__[name] = array
+        self.capacity = capacity
+
+    @property
+    def num_samples(self):
+        return self.size
+
+    def add_decisions(self, mask, obs, action, value, log_prob):
+        """ Store a new transition for the agents in `mask` (its reward is filled by `add_rewards`) """
+        columns = np.flatnonzero(mask)
+        if self.size + len(columns) > self.capacity:
+            self._allocate(max(2 * self.capacity, self.size + len(columns)))
+        rows = np.arange(self.size, self.size + len(columns))
+
+        self.observations[rows] = np.array(obs).reshape((len(columns), *self.obs_shape))
+        self.actions[rows] = np.array(action).reshape((len(columns), self.action_dim))
+        self.rewards[rows] = 0
+        self.steps[rows] = 0
+        self.columns[rows] = columns
+        self.episode_starts[rows] = self.pending_episode_starts[columns]
+        self.values[rows] = value.clone().cpu().numpy().flatten()
+        self.log_probs[rows] = log_prob.clone().cpu().numpy().flatten()
+
+        self.pending_episode_starts[columns] = 0
+        self.last_decision[columns] = rows
+        self.size += len(columns)
+        self.pos = self.size
+
+    def add_rewards(self, rewards, dones):
+        """ Discount the step rewards into the last decision of every agent (gamma**k after k env steps) """
+        columns = np.flatnonzero(self.last_decision >= 0)
+        rows = self.last_decision[columns]
+        self.rewards[rows] += self.gamma ** self.steps[rows] * np.asarray(rewards)[columns]
+        self.steps[rows] += 1
+        self.pending_episode_starts[np.asarray(dones, dtype=bool)] = 1
+
+    def compute_returns_and_advantage(self, last_values, dones):
+        """ GAE(lambda) computed per agent over its own decisions, discounted by gamma**k for k env steps """
+        last_values = last_values.clone().cpu().numpy().flatten()
+        self.advantages = np.zeros(self.size, dtype=np.float32)
+
+        for env_idx in range(self.n_envs):
+            rows = np.flatnonzero(self.columns[:self.size] == env_idx)
+            last_gae_lam = 0
+            for i in reversed(range(len(rows))):
+                row = rows[i]
+                if i == len(rows) - 1:
+                    next_non_terminal = 1.0 - self.pending_episode_starts[env_idx]
+                    next_values = last_values[env_idx]
+                else:
+                    next_non_terminal = 1.0 - self.episode_starts[rows[i + 1]]
+                    next_values = self.values[rows[i + 1]]
+                discount = self.gamma ** self.steps[row]
+                delta = self.rewards[row] + discount * next_values * next_non_terminal - self.values[row]
+                last_gae_lam = delta + discount * self.gae_lambda * next_non_terminal * last_gae_lam
+                self.advantages[row] = last_gae_lam
+        self.returns = self.advantages + self.values[:self.size]
+        self.full = True
+
+    def get(self, batch_size=None):
+        """ Minibatches over the stored decisions """
+        assert self.full, ""
+        indices = np.random.permutation(self.size)
+        if not self.generator_ready:
+            for tensor in ["observations", "actions", "values", "log_probs"]:
+                self.__dict__[tensor] = self.__dict__[tensor][:self.size]
+            self.generator_ready = True
+
+        if batch_size is None:
+            batch_size = len(indices)
+
+        start_idx = 0
+        while start_idx < len(indices):
+            yield self._get_samples(indices[start_idx : start_idx + batch_size])
+            start_idx += batch_size
+
+
+class DecisionPPO(PPO):
+    """
+    PPO that only runs the policy for the agents that need a decision (see `TLSEnv.decision_agents`).
+    Locked agents keep their last action, which the environment discards anyway.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("rollout_buffer_class", DecisionRolloutBuffer)
+        super().__init__(*args, **kwargs)
+
+    def _setup_learn(self, *args, **kwargs):
+        last_obs = self._last_obs
+        result = super()._setup_learn(*args, **kwargs)
+        if self._last_obs is not last_obs:
+            self._last_decision_mask = None    # the env was reset (also after load + set_env): every agent decides
+            self._last_actions = None
+        return result
+
+    def _excluded_save_params(self):
+        """ The decision mask and the actions belong to the episode of the current env """
+        return super()._excluded_save_params() + ["_last_decision_mask", "_last_actions"]
+
+    def collect_rollouts(self, env, callback, rollout_buffer, n_rollout_steps):
+        assert self._last_obs is not None, "No previous observation was provided"
+        self.policy.set_training_mode(False)
+
+        n_steps = 0
+        policy_evaluations = 0
+        rollout_buffer.reset()
+        callback.on_rollout_start()
+
+        if getattr(self, "_last_decision_mask", None) is None:
+            self._last_decision_mask = np.ones(env.num_envs, dtype=bool)
+            self._last_actions = np.zeros(env.num_envs, dtype=np.int64)
+
+        while n_steps < n_rollout_steps:
+            mask = self._last_decision_mask
+            actions = self._last_actions.copy()
+
+            if mask.any():
+                with th.no_grad():
+                    obs_tensor = obs_as_tensor(self._last_obs[mask], self.device)
+                    decision_actions, values, log_probs = self.policy(obs_tensor)
+                decision_actions = decision_actions.cpu().numpy()
+                actions[mask] = decision_actions
+                rollout_buffer.add_decisions(mask, self._last_obs[mask], decision_actions, values, log_probs)
+                policy_evaluations += int(mask.sum())
+
+            new_obs, rewards, dones, infos = env.step(actions)
+
+            self.num_timesteps += env.num_envs
+
+            # Give access to local variables
+            callback.update_locals(locals())
+            if not callback.on_step():
+                return False
+
+            self._update_info_buffer(infos, dones)
+            n_steps += 1
+
+            rollout_buffer.add_rewards(rewards, dones)
+            self._last_obs = new_obs
+            self._last_actions = actions
+            self._last_decision_mask = get_decision_mask(infos, dones)
+
+        with th.no_grad():
+            # Compute value for the last timestep
+            values = self.policy.predict_values(obs_as_tensor(new_obs, self.device))
+
+        rollout_buffer.compute_returns_and_advantage(last_values=values, dones=dones)
+
+        agent_steps = n_rollout_steps * env.num_envs
+        self.logger.record("decision/policy_evaluations", policy_evaluations)
+        self.logger.record("decision/skipped_evaluations", agent_steps - policy_evaluations)
+        self.logger.record("decision/buffer_samples", rollout_buffer.num_samples)
+        self.logger.record("decision/buffer_capacity", rollout_buffer.capacity)
+
+        callback.update_locals(locals())
+
+        callback.on_rollout_end()
+
+        return True
@@ -0,0 +1,113 @@
+import os
+import sys
+from collections import defaultdict
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+import traci
+import traci.constants as tc
+
+CONTEXT_MARGIN = 40     # Context radius added to the longest detector of a junction (m)
+
+
+class DetectorIndex:
+    """
+    TLS -> detectors index built in one pass over the lanearea detectors (Detector ID: TLS<tls_num>_Det<detector_num>).
+    In city-scale mode the detector data of every TLS is fetched once per step with TraCI subscriptions:
+    the vehicle list of each detector and one context subscription per junction with the type and
+    waiting time of the vehicles around it.
+    Mesoscopic simulations have no lanearea detectors (nor lanes): the vehicles of a detector are then
+    the vehicles of its edge (edge subscriptions), split evenly between the detectors of the edge.
+    The split is round-robin over the edge vehicle list, not by lane (the mesoscopic model has no lanes):
+    every detector of an edge gets about the same count, so lane-specific queues (e.g. a full turning
+    lane next to an empty one) are averaged over the edge in the observations.
+    """
+
+    def __init__(self, tls_ids, city_scale=False, mesoscopic=False):
+        """ Index the detectors of `tls_ids` """
+        self.city_scale = city_scale
+        self.mesoscopic = mesoscopic
+
+        tls_ids = set(tls_ids)
+        self.detectors = defaultdict(list)
+        for detector_id in traci.lanearea.getIDList():
+            tls_id = detector_id.split("_")[0]
+            if tls_id in tls_ids:
+                self.detectors[tls_id].append(detector_id)
+
+        self.detector_vehicles = {}
+        self.vehicle_data = {}
+        self.detector_counts = False    # also subscribe to the vehicle and halting counts (see subscribe_counts)
+
+    def subscribe_counts(self):
+        """
+        Add the vehicle and halting counts of the lanearea detectors to their subscription from the next
+        simulation on (TraCI replaces the subscription of a detector, so every variable is subscribed here)
+        """
+        self.detector_counts = True
+
+    def subscribe(self):
+        """ Subscribe to the detector data of the (new) simulation """
+        if not self.city_scale and not self.mesoscopic and not self.detector_counts:
+            return
+
+        ## Edge and junction fed by each detector, and the context radius that covers the detectors of a junction
+        self.edge_detectors = defaultdict(list)
+        junction_radius = defaultdict(float)
+        for detectors in self.detectors.values():
+            for detector_id in detectors:
+                edge_id = traci.lane.getEdgeID(traci.lanearea.getLaneID(detector_id))
+                self.edge_detectors[edge_id].append(detector_id)
+                junction_id = traci.edge.getToJunction(edge_id)
+                junction_radius[junction_id] = max(junction_radius[junction_id], traci.lanearea.getLength(detector_id) + CONTEXT_MARGIN)
+
+        if self.mesoscopic:
+            for edge_id in self.edge_detectors:
+                traci.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_ID_LIST])
+        else:
+            variables = [tc.LAST_STEP_VEHICLE_ID_LIST] if self.city_scale else []
+            if self.detector_counts:
+                variables += [tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+            for detectors in self.edge_detectors.values():
+                for detector_id in detectors:
+                    traci.lanearea.subscribe(detector_id, variables)
+
+        if self.city_scale:
+            for junction_id, radius in junction_radius.items():
+                traci.junction.subscribeContext(junction_id, tc.CMD_GET_VEHICLE_VARIABLE, radius, [tc.VAR_TYPE, tc.VAR_WAITING_TIME])
+
+        self.update()
+
+    def update(self):
+        """ Fetch the subscribed data of the last simulation step """
+        if self.mesoscopic:
+            self.detector_vehicles = {}
+            for edge_id, results in traci.edge.getAllSubscriptionResults().items():
+                detectors = self.edge_detectors[edge_id]
+                vehicles = results[tc.LAST_STEP_VEHICLE_ID_LIST]
+                for i, detector_id in enumerate(detectors):     # round-robin, not by lane (see the class docstring)
+                    self.detector_vehicles[detector_id] = {tc.LAST_STEP_VEHICLE_ID_LIST: vehicles[i::len(detectors)]}
+        elif self.city_scale:
+            self.detector_vehicles = traci.lanearea.getAllSubscriptionResults()
+
+        if self.city_scale:
+            self.vehicle_data = {}
+            for vehicles in traci.junction.getAllContextSubscriptionResults().values():
+                self.vehicle_data.update(vehicles)
+
+    def get_vehicle_ids(self, detector_id):
+        if self.city_scale or self.mesoscopic:
+            return self.detector_vehicles[detector_id][tc.LAST_STEP_VEHICLE_ID_LIST]
+        return traci.lanearea.getLastStepVehicleIDs(detector_id)
+
+    def get_type(self, vehicle_id):
+        if vehicle_id in self.vehicle_data:
+            return self.vehicle_data[vehicle_id][tc.VAR_TYPE]
+        return traci.vehicle.getTypeID(vehicle_id)
+
+    def get_waiting_time(self, vehicle_id):
+        if vehicle_id in self.vehicle_data:
+            return self.vehicle_data[vehicle_id][tc.VAR_WAITING_TIME]
+        return traci.vehicle.getWaitingTime(vehicle_id)
@@ -18,17 +18,26 @@ from collections import defaultdict
 # Parallel Env
 from pettingzoo import ParallelEnv
 from pettingzoo.utils import agent_selector, wrappers
-from stable_baselines3.common.vec_env import VecNormalize
 import supersuit as ss
 
 from typing import Union
 from copy import copy
 from sumo_config.sumo_utils import generate_route_file
 from marl_tls.smart_tls import SmartTLS
+from marl_tls.observation_stack import ObservationStack
+from marl_tls.rollout_recorder import RolloutRecorder
+from marl_tls.detector_index import DetectorIndex
+from marl_tls.traci_trace import TraceRecorder, TraceReplayer
 
 PRIVATE_TRANSPORT_WEIGHT = 1
 PUBLIC_TRANSPORT_WEIGHT = 5
 
+## SUMO options of each simulation fidelity (the traffic lights must control the mesoscopic junctions)
+FIDELITY_OPTIONS = {
+    "micro": [],
+    "meso": ["--mesosim", "true", "--meso-junction-control", "true"],
+}
+
 from stable_baselines3.common.env_checker import check_env
 from pettingzoo.test import parallel_api_test
 
@@ -45,11 +54,23 @@ class TLSEnv(ParallelEnv):
         end=None,                   # Simulation end time
         render_mode=None,           # None or "human" for visualization
         simulation_path="cross/cross",  # Name of the simulation
-        simulation_label="AveiroCity"   # Label for traci track communication
+        simulation_label="AveiroCity",  # Label for traci track communication
+        normalize_observations=False,   # Running mean/variance normalization of the observations
+        stack_frames=1,                 # Number of stacked observation frames
+        observation_stats=None,         # File with the normalization statistics to load
+        update_observation_stats=True,  # Keep updating the normalization statistics (False for testing)
+        city_scale=False,               # Fetch the detector data with per-junction TraCI subscriptions
+        public_transport_weight=PUBLIC_TRANSPORT_WEIGHT,    # Weight of the public transport in the observations and reward
+        fidelity="micro",               # "micro" or "meso" (faster mesoscopic simulation, e.g. for pre-training)
+        phase_check_interval=0,         # Steps between the checks of the local TLS phases against SUMO (0: never, for debugging)
+        record_trace=None,              # File to record every TraCI request and response (see marl_tls/traci_trace.py)
+        replay_trace=None               # Trace file to replay instead of running SUMO (same env arguments and actions as the recording)
         ):
         """ Initialize the environment """
         assert render_mode is None or render_mode in self.metadata["render_modes"]
+        assert fidelity in FIDELITY_OPTIONS
         self.render_mode = render_mode
+        self.fidelity = fidelity
         
         ## Start traffic simulation
         self.simulation_path = simulation_path
@@ -57,10 +78,15 @@ class TLSEnv(ParallelEnv):
         self.traffic_scale = traffic_scale
         self.episode_traffic_scale = 0
         
+        ## TraCI trace recording/replay
+        self.trace_recorder = TraceRecorder(record_trace) if record_trace is not None else None
+        self.trace_replayer = TraceReplayer(replay_trace) if replay_trace is not None else None
+        
         self.sumo_start(hidden=True) # To get simulation data (e.g. detectors, tls, etc)
         self.end = end if end != None else traci.simulation.getEndTime()
         
         self.list_tls_id = [tls_id for tls_id in traci.trafficlight.getIDList() if tls_id.startswith("TLS")]
+        self.detector_index = DetectorIndex(self.list_tls_id, city_scale=city_scale, mesoscopic=fidelity == "meso")   # one pass over the detectors
         
         self.list_tls = {
             tls_id: SmartTLS(
@@ -68,10 +94,29 @@ class TLSEnv(ParallelEnv):
                 delta_time=delta_time,
                 min_phase_time=min_phase_time,
                 max_phase_time=max_phase_time,
-                yellow_time=yellow_time
+                yellow_time=yellow_time,
+                detector_index=self.detector_index,
+                public_transport_weight=public_transport_weight,
+                phase_check_interval=phase_check_interval
             ) for tls_id in self.list_tls_id
         }
                 
+        ## Observation normalization and frame stacking
+        self.observation_stack = None
+        if normalize_observations or stack_frames > 1:
+            self.observation_stack = ObservationStack(
+                {tls_id: tls.observation_space for tls_id, tls in self.list_tls.items()},
+                normalize=normalize_observations,
+                stack_frames=stack_frames
+            )
+            if observation_stats is not None:
+                self.observation_stack.load(observation_stats)
+            self.observation_stack.training = update_observation_stats
+                
+        ## Rollout recording (raw observations of the previous step)
+        self.recorder = None
+        self.last_observations = None
+                
         ## Mandatory for ParallelEnv
         self.possible_agents = self.list_tls_id[:]
         self.agents = self.list_tls_id[:]  
@@ -96,6 +141,9 @@ class TLSEnv(ParallelEnv):
         self.current_step = 0
         self.delta_time = delta_time
         
+        ## Agents whose action will be used in the next step (the others are locked)
+        self.decision_agents = self.list_tls_id[:]
+        
         ## Cyclic stepping through the agents list
         self._agent_selector = agent_selector(self.list_tls_id) 
         self._agent_selection = self._agent_selector.next()
@@ -113,6 +161,7 @@ class TLSEnv(ParallelEnv):
         
         vec_env = ss.pettingzoo_env_to_vec_env_v1(env)
         vec_env = ss.concat_vec_envs_v1(vec_env, 1, base_class="stable_baselines3")
+        vec_env.tls_env = vec_env.venv.vec_envs[0].par_env.unwrapped    # the vectorized env works on a copy
         return vec_env
     
     def sumo_start(self, hidden=False):
@@ -120,6 +169,10 @@ class TLSEnv(ParallelEnv):
 
         self.episode_traffic_scale = self.traffic_scale if self.traffic_scale != None else random.uniform(1,3.5)
         
+        if self.trace_replayer is not None:
+            self.trace_replayer.connect(self.simulation_label)
+            return
+        
         binary = checkBinary("sumo-gui") if self.render_mode == "human" and not hidden else checkBinary("sumo")
         
         start_input = [
@@ -128,7 +181,7 @@ class TLSEnv(ParallelEnv):
             "--no-step-log", "true", 
             "--no-warnings", "true",
             "--scale", str(self.episode_traffic_scale),
-        ]
+        ] + FIDELITY_OPTIONS[self.fidelity]
         
         if self.render_mode == "human" and not hidden:
             start_input.extend([
@@ -137,12 +190,17 @@ class TLSEnv(ParallelEnv):
                 "--device.emissions.probability", "0.10"
             ])
         else:
-            generate_route_file("sumo_config/" + self.simulation_path + ".rou.xml") # TODO: --random with seed!
+            # Written aside and renamed, so parallel environments never read a partial file
+            route_file = "sumo_config/" + self.simulation_path + ".rou.xml"
+            generate_route_file(route_file + "." + self.simulation_label) # TODO: --random with seed!
+            os.replace(route_file + "." + self.simulation_label, route_file)
             start_input.extend([
                 "--quit-on-end", "true"
             ])
         
         traci.start(start_input, label=self.simulation_label)
+        if self.trace_recorder is not None:
+            self.trace_recorder.attach(self.simulation_label)
     
     def _get_accumulated_waiting_time(self):
         """ Get the accumulated waiting time of the vehicles for all traffic lights """
@@ -150,9 +208,9 @@ class TLSEnv(ParallelEnv):
         return [sum(x) for x in zip(*acumulated_waiting_times)] # [private_wt, public_wt]
     
     def _apply_actions(self, actions: Union[dict, int]):
-        """ Apply the actions to the traffic lights """
-        for tls_id, action in actions.items():
-            tls = self.list_tls[tls_id]
+        """ Apply the actions to the traffic lights (agents missing from `actions` must be locked) """
+        for tls_id, tls in self.list_tls.items():
+            action = actions.get(tls_id, 0)
             
             ## Update agent counters
             if not tls.action_available:
@@ -171,6 +229,10 @@ class TLSEnv(ParallelEnv):
             if tls.action_available and self.current_step % self.delta_time == 0:
                 tls._go_to_phase(action * 2)   # Mapping the action to the phase
     
+    def _get_decision_agents(self):
+        """ Get the agents that need a decision in the next step """
+        return [tls_id for tls_id, tls in self.list_tls.items() if tls.needs_decision(self.current_step)]
+    
     def _is_terminal(self):
         """ Check if the environment is in a terminal state """
         return self.current_step >= self.end # every tls has the same termination condition
@@ -181,6 +243,7 @@ class TLSEnv(ParallelEnv):
         traci.close()
         
         self.sumo_start()
+        self.detector_index.subscribe()
         
         observations = {}
         infos = {}
@@ -190,24 +253,65 @@ class TLSEnv(ParallelEnv):
             observations[tls.tls_id] = observation
             infos[tls.tls_id] = info
         
+        self.last_observations = observations
+        if self.observation_stack is not None:
+            observations = self.observation_stack.reset(observations)
+        
         self.current_step = 0
         self._agent_selection = self._agent_selector.reset()
         
+        self.decision_agents = self._get_decision_agents()
+        decision_agents = set(self.decision_agents)
+        for tls_id in self.list_tls_id:
+            infos[tls_id]["needs_decision"] = tls_id in decision_agents
+        
         return observations, infos
 
-    def step(self, actions: Union[dict, int]):
-        ## Apply actions
+    def advance(self, actions: Union[dict, int]):
+        """ Apply the actions and step the simulation, without collecting observations nor rewards """
+        # PipelinedVecEnv._step_env runs the same steps with an asynchronous simulationStep
         self._apply_actions(actions)
         
         traci.simulationStep()
+        self._end_simulation_step()
+
+    def _end_simulation_step(self):
+        """ Bookkeeping after each simulation step """
         self.current_step += 1
+        for tls in self.list_tls.values():
+            tls.on_simulation_step()
+
+    def step(self, actions: Union[dict, int]):
+        ## Apply actions and step the simulation
+        self.advance(actions)
+        return self._collect_step(actions)
+
+    def _collect_step(self, actions: Union[dict, int]):
+        """ Observations, rewards and infos of the simulation step that was just made """
+        self.detector_index.update()
         
         ## Collect step information
         terminations = {tls.tls_id: self._is_terminal() for tls in self.list_tls.values()} 
         truncations = {tls.tls_id: False for tls in self.list_tls.values()} # Not used      
         rewards = {tls.tls_id: tls._get_reward() for tls in self.list_tls.values()}
-        observations = {tls.tls_id: tls._get_observation() for tls in self.list_tls.values()}
+        raw_observations = {tls.tls_id: tls._get_observation() for tls in self.list_tls.values()}
         infos = {tls.tls_id: tls._get_info() for tls in self.list_tls.values()}
+        
+        ## Agents that will need a decision in the next step (the actions of the others are discarded)
+        used_actions = set(self.decision_agents)
+        self.decision_agents = self._get_decision_agents()
+        decision_agents = set(self.decision_agents)
+        for tls_id in self.list_tls_id:
+            infos[tls_id]["needs_decision"] = tls_id in decision_agents
+        
+        if self.recorder is not None:
+            recorded_actions = {tls_id: action for tls_id, action in actions.items() if tls_id in used_actions}    # locked agents: -1
+            self.recorder.record(self.last_observations, recorded_actions, rewards, terminations, infos)
+        self.last_observations = raw_observations
+        
+        observations = raw_observations
+        if self.observation_stack is not None:
+            observations = self.observation_stack.step(raw_observations)
 
         return observations, rewards, terminations, truncations, infos
     
@@ -221,16 +325,41 @@ class TLSEnv(ParallelEnv):
     # IMPORTANT: If your spaces change over time, remove this lines (disable caching).
     @functools.lru_cache(maxsize=None)
     def observation_space(self, agent):
+        if self.observation_stack is not None:
+            return self.observation_stack.observation_spaces[agent]
         return self.list_tls[agent].observation_space
 
     @functools.lru_cache(maxsize=None)
     def action_space(self, agent):
         return self.list_tls[agent].action_space
 
+    def save_observation_stats(self, path):
+        """ Save the observation normalization statistics (e.g. next to the model zip) """
+        if self.observation_stack is not None:
+            self.observation_stack.save(path)
+
+    def start_recording(self, directory, chunk_size=4096):
+        """ Record the transitions of every agent into a memory-mapped dataset (see RolloutDataset) """
+        self.stop_recording()
+        self.recorder = RolloutRecorder(
+            directory,
+            {tls_id: tls.observation_space for tls_id, tls in self.list_tls.items()},
+            chunk_size=chunk_size
+        )
+    
+    def stop_recording(self):
+        """ Flush the recorded dataset """
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
     def render(self):
         pass
     
     def close(self):
+        self.stop_recording()
         traci.close()
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
     
     
\ No newline at end of file
@@ -0,0 +1,60 @@
+import json
+import zlib
+import base64
+from bisect import bisect_right
+
+## Lower bounds of the queue weight bins after the first one: [0, 1), [1, 2), [2, 4), ..., [16, inf)
+DEFAULT_BOUNDARIES = [1, 2, 4, 7, 11, 16]
+MAX_QUEUE_WEIGHT = 30       # Upper bound of the SmartTLS queue weights
+
+
+class LookupTablePolicy:
+    """
+    Policy compiled into one lookup table per TLS (see marl_tls/policy_compiler.py): constant-time decisions
+    from the SmartTLS observations with the standard library only (no ML runtime).
+    Table index: queue weight bin of every detector (first detector most significant), phase, action available.
+    """
+
+    def __init__(self, path):
+        """ Load the tables of a compiled policy file """
+        with open(path) as file:
+            data = json.load(file)
+        self.boundaries = data["boundaries"]
+        self.num_bins = len(self.boundaries) + 1
+        self.tables = {
+            tls_id: (tls["num_detectors"], tls["num_phases"], zlib.decompress(base64.b64decode(tls["table"])))
+            for tls_id, tls in data["tls"].items()
+        }
+
+    def index(self, tls_id, observation):
+        """ Table index of an observation: [queue_weight * num_detectors, current_phase, action_available] """
+        num_detectors, num_phases, _ = self.tables[tls_id]
+        index = 0
+        for weight in observation[:num_detectors]:
+            index = index * self.num_bins + bisect_right(self.boundaries, weight)
+        index = index * num_phases + int(observation[num_detectors])
+        return index * 2 + int(observation[num_detectors + 1])
+
+    def act(self, tls_id, observation):
+        """ Action of one TLS """
+        return self.tables[tls_id][2][self.index(tls_id, observation)]
+
+    def act_all(self, observations):
+        """ Actions of every TLS ({tls_id: observation} -> {tls_id: action}) """
+        return {tls_id: self.act(tls_id, observation) for tls_id, observation in observations.items()}
+
+
+def save_lookup_policy(path, tables, boundaries=DEFAULT_BOUNDARIES):
+    """ Save compiled tables ({tls_id: (num_detectors, num_phases, bytes)}) in the format read by LookupTablePolicy """
+    data = {
+        "boundaries": list(boundaries),
+        "tls": {
+            tls_id: {
+                "num_detectors": num_detectors,
+                "num_phases": num_phases,
+                "table": base64.b64encode(zlib.compress(table, 9)).decode("ascii"),
+            } for tls_id, (num_detectors, num_phases, table) in tables.items()
+        },
+    }
+    with open(path, "w") as file:
+        json.dump(data, file)
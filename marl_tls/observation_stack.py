@@ -0,0 +1,104 @@
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.running_mean_std import RunningMeanStd
+
+
+class ObservationStack:
+    """
+    Running mean/variance normalization and k-frame stacking of the SmartTLS observations.
+    The frames of every agent share one preallocated ring buffer (one column range per agent).
+    """
+
+    def __init__(
+        self,
+        observation_spaces,         # {tls_id: Box} of the raw SmartTLS observations
+        normalize=False,            # Running mean/variance normalization
+        stack_frames=1,             # Number of stacked frames
+        clip_obs=10.0,              # Clipping of the normalized observations
+        epsilon=1e-8
+        ):
+        """ Initialize the shared buffers """
+        assert stack_frames >= 1
+        self.normalize = normalize
+        self.stack_frames = stack_frames
+        self.clip_obs = clip_obs
+        self.epsilon = epsilon
+        self.training = True
+
+        ## Column range of each agent in the shared buffers
+        self.slices = {}
+        start = 0
+        for tls_id, space in observation_spaces.items():
+            self.slices[tls_id] = slice(start, start + space.shape[0])
+            start += space.shape[0]
+        self.size = start
+
+        ## Ring buffer written twice, so the last `stack_frames` frames are always a contiguous window
+        self.frames = np.zeros((2 * stack_frames, self.size), dtype=np.float32)
+        self.frame = np.zeros(self.size, dtype=np.float32)
+        self.pos = 0
+
+        self.obs_rms = RunningMeanStd(shape=(self.size,))
+
+        ## Observation spaces of the processed observations
+        self.observation_spaces = {}
+        for tls_id, space in observation_spaces.items():
+            if normalize:
+                low = np.full(space.shape[0] * stack_frames, -clip_obs, dtype=np.float32)
+                high = np.full(space.shape[0] * stack_frames, clip_obs, dtype=np.float32)
+            else:
+                low = np.tile(space.low, stack_frames).astype(np.float32)
+                high = np.tile(space.high, stack_frames).astype(np.float32)
+            self.observation_spaces[tls_id] = spaces.Box(low=low, high=high, dtype=np.float32)
+
+    def _push(self, observations):
+        """ Write the (normalized) observations of all agents as the newest frame """
+        for tls_id, observation in observations.items():
+            self.frame[self.slices[tls_id]] = observation
+
+        if self.normalize:
+            if self.training:
+                self.obs_rms.update(self.frame[None, :])
+            np.subtract(self.frame, self.obs_rms.mean, out=self.frame)
+            np.divide(self.frame, np.sqrt(self.obs_rms.var + self.epsilon), out=self.frame)
+            np.clip(self.frame, -self.clip_obs, self.clip_obs, out=self.frame)
+
+        self.frames[self.pos] = self.frame
+        self.frames[self.pos + self.stack_frames] = self.frame
+        self.pos = (self.pos + 1) % self.stack_frames
+
+    def _stacked(self):
+        """ Stacked observation of each agent (oldest frame first) """
+        window = self.frames[self.pos:self.pos + self.stack_frames]
+        return {tls_id: window[:, columns].flatten() for tls_id, columns in self.slices.items()}
+
+    def reset(self, observations):
+        """ Start a new episode: every frame of the stack is the first observation """
+        self._push(observations)
+        self.frames[:] = self.frame
+        return self._stacked()
+
+    def step(self, observations):
+        """ Add the observations of a step and get the stacked ones """
+        self._push(observations)
+        return self._stacked()
+
+    def save(self, path):
+        """ Save the normalization statistics """
+        np.savez(
+            path,
+            mean=self.obs_rms.mean,
+            var=self.obs_rms.var,
+            count=self.obs_rms.count,
+            size=self.size,
+            stack_frames=self.stack_frames,
+        )
+
+    def load(self, path):
+        """ Load the normalization statistics """
+        with np.load(path) as data:
+            assert int(data["size"]) == self.size, "observation statistics do not match the simulation"
+            assert int(data["stack_frames"]) == self.stack_frames, "observation statistics do not match the frame stacking"
+            self.obs_rms.mean = data["mean"]
+            self.obs_rms.var = data["var"]
+            self.obs_rms.count = float(data["count"])
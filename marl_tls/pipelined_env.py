@@ -0,0 +1,176 @@
+import os
+import sys
+import struct
+import asyncio
+import numpy as np
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+import traci
+import traci.constants as tc
+from traci.exceptions import FatalTraCIError, TraCIException
+from stable_baselines3.common.vec_env import VecEnv
+from supersuit.utils.action_transforms.homogenize_ops import homogenize_spaces, homogenize_observations, dehomogenize_actions
+from marl_tls.env import TLSEnv
+
+
+async def _simulation_step(connection, loop):
+    """
+    Asynchronous Connection.simulationStep(): send the command, let the other coroutines run while SUMO
+    simulates, then read the answer (same checks and subscription updates as Connection.simulationStep).
+
+    TraCI has no asynchronous API, so this is the only place that uses the private internals of
+    traci.Connection (_lock, _pack, _string, _queue, _socket, _recvExact, _subscriptionMapping,
+    _readSubscription) of the traci version in requirements.txt. Check it against Connection.simulationStep and
+    Connection._sendCmd when upgrading SUMO.
+    """
+    with connection._lock:
+        packed = connection._pack("D", 0.)
+        connection._queue.append(tc.CMD_SIMSTEP)
+        connection._string += struct.pack("!BB", len(packed) + 2, tc.CMD_SIMSTEP) + packed
+        connection._socket.send(struct.pack("!i", len(connection._string) + 4) + connection._string)
+        connection._string = bytes()
+
+    readable = loop.create_future()
+    loop.add_reader(connection._socket.fileno(), lambda: readable.done() or readable.set_result(None))
+    try:
+        await readable
+    finally:
+        loop.remove_reader(connection._socket.fileno())
+
+    result = connection._recvExact()
+    if not result:
+        connection._socket.close()
+        connection._socket = None
+        raise FatalTraCIError("Connection closed by SUMO.")
+    connection._queue = []
+    prefix = result.read("!BBB")
+    err = result.readString()
+    if prefix[2] or err:
+        raise TraCIException(err, prefix[1])
+
+    for subscription_results in connection._subscriptionMapping.values():
+        subscription_results.reset()
+    for _ in range(result.readInt()):
+        connection._readSubscription(result)
+    connection.manageStepListeners(0)
+
+
+class PipelinedVecEnv(VecEnv):
+    """
+    Several TLSEnv simulations stepped together: the simulationStep command is sent to every SUMO
+    first, then the observations/rewards of each env are assembled as soon as its SUMO answers
+    (asyncio readers on the TraCI sockets), while the other simulations are still running.
+    The agents of all the envs are exposed as one SB3 VecEnv, padded as in `TLSEnv.get_vec_env`.
+    Needs the socket TraCI (not libsumo).
+    """
+
+    def __init__(self, num_envs=2, simulation_label="AveiroCity_pipe", **env_kwargs):
+        """ Start one TLSEnv (and SUMO) per env """
+        self.envs = [TLSEnv(simulation_label="%s%d" % (simulation_label, i), **env_kwargs) for i in range(num_envs)]
+        self.tls_env = self.envs[0]    # as in TLSEnv.get_vec_env (e.g. to save the observation statistics)
+
+        ## One set of normalization statistics updated by every env (the frames stay per env)
+        if self.tls_env.observation_stack is not None:
+            for env in self.envs[1:]:
+                env.observation_stack.obs_rms = self.tls_env.observation_stack.obs_rms
+        self.render_mode = None
+        self.loop = asyncio.new_event_loop()
+
+        ## Agents of every env (env index, tls_id) and their padded spaces
+        self.agents = [(env_idx, tls_id) for env_idx, env in enumerate(self.envs) for tls_id in env.possible_agents]
+        observation_space = homogenize_spaces([self.envs[i].observation_space(tls_id) for i, tls_id in self.agents])
+        action_space = homogenize_spaces([self.envs[i].action_space(tls_id) for i, tls_id in self.agents])
+        super().__init__(len(self.agents), observation_space, action_space)
+
+        self.actions = None
+
+    def _connection(self, env):
+        traci.switch(env.simulation_label)
+        return traci.getConnection(env.simulation_label)
+
+    def _stack(self, env_idx, observations):
+        env = self.envs[env_idx]
+        return [homogenize_observations(self.observation_space, observations[tls_id]) for tls_id in env.possible_agents]
+
+    def _reset_env(self, env_idx):
+        self._connection(self.envs[env_idx])
+        return self.envs[env_idx].reset()
+
+    def reset(self):
+        observations = []
+        self.reset_infos = []
+        for env_idx, env in enumerate(self.envs):
+            env_observations, env_infos = self._reset_env(env_idx)
+            observations.extend(self._stack(env_idx, env_observations))
+            self.reset_infos.extend(env_infos[tls_id] for tls_id in env.possible_agents)
+        return np.array(observations)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def _env_actions(self, env_idx):
+        env = self.envs[env_idx]
+        return {
+            tls_id: dehomogenize_actions(env.action_space(tls_id), int(action))
+            for (agent_env, tls_id), action in zip(self.agents, self.actions) if agent_env == env_idx
+        }
+
+    async def _step_env(self, env_idx):
+        """
+        TLSEnv.step of one env with an asynchronous simulation step: every env sends its simulationStep
+        before the first answer is awaited (asyncio.gather runs each coroutine up to its first await)
+        """
+        env = self.envs[env_idx]
+        actions = self._env_actions(env_idx)
+        connection = self._connection(env)
+        env._apply_actions(actions)
+        await _simulation_step(connection, self.loop)
+
+        # No await from here on: the global TraCI connection stays on this env
+        traci.switch(env.simulation_label)
+        env._end_simulation_step()
+        observations, rewards, terminations, truncations, infos = env._collect_step(actions)
+
+        dones = {tls_id: terminations[tls_id] or truncations[tls_id] for tls_id in env.possible_agents}
+        if all(dones.values()):
+            for tls_id in env.possible_agents:
+                infos[tls_id]["terminal_observation"] = homogenize_observations(self.observation_space, observations[tls_id])
+            observations, _ = env.reset()
+        return observations, rewards, dones, infos
+
+    async def _step_all(self):
+        return await asyncio.gather(*[self._step_env(env_idx) for env_idx in range(len(self.envs))])
+
+    def step_wait(self):
+        results = self.loop.run_until_complete(self._step_all())
+
+        observations, rewards, dones, infos = [], [], [], []
+        for env_idx, (env_observations, env_rewards, env_dones, env_infos) in enumerate(results):
+            observations.extend(self._stack(env_idx, env_observations))
+            for tls_id in self.envs[env_idx].possible_agents:
+                rewards.append(env_rewards[tls_id])
+                dones.append(env_dones[tls_id])
+                infos.append(env_infos[tls_id])
+        return np.array(observations), np.array(rewards, dtype=np.float32), np.array(dones), infos
+
+    def close(self):
+        for env in self.envs:
+            self._connection(env)
+            env.close()
+        self.loop.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.envs[self.agents[i][0]], attr_name) for i in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for i in self._get_indices(indices):
+            setattr(self.envs[self.agents[i][0]], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.envs[self.agents[i][0]], method_name)(*method_args, **method_kwargs) for i in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,76 @@
+import numpy as np
+from marl_tls.lookup_policy import DEFAULT_BOUNDARIES, MAX_QUEUE_WEIGHT
+
+MAX_TABLE_ENTRIES = 4000000     # Larger tables need fewer bins (or a TLS with fewer detectors)
+
+
+def bin_values(boundaries=DEFAULT_BOUNDARIES):
+    """ Queue weight evaluated for each bin: middle of its integer weights (the last bin ends at MAX_QUEUE_WEIGHT) """
+    lows = [0] + list(boundaries)
+    highs = [boundary - 1 for boundary in boundaries] + [MAX_QUEUE_WEIGHT]
+    return np.array([(low + max(high, low)) / 2 for low, high in zip(lows, highs)], dtype=np.float32)
+
+
+def model_actions(model, observations, num_actions):
+    """ Deterministic actions of the (padded) model, padded actions refer to action 0 (dehomogenize_actions) """
+    padded = np.zeros((len(observations), model.observation_space.shape[0]), dtype=np.float32)
+    padded[:, :observations.shape[1]] = observations
+    actions, _ = model.predict(padded, deterministic=True)
+    return np.where(actions < num_actions, actions, 0)
+
+
+def table_entries(num_detectors, num_phases, boundaries=DEFAULT_BOUNDARIES):
+    """ Number of entries of the lookup table of a TLS """
+    return (len(boundaries) + 1) ** num_detectors * num_phases * 2
+
+
+def compile_tls(model, num_detectors, num_phases, boundaries=DEFAULT_BOUNDARIES, batch_size=65536):
+    """ Lookup table (bytes, one action per index of LookupTablePolicy) of one TLS """
+    values = bin_values(boundaries)
+    shape = [len(values)] * num_detectors + [num_phases, 2]
+    num_entries = table_entries(num_detectors, num_phases, boundaries)
+    if num_entries > MAX_TABLE_ENTRIES:
+        raise ValueError(f"{num_entries} table entries for {num_detectors} detectors and {len(values)} bins (maximum {MAX_TABLE_ENTRIES})")
+
+    table = np.zeros(num_entries, dtype=np.uint8)
+    for start in range(0, num_entries, batch_size):
+        indices = np.arange(start, min(start + batch_size, num_entries))
+        coordinates = np.unravel_index(indices, shape)
+        observations = np.zeros((len(indices), num_detectors + 2), dtype=np.float32)
+        for detector in range(num_detectors):
+            observations[:, detector] = values[coordinates[detector]]
+        observations[:, num_detectors] = coordinates[num_detectors]
+        observations[:, num_detectors + 1] = coordinates[num_detectors + 1]
+        table[indices] = model_actions(model, observations, num_phases // 2)
+    return table.tobytes()
+
+
+def compile_policy(model, tls_shapes, boundaries=DEFAULT_BOUNDARIES):
+    """
+    Tables of the TLS with few enough detectors ({tls_id: (num_detectors, num_phases)} -> {tls_id: (num_detectors, num_phases, bytes)}),
+    and the entries of the skipped TLS ({tls_id: table entries}), which are left to the model
+    """
+    tables, skipped = {}, {}
+    for tls_id, (num_detectors, num_phases) in tls_shapes.items():
+        num_entries = table_entries(num_detectors, num_phases, boundaries)
+        if num_entries > MAX_TABLE_ENTRIES:
+            skipped[tls_id] = num_entries
+        else:
+            tables[tls_id] = (num_detectors, num_phases, compile_tls(model, num_detectors, num_phases, boundaries))
+    return tables, skipped
+
+
+def sample_agreement(model, policy, tls_shapes, samples=10000, seed=0):
+    """ Fraction of random observations (queue weights 0 to MAX_QUEUE_WEIGHT) where the table and the model agree, per TLS """
+    rng = np.random.default_rng(seed)
+    agreement = {}
+    for tls_id, (num_detectors, num_phases) in tls_shapes.items():
+        observations = np.concatenate([
+            rng.integers(0, MAX_QUEUE_WEIGHT + 1, (samples, num_detectors)),
+            rng.integers(0, num_phases, (samples, 1)),
+            rng.integers(0, 2, (samples, 1)),
+        ], axis=1)
+        network_actions = model_actions(model, observations.astype(np.float32), num_phases // 2)
+        table_actions = np.array([policy.act(tls_id, observation) for observation in observations.tolist()])
+        agreement[tls_id] = float(np.mean(network_actions == table_actions))
+    return agreement
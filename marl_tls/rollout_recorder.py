@@ -0,0 +1,145 @@
+import os
+import json
+import numpy as np
+
+METADATA_FILE = "metadata.json"
+FIELDS = ["obs", "action", "reward", "done", "info"]
+
+
+def _flatten_info(info):
+    """ Numeric values of an info dict as a flat list (sorted by key) """
+    values = []
+    for key in sorted(info):
+        values.extend(np.ravel(info[key]).tolist())
+    return values
+
+
+class RolloutRecorder:
+    """
+    Record the (obs, action, reward, done, info) transitions of every agent into chunked,
+    memory-mapped `.npy` files: <directory>/<tls_id>/<chunk>/<field>.npy
+    """
+
+    def __init__(
+        self,
+        directory,                  # Output directory of the dataset
+        observation_spaces,         # {tls_id: Box} of the recorded observations
+        chunk_size=4096             # Transitions per chunk file
+        ):
+        """ Initialize the recorder """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.observation_spaces = observation_spaces
+
+        self.info_keys = None
+        self.chunks = {tls_id: [] for tls_id in observation_spaces}    # tls_id: [num_transitions per chunk]
+        self.arrays = {}                                                # tls_id: {field: memmap} of the open chunk
+        self.positions = {tls_id: 0 for tls_id in observation_spaces}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_chunk(self, tls_id, info_size):
+        """ Create the memory-mapped files of a new chunk """
+        chunk_dir = os.path.join(self.directory, tls_id, "%05d" % len(self.chunks[tls_id]))
+        os.makedirs(chunk_dir, exist_ok=True)
+
+        shapes = {
+            "obs": ((self.chunk_size, *self.observation_spaces[tls_id].shape), self.observation_spaces[tls_id].dtype),
+            "action": ((self.chunk_size,), np.int64),
+            "reward": ((self.chunk_size,), np.float32),
+            "done": ((self.chunk_size,), np.bool_),
+            "info": ((self.chunk_size, info_size), np.float32),
+        }
+        self.arrays[tls_id] = {
+            field: np.lib.format.open_memmap(os.path.join(chunk_dir, field + ".npy"), mode="w+", dtype=dtype, shape=shape)
+            for field, (shape, dtype) in shapes.items()
+        }
+        self.chunks[tls_id].append(0)
+        self.positions[tls_id] = 0
+
+    def _close_chunk(self, tls_id):
+        """ Flush the open chunk of an agent and add it to the metadata """
+        for array in self.arrays.pop(tls_id).values():
+            array.flush()
+        self._write_metadata()
+
+    def _write_metadata(self):
+        """ Atomically replace the metadata with the finalized chunks (a crashed recording stays readable) """
+        metadata = {
+            "chunk_size": self.chunk_size,
+            "info_keys": self.info_keys,
+            "chunks": {tls_id: lengths[:-1] if tls_id in self.arrays else lengths for tls_id, lengths in self.chunks.items()},
+        }
+        path = os.path.join(self.directory, METADATA_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(metadata, file, indent=4)
+        os.replace(path + ".tmp", path)
+
+    def record(self, observations, actions, rewards, terminations, infos):
+        """ Append one transition per agent (missing actions are stored as -1: TLSEnv leaves out the locked agents) """
+        for tls_id, observation in observations.items():
+            info = _flatten_info(infos[tls_id])
+            if self.info_keys is None:
+                self.info_keys = sorted(infos[tls_id])
+
+            if tls_id not in self.arrays:
+                self._open_chunk(tls_id, len(info))
+
+            arrays = self.arrays[tls_id]
+            pos = self.positions[tls_id]
+            arrays["obs"][pos] = observation
+            arrays["action"][pos] = actions.get(tls_id, -1)
+            arrays["reward"][pos] = rewards[tls_id]
+            arrays["done"][pos] = terminations[tls_id]
+            arrays["info"][pos] = info
+
+            self.positions[tls_id] = pos + 1
+            self.chunks[tls_id][-1] = pos + 1
+            if pos + 1 == self.chunk_size:
+                self._close_chunk(tls_id)
+
+    def close(self):
+        """ Flush the open chunks and write the dataset metadata """
+        for tls_id in list(self.arrays):
+            self._close_chunk(tls_id)
+        self._write_metadata()
+
+
+class RolloutDataset:
+    """
+    Stream a dataset written by `RolloutRecorder`, one memory-mapped chunk at a time
+    (only the pages that are read are loaded in RAM).
+    """
+
+    def __init__(self, directory):
+        """ Read the dataset metadata """
+        self.directory = directory
+        with open(os.path.join(directory, METADATA_FILE), "r") as file:
+            metadata = json.load(file)
+
+        self.chunk_size = metadata["chunk_size"]
+        self.info_keys = metadata["info_keys"]
+        self.chunks = metadata["chunks"]
+        self.agents = list(self.chunks)
+
+    def __len__(self):
+        return sum(sum(lengths) for lengths in self.chunks.values())
+
+    def iter_chunks(self, tls_id=None):
+        """ Yield (tls_id, {field: read-only memmap}) for every chunk """
+        for agent in ([tls_id] if tls_id is not None else self.agents):
+            for chunk, length in enumerate(self.chunks[agent]):
+                chunk_dir = os.path.join(self.directory, agent, "%05d" % chunk)
+                yield agent, {
+                    field: np.load(os.path.join(chunk_dir, field + ".npy"), mmap_mode="r")[:length]
+                    for field in FIELDS
+                }
+
+    def iter_batches(self, batch_size, tls_id=None, shuffle=False):
+        """ Yield (tls_id, {field: array}) batches (shuffled inside each chunk) """
+        for agent, chunk in self.iter_chunks(tls_id):
+            length = len(chunk["reward"])
+            indices = np.random.permutation(length) if shuffle else np.arange(length)
+            for start in range(0, length, batch_size):
+                batch = np.sort(indices[start:start + batch_size])
+                yield agent, {field: np.asarray(array[batch]) for field, array in chunk.items()}
@@ -1,5 +1,6 @@
 import os
 import sys
+import warnings
 import numpy as np
 from gymnasium import spaces
 if 'SUMO_HOME' in os.environ:
@@ -10,6 +11,7 @@ else:
 import traci
 from collections import defaultdict
 from operator import add;
+from marl_tls.detector_index import DetectorIndex
 
 PRIVATE_TRANSPORT_WEIGHT = 1
 PUBLIC_TRANSPORT_WEIGHT = 5
@@ -22,7 +24,10 @@ class SmartTLS:
         delta_time=5,               # Time steps to wait before changing the phase
         min_phase_time=5,           # Minimum time for a phase
         max_phase_time=120,         # Maximum time for a phase
-        yellow_time=5               # Yellow time
+        yellow_time=5,              # Yellow time
+        detector_index=None,        # DetectorIndex shared by the agents (built for this TLS if None)
+        public_transport_weight=PUBLIC_TRANSPORT_WEIGHT,    # Weight of the public transport in the observations and reward
+        phase_check_interval=0      # Steps between the checks of the local phase against SUMO (0: never, for debugging)
         ):
         """ Initialize the agent """
         assert tls_id != None
@@ -32,9 +37,11 @@ class SmartTLS:
         self.min_phase_time = min_phase_time
         self.max_phase_time = max_phase_time
         self.yellow_time = yellow_time
+        self.public_transport_weight = public_transport_weight
 
         ## Detector ID: TLS<tls_num>_Det<detector_num>
-        self.lane_detectors = [detector_id for detector_id in traci.lanearea.getIDList() if detector_id.startswith(tls_id)]
+        self.detector_index = detector_index if detector_index is not None else DetectorIndex([tls_id])
+        self.lane_detectors = self.detector_index.detectors[tls_id]
         self.num_detectors = len(self.lane_detectors)
 
         ## Reward control
@@ -44,7 +51,10 @@ class SmartTLS:
         
         ## Control parameters
         self.max_phase_time = max_phase_time    # TODO: not allow to exceed this value in a phase time
-        self.num_phases = len(traci.trafficlight.getAllProgramLogics(tls_id)[0].getPhases())
+        program_id = traci.trafficlight.getProgram(tls_id)    # the running program, not the first one defined
+        logic = next(logic for logic in traci.trafficlight.getAllProgramLogics(tls_id) if logic.programID == program_id)
+        self.phase_durations = [phase.duration for phase in logic.getPhases()]
+        self.num_phases = len(self.phase_durations)
         self.num_actions = int(self.num_phases / 2)
         
         ## Lock control
@@ -53,9 +63,17 @@ class SmartTLS:
         self.current_lock_time = 0
         self.action_available = True
         
-        ## Phase control
+        ## Phase control: local copy of the SUMO program state (the env drives every phase change)
         # .current_phase  @property
         self.aimed_phase = None
+        self.phase = 0
+        self.time = 0               # simulation time of the local state
+        self.phase_end = 0          # simulation time of the next program switch
+        self.step_length = traci.simulation.getDeltaT()
+        self.phase_check_interval = phase_check_interval
+        self.steps = 0
+        self.phase_mismatches = 0   # checks where the local phase differed from SUMO (resynchronized)
+        self._sync_phase()
         
         ## Observations
         self.observation_space = spaces.Box(
@@ -69,13 +87,44 @@ class SmartTLS:
      
     @property
     def current_phase(self):
-        return traci.trafficlight.getPhase(self.tls_id)
+        return self.phase
+
+    def _sync_phase(self):
+        """ Read the phase state from SUMO """
+        self.phase = traci.trafficlight.getPhase(self.tls_id)
+        self.time = traci.simulation.getTime()
+        self.phase_end = traci.trafficlight.getNextSwitch(self.tls_id)
+
+    def on_simulation_step(self):
+        """ Advance the local phase state by one simulation step (phases whose duration expired move on, as in SUMO) """
+        self.time += self.step_length
+        while self.time > self.phase_end:    # SUMO switches in the step that starts at phase_end
+            self.phase = (self.phase + 1) % self.num_phases
+            self.phase_end += self.phase_durations[self.phase]
+
+        self.steps += 1
+        if self.phase_check_interval and self.steps % self.phase_check_interval == 0:
+            sumo_phase = traci.trafficlight.getPhase(self.tls_id)
+            if sumo_phase != self.phase:
+                warnings.warn(f"{self.tls_id}: local phase {self.phase} != SUMO phase {sumo_phase} at time {self.time}, resynchronizing")
+                self.phase_mismatches += 1
+                self._sync_phase()
+    
+    def needs_decision(self, step):
+        """ Check if the action applied at `step` will be used (locked agents discard their actions) """
+        if step % self.delta_time != 0:
+            return False
+        if self.action_available:
+            return True
+        return self.current_lock_time + 1 > self.lock_time   # lock is released in this step
      
     def agent_reset(self):
         """ Reset the agent """
         self.current_lock_time = 0
         self.action_available = True
         self.aimed_phase = None
+        self._sync_phase()
+        self.steps = 0
         
         self.last_reward = 0
         self.accumulated_waiting_times = defaultdict(lambda: defaultdict(int))
@@ -91,13 +140,13 @@ class SmartTLS:
         weight_list = []
         
         for detector_id in self.lane_detectors:
-            vehicles = traci.lanearea.getLastStepVehicleIDs(detector_id)
+            vehicles = self.detector_index.get_vehicle_ids(detector_id)
             weight = 0
             for veh in vehicles:
-                veh_type = traci.vehicle.getTypeID(veh)
+                veh_type = self.detector_index.get_type(veh)
                 
                 if veh_type == "pt_bus":
-                    weight += PUBLIC_TRANSPORT_WEIGHT
+                    weight += self.public_transport_weight
                 else:
                     weight += PRIVATE_TRANSPORT_WEIGHT
             
@@ -120,7 +169,9 @@ class SmartTLS:
     
     def _set_phase(self, phase):
         """ Set the phase of the traffic light """
-        traci.trafficlight.setPhase(self.tls_id, int(phase))    
+        traci.trafficlight.setPhase(self.tls_id, int(phase))
+        self.phase = int(phase)
+        self.phase_end = self.time + self.phase_durations[self.phase]
     
     def _go_to_phase(self, phase): 
         """ **Asynchronously** go to the phase - the pending phase will be the aimed phase """  
@@ -137,9 +188,9 @@ class SmartTLS:
         total_accumulated_waiting = [0, 0] # [private_wt, public_wt]
         
         for detector_id in self.lane_detectors:
-            for vehicle_id in traci.lanearea.getLastStepVehicleIDs(detector_id):
-                waiting_time = traci.vehicle.getWaitingTime(vehicle_id)
-                vehicleType = traci.vehicle.getTypeID(vehicle_id)
+            for vehicle_id in self.detector_index.get_vehicle_ids(detector_id):
+                waiting_time = self.detector_index.get_waiting_time(vehicle_id)
+                vehicleType = self.detector_index.get_type(vehicle_id)
                 
                 if waiting_time == 0: # vehicle is not waiting
                     # Safely delete from currently_waiting
@@ -165,7 +216,7 @@ class SmartTLS:
     def _get_reward(self):
         """ Get the reward of the environment """
         # Apply weights to prioritize public transport
-        total_accumulated_waiting = np.array(self._get_accumulated_waiting_time()) * np.array([PRIVATE_TRANSPORT_WEIGHT, PUBLIC_TRANSPORT_WEIGHT])
+        total_accumulated_waiting = np.array(self._get_accumulated_waiting_time()) * np.array([PRIVATE_TRANSPORT_WEIGHT, self.public_transport_weight])
         
         temp = np.sum(total_accumulated_waiting) / 100
         reward = self.last_reward - temp
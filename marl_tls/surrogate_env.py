@@ -0,0 +1,469 @@
+import os
+import sys
+import json
+import random
+import numpy as np
+from gymnasium import spaces
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+import traci
+from pettingzoo import ParallelEnv
+from stable_baselines3.common.vec_env import VecEnv
+from supersuit.utils.action_transforms.homogenize_ops import homogenize_spaces
+from marl_tls.env import TLSEnv
+from marl_tls.smart_tls import PRIVATE_TRANSPORT_WEIGHT, PUBLIC_TRANSPORT_WEIGHT
+
+## Per-detector rates measured by `calibrate`
+DETECTOR_RATES = ["car_arrivals", "bus_arrivals", "green_discharge", "red_discharge", "green_halting", "red_halting", "capacity"]
+
+
+def calibrate(
+    simulation_path="cross/cross",
+    traffic_scale=2.5,              # Scale of the calibration run (the surrogate rates scale linearly)
+    end=1800,                       # Simulation end time of the calibration run
+    seed=0,                         # Seed of the random actions
+    output=None,                    # JSON file to save the calibration
+    city_scale=False
+    ):
+    """
+    Measure the queue model of every detector of a SUMO scenario: one microscopic episode with random actions.
+      - car/bus arrivals: vehicles entering the detector per second
+      - green/red discharge: vehicles leaving the (non-empty) detector per second, with/without green
+      - green/red halting: fraction of the vehicles on the detector that are stopped, with/without green
+      - capacity: most vehicles seen on the detector
+    The phase durations of the programs and the detectors served by each phase are saved too.
+    """
+    env = TLSEnv(simulation_path=simulation_path, traffic_scale=traffic_scale, end=end, simulation_label="Surrogate_calibration", city_scale=city_scale)
+    env.reset()
+    rng = random.Random(seed)
+
+    ## Phases of the programs and detectors served by each phase (green lanes, as in BaselineController)
+    tls_data = {}
+    for tls_id, tls in env.list_tls.items():
+        phases = traci.trafficlight.getAllProgramLogics(tls_id)[0].getPhases()
+        links = traci.trafficlight.getControlledLinks(tls_id)
+        detector_lanes = [traci.lanearea.getLaneID(detector_id) for detector_id in tls.lane_detectors]
+        served = []
+        for phase in phases:
+            green_lanes = {link[0][0] for link, signal in zip(links, phase.state) if link and signal in "Gg"}
+            served.append([int(lane in green_lanes) for lane in detector_lanes])
+        tls_data[tls_id] = {
+            "detectors": tls.lane_detectors[:],
+            "phase_durations": [max(int(round(phase.duration)), 1) for phase in phases],
+            "served": served,
+        }
+
+    ## Counters per detector
+    counters = {
+        detector_id: dict(steps=0, cars=0, buses=0, green_steps=0, green_departures=0, red_steps=0, red_departures=0,
+                          green_vehicles=0, green_halting=0, red_vehicles=0, red_halting=0, capacity=0)
+        for tls_id in env.list_tls_id for detector_id in tls_data[tls_id]["detectors"]
+    }
+    previous = {detector_id: set() for detector_id in counters}
+    vehicle_types = {}
+
+    while env.current_step < end:
+        env.advance({tls_id: rng.randrange(tls.num_actions) for tls_id, tls in env.list_tls.items()})
+        env.detector_index.update()
+
+        for tls_id, tls in env.list_tls.items():
+            served = tls_data[tls_id]["served"][tls.current_phase]
+            for detector_idx, detector_id in enumerate(tls.lane_detectors):
+                counter = counters[detector_id]
+                vehicles = set(env.detector_index.get_vehicle_ids(detector_id))
+                green = "green" if served[detector_idx] else "red"
+
+                for vehicle_id in vehicles - previous[detector_id]:
+                    if vehicle_id not in vehicle_types:
+                        vehicle_types[vehicle_id] = env.detector_index.get_type(vehicle_id)
+                    counter["buses" if vehicle_types[vehicle_id] == "pt_bus" else "cars"] += 1
+                if previous[detector_id]:
+                    counter[green + "_steps"] += 1
+                    counter[green + "_departures"] += len(previous[detector_id] - vehicles)
+
+                counter[green + "_vehicles"] += len(vehicles)
+                counter[green + "_halting"] += sum(1 for vehicle_id in vehicles if env.detector_index.get_waiting_time(vehicle_id) > 0)
+                counter["steps"] += 1
+                counter["capacity"] = max(counter["capacity"], len(vehicles))
+                previous[detector_id] = vehicles
+    env.close()
+
+    for tls_id, data in tls_data.items():
+        detector_counters = [counters[detector_id] for detector_id in data["detectors"]]
+        data["car_arrivals"] = [c["cars"] / max(c["steps"], 1) for c in detector_counters]
+        data["bus_arrivals"] = [c["buses"] / max(c["steps"], 1) for c in detector_counters]
+        data["green_discharge"] = [c["green_departures"] / max(c["green_steps"], 1) for c in detector_counters]
+        data["red_discharge"] = [c["red_departures"] / max(c["red_steps"], 1) for c in detector_counters]
+        data["green_halting"] = [c["green_halting"] / max(c["green_vehicles"], 1) for c in detector_counters]
+        data["red_halting"] = [c["red_halting"] / max(c["red_vehicles"], 1) for c in detector_counters]
+        data["capacity"] = [max(c["capacity"], 1) for c in detector_counters]
+
+    calibration = {"simulation": simulation_path, "traffic_scale": traffic_scale, "tls": tls_data}
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(calibration, file, indent=1)
+    return calibration
+
+
+def load_calibration(calibration):
+    """ Calibration dict (see `calibrate`) from a dict or a JSON file """
+    if isinstance(calibration, dict):
+        return calibration
+    with open(calibration) as file:
+        return json.load(file)
+
+
+class QueueSimulator:
+    """
+    Batched queue model of the calibrated intersections: the state of every (env, TLS, detector) is kept in
+    NumPy arrays of shape (num_envs, num_tls, max_detectors) and each step is a handful of array operations.
+    The signals follow TLSEnv._apply_actions (yellow, lock and delta_time) and the SUMO programs (a phase
+    moves on to the next one when its duration expires); the vehicles arrive (Poisson), queue up to the
+    detector capacity and leave at the green/red discharge rates, accumulating waiting time while halted.
+    """
+
+    def __init__(
+        self,
+        calibration,                # Calibration dict or JSON file (see `calibrate`)
+        num_envs=1,                 # Independent environments stepped together
+        delta_time=5,               # Time steps to wait before changing the phase
+        min_phase_time=5,           # Minimum time for a phase
+        yellow_time=5,              # Yellow time
+        traffic_scale=None,         # Scale traffic (None: random between 1 and 3.5 per episode, as TLSEnv)
+        end=2250,                   # Episode end time
+        public_transport_weight=PUBLIC_TRANSPORT_WEIGHT,    # Weight of the public transport in the observations and reward
+        seed=None
+        ):
+        """ Build the per-TLS tables of the calibration """
+        calibration = load_calibration(calibration)
+        self.calibration_scale = calibration["traffic_scale"]
+        self.tls_ids = list(calibration["tls"])
+        tls_data = [calibration["tls"][tls_id] for tls_id in self.tls_ids]
+
+        self.num_envs = num_envs
+        self.num_tls = len(self.tls_ids)
+        self.delta_time = delta_time
+        self.yellow_time = yellow_time
+        self.lock_time = yellow_time + min_phase_time
+        self.traffic_scale = traffic_scale
+        self.end = end
+        self.public_transport_weight = public_transport_weight
+        self.rng = np.random.default_rng(seed)
+
+        ## Per-TLS tables, padded to the largest TLS
+        self.num_detectors = np.array([len(data["detectors"]) for data in tls_data])
+        self.num_phases = np.array([len(data["phase_durations"]) for data in tls_data])
+        self.num_actions = self.num_phases // 2
+        self.max_detectors = int(self.num_detectors.max())
+        max_phases = int(self.num_phases.max())
+
+        self.durations = np.ones((self.num_tls, max_phases), dtype=np.int64)
+        self.served = np.zeros((self.num_tls, max_phases, self.max_detectors), dtype=bool)
+        self.rates = {name: np.zeros((self.num_tls, self.max_detectors)) for name in DETECTOR_RATES}
+        for tls_idx, data in enumerate(tls_data):
+            num_phases, num_detectors = self.num_phases[tls_idx], self.num_detectors[tls_idx]
+            self.durations[tls_idx, :num_phases] = data["phase_durations"]
+            self.served[tls_idx, :num_phases, :num_detectors] = np.array(data["served"], dtype=bool).reshape(num_phases, num_detectors)
+            for name in DETECTOR_RATES:
+                self.rates[name][tls_idx, :num_detectors] = data[name]
+        self.capacity = self.rates["capacity"].astype(np.int64)
+        self.tls_index = np.arange(self.num_tls)[None, :]
+
+        ## State
+        shape, detector_shape = (num_envs, self.num_tls), (num_envs, self.num_tls, self.max_detectors)
+        self.current_step = np.zeros(num_envs, dtype=np.int64)
+        self.episode_traffic_scale = np.zeros(num_envs)
+        self.phase = np.zeros(shape, dtype=np.int64)
+        self.remaining = np.zeros(shape, dtype=np.int64)          # seconds left in the current phase
+        self.aimed_phase = np.zeros(shape, dtype=np.int64)
+        self.current_lock_time = np.zeros(shape, dtype=np.int64)
+        self.action_available = np.ones(shape, dtype=bool)
+        self.last_reward = np.zeros(shape)
+        self.cars = np.zeros(detector_shape, dtype=np.int64)
+        self.buses = np.zeros(detector_shape, dtype=np.int64)
+        self.car_waiting = np.zeros(detector_shape)               # accumulated waiting time of the vehicles on the detector
+        self.bus_waiting = np.zeros(detector_shape)
+        self.car_rate = np.zeros(detector_shape)
+        self.bus_rate = np.zeros(detector_shape)
+
+        self.reset()
+
+    def reset(self, envs=None):
+        """ Start a new episode in the `envs` mask (all the envs if None) """
+        envs = np.ones(self.num_envs, dtype=bool) if envs is None else envs
+        num_reset = int(envs.sum())
+        scale = np.full(num_reset, self.traffic_scale, dtype=float) if self.traffic_scale is not None else self.rng.uniform(1, 3.5, num_reset)
+        self.episode_traffic_scale[envs] = scale
+
+        factor = (scale / self.calibration_scale)[:, None, None]
+        self.car_rate[envs] = self.rates["car_arrivals"][None] * factor
+        self.bus_rate[envs] = self.rates["bus_arrivals"][None] * factor
+
+        self.current_step[envs] = 0
+        self.phase[envs] = 0
+        self.remaining[envs] = self.durations[:, 0][None]
+        self.aimed_phase[envs] = 0
+        self.current_lock_time[envs] = 0
+        self.action_available[envs] = True
+        self.last_reward[envs] = 0
+        for array in [self.cars, self.buses, self.car_waiting, self.bus_waiting]:
+            array[envs] = 0
+
+    def _set_phase(self, mask, phase):
+        """ setPhase on the masked TLS (restarts the phase duration) """
+        self.phase = np.where(mask, phase, self.phase)
+        self.remaining = np.where(mask, self.durations[self.tls_index, self.phase], self.remaining)
+
+    def _apply_actions(self, actions):
+        """ Vectorized TLSEnv._apply_actions (actions: (num_envs, num_tls)) """
+        locked = ~self.action_available
+        self.current_lock_time = np.where(locked, self.current_lock_time + 1, 0)
+
+        ## Start the aimed phase at the end of the yellow time
+        self._set_phase(locked & (self.current_lock_time == self.yellow_time), self.aimed_phase)
+        self.action_available |= self.current_lock_time > self.lock_time
+
+        ## Go to the chosen phase through its yellow phase (SmartTLS._go_to_phase)
+        decide = self.action_available & (self.current_step % self.delta_time == 0)[:, None]
+        target = actions * 2
+        change = decide & (self.phase != target)
+        self.aimed_phase = np.where(change, target, self.aimed_phase)
+        self.action_available &= ~change
+        self._set_phase(change, (self.phase + 1) % self.num_phases)
+
+    def _advance_signals(self):
+        """ One second of the SUMO programs: expired phases move on to the next phase """
+        # SUMO switches at the start of the step at the end of the phase, the new phase counts that step
+        self._set_phase(self.remaining <= 0, (self.phase + 1) % self.num_phases)
+        self.remaining -= 1
+
+    def _move_vehicles(self):
+        """ One second of arrivals, discharges and waiting on every detector """
+        served = self.served[self.tls_index, self.phase]
+        ## Arrivals, blocked when the detector is full
+        free = np.maximum(self.capacity - self.cars - self.buses, 0)
+        cars = np.minimum(self.rng.poisson(self.car_rate), free)
+        buses = np.minimum(self.rng.poisson(self.bus_rate), free - cars)
+        self.cars += cars
+        self.buses += buses
+        queue = self.cars + self.buses
+
+        ## Halted vehicles accumulate waiting time
+        halting = np.where(served, self.rates["green_halting"], self.rates["red_halting"])
+        self.car_waiting += halting * self.cars
+        self.bus_waiting += halting * self.buses
+
+        ## Discharge (the leaving vehicles take their share of the accumulated waiting time)
+        departures = np.minimum(self.rng.poisson(np.where(served, self.rates["green_discharge"], self.rates["red_discharge"])), queue)
+        bus_departures = self.rng.hypergeometric(self.buses, self.cars, departures)
+        car_departures = departures - bus_departures
+        self.car_waiting *= np.divide(self.cars - car_departures, self.cars, out=np.zeros(queue.shape), where=self.cars > 0)
+        self.bus_waiting *= np.divide(self.buses - bus_departures, self.buses, out=np.zeros(queue.shape), where=self.buses > 0)
+        self.cars -= car_departures
+        self.buses -= bus_departures
+
+    def step(self, actions):
+        """ Apply the actions (num_envs, num_tls) and simulate one second """
+        self._apply_actions(actions)
+        self._advance_signals()
+        self._move_vehicles()
+        self.current_step += 1
+
+    def observations(self):
+        """ SmartTLS observations (num_envs, num_tls, max_detectors + 2): queue weights, current phase, action available, zero padding """
+        observations = np.zeros((self.num_envs, self.num_tls, self.max_detectors + 2), dtype=np.int32)
+        observations[:, :, :self.max_detectors] = (self.cars * PRIVATE_TRANSPORT_WEIGHT + self.buses * self.public_transport_weight).astype(np.int32)
+        observations[:, self.tls_index[0], self.num_detectors] = self.phase
+        observations[:, self.tls_index[0], self.num_detectors + 1] = self.action_available
+        return observations
+
+    def accumulated_waiting(self):
+        """ (private, public) accumulated waiting time per TLS: 2 arrays (num_envs, num_tls) """
+        return self.car_waiting.sum(axis=2), self.bus_waiting.sum(axis=2)
+
+    def rewards(self):
+        """ SmartTLS reward: decrease of the weighted accumulated waiting time (num_envs, num_tls) """
+        private, public = self.accumulated_waiting()
+        temp = (private * PRIVATE_TRANSPORT_WEIGHT + public * self.public_transport_weight) / 100
+        rewards = self.last_reward - temp
+        self.last_reward = temp
+        return rewards
+
+    def needs_decision(self):
+        """ SmartTLS.needs_decision for the next step (num_envs, num_tls) """
+        return ((self.current_step % self.delta_time == 0)[:, None]
+                & (self.action_available | (self.current_lock_time + 1 > self.lock_time)))
+
+    def is_terminal(self):
+        return self.current_step >= self.end
+
+    def agent_spaces(self):
+        """ SmartTLS observation and action spaces of every TLS """
+        observation_spaces, action_spaces = [], []
+        for num_detectors, num_phases in zip(self.num_detectors, self.num_phases):
+            observation_spaces.append(spaces.Box(
+                low=np.array([0] * num_detectors + [0] + [0]),
+                high=np.array([30] * num_detectors + [num_phases - 1] + [1]),
+                dtype=np.int32
+            ))
+            action_spaces.append(spaces.Discrete(int(num_phases // 2)))
+        return observation_spaces, action_spaces
+
+
+class SurrogateEnv(ParallelEnv):
+    """
+    TLSEnv interface on top of the QueueSimulator (same agents, spaces, rewards and infos).
+    With several envs the agents are <tls_id>@<env>.
+    """
+    metadata = {"render_modes": []}
+
+    def __init__(self, calibration, num_envs=1, **simulator_kwargs):
+        """ Initialize the environment """
+        self.simulator = QueueSimulator(calibration, num_envs=num_envs, **simulator_kwargs)
+        self.list_tls_id = self.simulator.tls_ids[:]
+        self.end = self.simulator.end
+        self.render_mode = None
+
+        ## (env, tls) of every agent
+        self.agent_index = {
+            (tls_id if num_envs == 1 else "%s@%d" % (tls_id, env_idx)): (env_idx, tls_idx)
+            for env_idx in range(num_envs) for tls_idx, tls_id in enumerate(self.list_tls_id)
+        }
+        self.possible_agents = list(self.agent_index)
+        self.agents = self.possible_agents[:]
+
+        observation_spaces, action_spaces = self.simulator.agent_spaces()
+        self.observation_spaces = {agent: observation_spaces[tls_idx] for agent, (_, tls_idx) in self.agent_index.items()}
+        self.action_spaces = {agent: action_spaces[tls_idx] for agent, (_, tls_idx) in self.agent_index.items()}
+
+    def observation_space(self, agent):
+        return self.observation_spaces[agent]
+
+    def action_space(self, agent):
+        return self.action_spaces[agent]
+
+    def _observations(self):
+        observations = self.simulator.observations()
+        return {
+            agent: observations[env_idx, tls_idx, :self.simulator.num_detectors[tls_idx] + 2]
+            for agent, (env_idx, tls_idx) in self.agent_index.items()
+        }
+
+    def _infos(self):
+        private, public = self.simulator.accumulated_waiting()
+        needs_decision = self.simulator.needs_decision()
+        return {
+            agent: {
+                "total_accumulated_waiting": [float(private[env_idx, tls_idx]), float(public[env_idx, tls_idx])],
+                "current_phase": int(self.simulator.phase[env_idx, tls_idx]),
+                "needs_decision": bool(needs_decision[env_idx, tls_idx]),
+            } for agent, (env_idx, tls_idx) in self.agent_index.items()
+        }
+
+    def reset(self, seed=None, options=None):
+        if seed is not None:
+            self.simulator.rng = np.random.default_rng(seed)
+        self.agents = self.possible_agents[:]
+        self.simulator.reset()
+        return self._observations(), self._infos()
+
+    def step(self, actions):
+        ## Missing agents take action 0 (as locked agents in TLSEnv, their action is not used)
+        action_array = np.zeros((self.simulator.num_envs, self.simulator.num_tls), dtype=np.int64)
+        for agent, action in actions.items():
+            action_array[self.agent_index[agent]] = action
+        self.simulator.step(action_array)
+
+        rewards = self.simulator.rewards()
+        terminal = self.simulator.is_terminal()
+        if terminal.all():
+            self.agents = []
+        return (
+            self._observations(),
+            {agent: float(rewards[index]) for agent, index in self.agent_index.items()},
+            {agent: bool(terminal[env_idx]) for agent, (env_idx, _) in self.agent_index.items()},
+            {agent: False for agent in self.possible_agents},
+            self._infos(),
+        )
+
+    def render(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SurrogateVecEnv(VecEnv):
+    """
+    SB3 VecEnv over every (env, TLS) agent of a QueueSimulator, padded as in `TLSEnv.get_vec_env`,
+    so a model pre-trained on it can be retrained on TLSEnv (see train.py --surrogate).
+    No per-agent dicts: the padded observations are built directly from the simulator arrays.
+    """
+
+    def __init__(self, calibration, num_envs=16, **simulator_kwargs):
+        self.simulator = QueueSimulator(calibration, num_envs=num_envs, **simulator_kwargs)
+        self.render_mode = None
+
+        ## The simulator observations are already padded to max_detectors + 2
+        observation_spaces, action_spaces = self.simulator.agent_spaces()
+        super().__init__(num_envs * self.simulator.num_tls, homogenize_spaces(observation_spaces), homogenize_spaces(action_spaces))
+
+        self.actions = None
+
+    def _observations(self):
+        return self.simulator.observations().reshape(self.num_envs, -1)
+
+    def _infos(self):
+        private, public = self.simulator.accumulated_waiting()
+        needs_decision = self.simulator.needs_decision()
+        return [
+            {"total_accumulated_waiting": [p, b], "current_phase": phase, "needs_decision": decision}
+            for p, b, phase, decision in zip(private.ravel().tolist(), public.ravel().tolist(),
+                                             self.simulator.phase.ravel().tolist(), needs_decision.ravel().tolist())
+        ]
+
+    def reset(self):
+        self.simulator.reset()
+        self.reset_infos = self._infos()
+        return self._observations()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        ## Padded actions refer to action 0 (dehomogenize_actions)
+        actions = np.asarray(self.actions, dtype=np.int64).reshape(self.simulator.num_envs, self.simulator.num_tls)
+        actions = np.where(actions < self.simulator.num_actions[None, :], actions, 0)
+        self.simulator.step(actions)
+
+        rewards = self.simulator.rewards().ravel().astype(np.float32)
+        terminal = self.simulator.is_terminal()
+        dones = np.repeat(terminal, self.simulator.num_tls)
+        infos = self._infos()
+        observations = self._observations()
+
+        if terminal.any():
+            for i in np.flatnonzero(dones):
+                infos[i]["terminal_observation"] = observations[i].copy()
+            self.simulator.reset(terminal)
+            observations = self._observations()
+        return observations, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        target = self.simulator if hasattr(self.simulator, attr_name) else self
+        return [getattr(target, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.simulator, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.simulator, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,247 @@
+import os
+import math
+import json
+import time
+import random
+import sqlite3
+import statistics
+import multiprocessing as mp
+from marl_tls.analysis_callback import AnalysisCallback
+
+## Trial parameters passed to TLSEnv, the others are PPO arguments
+ENV_PARAMS = ["delta_time", "min_phase_time", "max_phase_time", "yellow_time", "public_transport_weight", "traffic_scale", "end"]
+
+WAITING, RUNNING, COMPLETE, PRUNED, FAILED = "waiting", "running", "complete", "pruned", "failed"
+
+
+def sample_params(space, seed):
+    """
+    Sample one configuration of a search space:
+      - list: one of the values
+      - {"low", "high"}: uniform float ({"log": true} for log-uniform, {"int": true} for integers)
+      - anything else: fixed value
+    """
+    rng = random.Random(seed)
+    params = {}
+    for name, dist in sorted(space.items()):
+        if isinstance(dist, list):
+            params[name] = rng.choice(dist)
+        elif isinstance(dist, dict):
+            if dist.get("int"):
+                params[name] = rng.randint(dist["low"], dist["high"])
+            elif dist.get("log"):
+                params[name] = 10 ** rng.uniform(math.log10(dist["low"]), math.log10(dist["high"]))
+            else:
+                params[name] = rng.uniform(dist["low"], dist["high"])
+        else:
+            params[name] = dist
+    return params
+
+
+class TrialDatabase:
+    """ Trials and their intermediate metric reports in a SQLite file (shared by the worker processes) """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS trials (id INTEGER PRIMARY KEY, params TEXT, state TEXT, value REAL, cpus TEXT, started REAL, finished REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS reports (trial INTEGER, step INTEGER, value REAL, PRIMARY KEY (trial, step))")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def add_trial(self, trial_id, params):
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO trials (id, params, state) VALUES (?, ?, ?)", (trial_id, json.dumps(params), WAITING))
+
+    def resume(self):
+        """ Trials interrupted in a previous sweep are run again (failed trials are kept, they would fail again) """
+        with self._connect() as db:
+            db.execute("UPDATE trials SET state = ?, cpus = NULL, started = NULL WHERE state = ?", (WAITING, RUNNING))
+            db.execute("DELETE FROM reports WHERE trial IN (SELECT id FROM trials WHERE state = ?)", (WAITING,))
+
+    def trials(self, state=None):
+        """ [(id, params, state, value)] """
+        with self._connect() as db:
+            rows = db.execute("SELECT id, params, state, value FROM trials" + (" WHERE state = ?" if state else "") + " ORDER BY id", (state,) if state else ()).fetchall()
+        return [(trial_id, json.loads(params), trial_state, value) for trial_id, params, trial_state, value in rows]
+
+    def set_state(self, trial_id, state, value=None, cpus=None):
+        with self._connect() as db:
+            if state == RUNNING:
+                db.execute("UPDATE trials SET state = ?, cpus = ?, started = ? WHERE id = ?", (state, json.dumps(cpus), time.time(), trial_id))
+            else:
+                db.execute("UPDATE trials SET state = ?, value = ?, finished = ? WHERE id = ?", (state, value, time.time(), trial_id))
+
+    def report(self, trial_id, step, value):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO reports (trial, step, value) VALUES (?, ?, ?)", (trial_id, step, value))
+
+    def completed_reports(self, step):
+        """ Values reported at `step` by the completed trials """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT reports.value FROM reports JOIN trials ON reports.trial = trials.id WHERE trials.state = ? AND reports.step = ?",
+                (COMPLETE, step)).fetchall()
+        return [value for value, in rows]
+
+
+class MedianPruner:
+    """ Stop a trial whose metric is worse than the median of the completed trials at the same report """
+
+    def __init__(self, database, minimize=True, startup_trials=3, warmup_reports=1):
+        self.database = database
+        self.minimize = minimize
+        self.startup_trials = startup_trials
+        self.warmup_reports = warmup_reports
+
+    def should_prune(self, step, value):
+        if step < self.warmup_reports:
+            return False
+        values = self.database.completed_reports(step)
+        if len(values) < self.startup_trials:
+            return False
+        median = statistics.median(values)
+        return value > median if self.minimize else value < median
+
+
+class SweepCallback(AnalysisCallback):
+    """
+    Average the `analysis/*` metric (sum of the given keys) over every `report_interval` timesteps,
+    report it to the trial database and stop the training when the trial is pruned.
+    """
+
+    def __init__(self, env, trial_id, database, pruner, metric, report_interval, verbose=0):
+        super().__init__(env, verbose)
+        self.trial_id = trial_id
+        self.database = database
+        self.pruner = pruner
+        self.metric_keys = metric.split("+")
+        self.report_interval = report_interval
+
+        self.values = []
+        self.reports = []
+        self.pruned = False
+
+    def _on_step(self) -> bool:
+        super()._on_step()
+        self.values.append(sum(self.logger.name_to_value[key] for key in self.metric_keys))
+
+        if self.num_timesteps >= (len(self.reports) + 1) * self.report_interval:
+            value = float(sum(self.values) / len(self.values))
+            self.values = []
+            self.database.report(self.trial_id, len(self.reports), value)
+            self.reports.append(value)
+            if self.pruner.should_prune(len(self.reports) - 1, value):
+                self.pruned = True
+                return False
+        return True
+
+
+def _pin(cpus):
+    """ Run this process (and the SUMO processes it starts) on `cpus` only """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import torch
+    torch.set_num_threads(len(cpus))
+
+
+def _run_trial(trial_id, params, cpus, settings):
+    """ Worker process: train one PPO model with the trial parameters """
+    _pin(cpus)
+    from stable_baselines3 import PPO
+    from marl_tls.env import TLSEnv
+
+    database = TrialDatabase(settings["database"])
+    env_kwargs = {name: value for name, value in params.items() if name in ENV_PARAMS}
+    ppo_kwargs = {name: value for name, value in params.items() if name not in ENV_PARAMS}
+    env_kwargs.setdefault("end", settings["end"])
+
+    vec_env = TLSEnv.get_vec_env(TLSEnv, simulation_path=settings["simulation"], simulation_label="Sweep%d" % trial_id, **env_kwargs)
+    try:
+        model = PPO("MlpPolicy", vec_env, verbose=0, tensorboard_log=settings["tensorboard_log"], **ppo_kwargs)
+        pruner = MedianPruner(database, minimize=not settings["maximize"], startup_trials=settings["startup_trials"])
+        callback = SweepCallback(vec_env, trial_id, database, pruner, settings["metric"], settings["report_interval"])
+        model.learn(total_timesteps=settings["timesteps"], callback=callback, tb_log_name="PPO_trial%d" % trial_id)
+        model.save(os.path.join(settings["directory"], "trial_%d" % trial_id))
+    finally:
+        vec_env.close()
+
+    value = callback.reports[-1] if callback.reports else None
+    database.set_state(trial_id, PRUNED if callback.pruned else COMPLETE, value)
+
+
+def run_sweep(
+    space,                          # Search space (see `sample_params`)
+    directory,                      # Trial database, models and logs
+    simulation="cross/cross",
+    num_trials=20,
+    timesteps=100000,               # Timesteps per trial
+    cpus_per_trial=1,               # CPUs pinned to each trial (SUMO + PyTorch)
+    metric="analysis/waiting_private_transport+analysis/waiting_public_transport",
+    maximize=False,
+    report_interval=10000,          # Timesteps between the metric reports (pruning checks)
+    startup_trials=3,               # Completed trials before pruning
+    end=2250,                       # Simulation end time (unless sampled)
+    seed=0
+    ):
+    """
+    Run the trials of a hyperparameter sweep on the local CPUs, one pinned worker process per trial.
+    The trials are stored in <directory>/trials.db: running the sweep again resumes it.
+    """
+    os.makedirs(directory, exist_ok=True)
+    database = TrialDatabase(os.path.join(directory, "trials.db"))
+    database.resume()
+    for trial_id in range(num_trials):
+        database.add_trial(trial_id, sample_params(space, seed * 100003 + trial_id))
+
+    settings = dict(
+        database=database.path,
+        directory=directory,
+        tensorboard_log=os.path.join(directory, "logs"),
+        simulation=simulation,
+        timesteps=timesteps,
+        metric=metric,
+        maximize=maximize,
+        report_interval=report_interval,
+        startup_trials=startup_trials,
+        end=end,
+    )
+
+    ## One CPU set per worker
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    free_cpu_sets = [cpus[i:i + cpus_per_trial] for i in range(0, len(cpus) - cpus_per_trial + 1, cpus_per_trial)] or [cpus]
+
+    ctx = mp.get_context("spawn")
+    waiting = [(trial_id, params) for trial_id, params, _, _ in database.trials(WAITING)]
+    running = {}    # trial_id: (process, cpu_set)
+    while waiting or running:
+        while waiting and free_cpu_sets:
+            cpu_set = free_cpu_sets.pop(0)
+            trial_id, params = waiting.pop(0)
+            database.set_state(trial_id, RUNNING, cpus=cpu_set)
+            process = ctx.Process(target=_run_trial, args=(trial_id, params, cpu_set, settings))
+            process.start()
+            running[trial_id] = (process, cpu_set)
+            print(f"Trial {trial_id} started on CPUs {cpu_set}: {params}")
+
+        for trial_id, (process, cpu_set) in list(running.items()):
+            process.join(timeout=1)
+            if process.is_alive():
+                continue
+            del running[trial_id]
+            free_cpu_sets.append(cpu_set)
+            if process.exitcode != 0:
+                database.set_state(trial_id, FAILED)
+            state, value = [(state, value) for tid, _, state, value in database.trials() if tid == trial_id][0]
+            print(f"Trial {trial_id} {state}: {value}")
+
+    return best_trial(database, maximize)
+
+
+def best_trial(database, maximize=False):
+    """ (id, params, value) of the best completed trial """
+    completed = [(trial_id, params, value) for trial_id, params, _, value in database.trials(COMPLETE) if value is not None]
+    if not completed:
+        return None
+    return (max if maximize else min)(completed, key=lambda trial: trial[2])
@@ -0,0 +1,158 @@
+import os
+import sys
+import gzip
+import socket
+import struct
+import threading
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+import traci
+from traci import connection
+from traci.exceptions import FatalTraCIError
+
+## Trace records: kind (1 byte), length (4 bytes), data. A START record (data: connection label) opens each connection
+START, SEND, RECV = 0, 1, 2
+RECORD_HEADER = struct.Struct("!BI")
+
+
+class TraceMismatch(FatalTraCIError):
+    """ The replayed env sent a request that differs from the recorded one """
+
+
+class RecordingSocket:
+    """ Socket wrapper that writes the bytes sent to and received from SUMO into the trace """
+
+    def __init__(self, sock, trace_file):
+        self._sock = sock
+        self._trace_file = trace_file
+
+    def send(self, data):
+        self._trace_file.write(RECORD_HEADER.pack(SEND, len(data)) + data)
+        return self._sock.send(data)
+
+    def recv(self, size):
+        data = self._sock.recv(size)
+        if data:
+            self._trace_file.write(RECORD_HEADER.pack(RECV, len(data)) + data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)    # fileno, close, ...
+
+
+class ReplaySocket:
+    """ Serve the recorded responses of one connection in order, checking the requests against the recorded ones """
+
+    def __init__(self, sent, received, strict=True):
+        self.sent = sent
+        self.received = received
+        self.strict = strict
+        self.sent_position = 0
+        self.received_position = 0
+
+    def send(self, data):
+        if self.strict and self.sent[self.sent_position:self.sent_position + len(data)] != data:
+            raise TraceMismatch(f"request at byte {self.sent_position} differs from the trace (record it again after changing the TraCI calls)")
+        self.sent_position += len(data)
+        return len(data)
+
+    def recv(self, size):
+        data = self.received[self.received_position:self.received_position + size]
+        self.received_position += len(data)
+        return data
+
+    def close(self):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+    def connect(self, address):
+        pass
+
+
+class ReplaySocketModule:
+    """ Socket module of traci.connection while a ReplayConnection is opened: socket() returns the ReplaySocket """
+
+    def __init__(self, replay_socket):
+        self.replay_socket = replay_socket
+
+    def socket(self, *args):
+        return self.replay_socket
+
+    def __getattr__(self, name):
+        return getattr(socket, name)    # error, IPPROTO_TCP, ...
+
+
+## Connection.__init__ opens the socket with connection.socket.socket() (traci 1.20 and 1.28): it is swapped for the
+## ReplaySocket while the connection is built, so the connection state is set up by traci itself
+replay_lock = threading.Lock()
+
+
+class ReplayConnection(connection.Connection):
+    """ TraCI connection served by a ReplaySocket (no SUMO process) """
+
+    def __init__(self, replay_socket, label):
+        with replay_lock:
+            connection.socket = ReplaySocketModule(replay_socket)
+            try:
+                connection.Connection.__init__(self, "replay", 0, None, None, False, label)
+            finally:
+                connection.socket = socket
+
+
+class TraceRecorder:
+    """ Record every TraCI request and response of the connections attached to it into one (gzip) trace file """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "wb")
+
+    def attach(self, label):
+        """ Record the connection `label` from now on (e.g. right after traci.start) """
+        con = traci.getConnection(label)
+        data = label.encode()
+        self.file.write(RECORD_HEADER.pack(START, len(data)) + data)
+        con._socket = RecordingSocket(con._socket, self.file)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TraceReplayer:
+    """ Replay the connections of a trace file in order, without SUMO """
+
+    def __init__(self, path, strict=True):
+        """ Read the trace: one (sent, received) byte stream per connection """
+        self.strict = strict
+        self.sessions = []
+        with gzip.open(path, "rb") as file:
+            data = file.read()
+        position = 0
+        sent, received = [], []
+        while position < len(data):
+            kind, length = RECORD_HEADER.unpack_from(data, position)
+            position += RECORD_HEADER.size
+            chunk = data[position:position + length]
+            position += length
+            if kind == START:
+                sent, received = [], []
+                self.sessions.append((sent, received))
+            else:
+                (sent if kind == SEND else received).append(chunk)
+        self.sessions = [(b"".join(sent), b"".join(received)) for sent, received in self.sessions]
+        self.next_session = 0
+
+    def connect(self, label):
+        """ Replace traci.start: open the next recorded connection under `label` and switch to it """
+        if self.next_session >= len(self.sessions):
+            raise FatalTraCIError("no more connections in the trace")
+        sent, received = self.sessions[self.next_session]
+        self.next_session += 1
+        ReplayConnection(ReplaySocket(sent, received, self.strict), label)
+        traci.switch(label)
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import optparse
+import numpy as np
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import traci
+from marl_tls.env import TLSEnv
+from marl_tls.pipelined_env import PipelinedVecEnv
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--simulation", action="store", type="string", default="aveiro_traffic/osm", help="path to the simulation")
+    optParser.add_option("--num_envs", action="store", type="int", default=4, help="number of simulations")
+    optParser.add_option("--steps", action="store", type="int", default=500, help="measured steps")
+    optParser.add_option("--traffic_scale", action="store", type="float", default=2, help="Scale Traffic")
+    options, args = optParser.parse_args()
+    return options
+
+
+def sequential(options):
+    """ Naive loop: each env blocks on its SUMO step and its TraCI queries before the next one """
+    envs = [TLSEnv(simulation_path=options.simulation, traffic_scale=options.traffic_scale, end=options.steps + 1, simulation_label="AveiroCity_seq%d" % i) for i in range(options.num_envs)]
+    for env in envs:
+        traci.switch(env.simulation_label)
+        env.reset()
+
+    start = time.perf_counter()
+    for _ in range(options.steps):
+        for env in envs:
+            traci.switch(env.simulation_label)
+            env.step({tls_id: 0 for tls_id in env.possible_agents})
+    elapsed = time.perf_counter() - start
+
+    for env in envs:
+        traci.switch(env.simulation_label)
+        env.close()
+    return elapsed
+
+
+def pipelined(options):
+    vec_env = PipelinedVecEnv(options.num_envs, simulation_path=options.simulation, traffic_scale=options.traffic_scale, end=options.steps + 1)
+    vec_env.reset()
+    actions = np.zeros(vec_env.num_envs, dtype=np.int64)
+
+    start = time.perf_counter()
+    for _ in range(options.steps):
+        vec_env.step(actions)
+    elapsed = time.perf_counter() - start
+
+    vec_env.close()
+    return elapsed
+
+
+if __name__ == "__main__":
+    options = get_options()
+
+    sequential_time = sequential(options)
+    pipelined_time = pipelined(options)
+
+    env_steps = options.num_envs * options.steps
+    print(f"{options.num_envs} envs x {options.steps} steps ({os.cpu_count()} CPUs)")
+    print(f"Sequential: {env_steps / sequential_time:8.1f} env-steps/s")
+    print(f"Pipelined:  {env_steps / pipelined_time:8.1f} env-steps/s ({sequential_time / pipelined_time:.2f}x)")
+    sys.stdout.flush()
@@ -1,20 +1,40 @@
+import os
 import json
 from datetime import datetime
+from collections import OrderedDict, defaultdict
+from math import cos, radians, sqrt
 import threading
 import time
 import argparse  # Para processar argumentos de linha de comando
+from .bearing_calculator import bearing
 
 
 DATA_TIMEOUT = 5
+CELL_SIZE = 0.0025          # Spatial index cell (degrees, ~280 m of latitude)
+MAX_BUS_SPEED = 25          # Upper bound of the bus speeds (m/s), limits the searched cells
+MINIMUM_SPEED = 1.1         # Below this speed a bus is considered stopped (m/s)
+APPROACH_ANGLE = 45         # Maximum difference between the bus heading and the bearing to the intersection
+INVALID_HEADING = 360       # Headings/speeds above these values are "not available" (e.g. 3601, 16383)
+INVALID_SPEED = 100
+METERS_PER_DEGREE = 111320
+APPROACHES = ["N", "E", "S", "W"]
+TL_INFO_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tl_info.json")
 
 class BusLocator:
     def __init__(self, json_file_path="test.json"):
-        
-        self.bus_location = {} # bus_id: ([lat, lon], timestamp)
 
-        print(f"Starting data processing for file: {json_file_path}")
-        processing_thread = threading.Thread(target=self.read_and_process_data, args=(json_file_path,))
-        processing_thread.start()
+        self.bus_location = OrderedDict() # bus_id: ([lon, lat], timestamp), oldest update first
+        self.bus_motion = {} # bus_id: (heading, speed), None if not available
+
+        ## Spatial index: grid cell -> buses in the cell
+        self.grid = defaultdict(set)
+        self.bus_cell = {}
+        self.lock = threading.Lock()
+
+        if json_file_path is not None:
+            print(f"Starting data processing for file: {json_file_path}")
+            processing_thread = threading.Thread(target=self.read_and_process_data, args=(json_file_path,))
+            processing_thread.start()
 
 
     def read_and_process_data(self, file_path):
@@ -28,52 +48,136 @@ class BusLocator:
 
 
     def process_data(self, object):
-        
+
         entity_type = object["entityType"]
-        
+
         if entity_type != "Bus":
             return
 
         event_timestamp_str = object["eventTimestamp"]["$date"]
         event_timestamp = datetime.fromisoformat(event_timestamp_str.replace("Z", "+00:00"))
 
-        self._clean_up_old_data(event_timestamp)
-        
-        # -- Process new data --
-        bus_id = object["entityId"]
-        coordinates = object["location"]["coordinates"]
-
-        # print(f"\n\nProcessing bus {bus_id} with coordinates {coordinates}")
-        
-        self.bus_location[bus_id] = (coordinates, event_timestamp)
-   
-    
-    def _clean_up_old_data(self, event_timestamp):
-        bus_old_data = []
+        with self.lock:
+            self._clean_up_old_data(event_timestamp)
+
+            # -- Process new data --
+            bus_id = object["entityId"]
+            coordinates = object["location"]["coordinates"]
+            heading = object.get("heading")
+            speed = object.get("speed")
+
+            # print(f"\n\nProcessing bus {bus_id} with coordinates {coordinates}")
+
+            self.bus_location[bus_id] = (coordinates, event_timestamp)
+            self.bus_location.move_to_end(bus_id)
+            self.bus_motion[bus_id] = (
+                heading if heading is not None and abs(heading) <= INVALID_HEADING else None,
+                speed if speed is not None and speed <= INVALID_SPEED else None
+            )
+            self._update_cell(bus_id, self._cell(coordinates[1], coordinates[0]))
+
 
-        for bus in self.bus_location:
-            if (event_timestamp - self.bus_location[bus][1]).total_seconds() > DATA_TIMEOUT:
-                bus_old_data.append(bus)
-                
-        for bus in bus_old_data:
+    def _cell(self, lat, lon):
+        return (int(lat // CELL_SIZE), int(lon // CELL_SIZE))
+
+
+    def _update_cell(self, bus_id, cell):
+        old_cell = self.bus_cell.get(bus_id)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self.grid[old_cell].discard(bus_id)
+            if not self.grid[old_cell]:
+                del self.grid[old_cell]
+        if cell is not None:
+            self.grid[cell].add(bus_id)
+            self.bus_cell[bus_id] = cell
+        else:
+            del self.bus_cell[bus_id]
+
+
+    def _clean_up_old_data(self, event_timestamp):
+        # The oldest updates are at the front
+        while self.bus_location:
+            bus, (_, timestamp) = next(iter(self.bus_location.items()))
+            if (event_timestamp - timestamp).total_seconds() <= DATA_TIMEOUT:
+                break
             # print(f"Removing old data for bus {bus} because stopped receiving updates of it.")
             del self.bus_location[bus]
+            del self.bus_motion[bus]
+            self._update_cell(bus, None)
+
 
- 
     def get_bus_locations(self):
-        data = list(self.bus_location.values())
+        with self.lock:
+            data = list(self.bus_location.values())
         coordinates = [x[0] for x in data]
         print(f"** Bus locations: {coordinates}")
 
 
+    def get_approaching_buses(self, tl_lat, tl_lon, horizon=60):
+        """
+        Buses that will reach the intersection in the next `horizon` seconds (driving towards it),
+        sorted by arrival time: [{"bus_id", "eta", "distance", "approach", "heading", "speed"}]
+        """
+        radius = horizon * MAX_BUS_SPEED
+        lat_cells = int(radius / METERS_PER_DEGREE / CELL_SIZE) + 1
+        lon_meters = METERS_PER_DEGREE * cos(radians(tl_lat))
+        lon_cells = int(radius / lon_meters / CELL_SIZE) + 1
+        center_lat, center_lon = self._cell(tl_lat, tl_lon)
+
+        approaching = []
+        with self.lock:
+            for cell_lat in range(center_lat - lat_cells, center_lat + lat_cells + 1):
+                for cell_lon in range(center_lon - lon_cells, center_lon + lon_cells + 1):
+                    for bus_id in self.grid.get((cell_lat, cell_lon), ()):
+                        heading, speed = self.bus_motion[bus_id]
+                        if heading is None or speed is None or speed < MINIMUM_SPEED:
+                            continue
+                        lon, lat = self.bus_location[bus_id][0]
+
+                        # Equirectangular distance (the searched area is a few km wide)
+                        distance = sqrt(((lat - tl_lat) * METERS_PER_DEGREE)**2 + ((lon - tl_lon) * lon_meters)**2)
+                        eta = distance / speed
+                        if eta > horizon:
+                            continue
+                        # Driving towards the intersection
+                        if abs((bearing(lat, lon, tl_lat, tl_lon) - heading + 180) % 360 - 180) > APPROACH_ANGLE:
+                            continue
+                        approaching.append({
+                            "bus_id": bus_id,
+                            "eta": eta,
+                            "distance": distance,
+                            "approach": APPROACHES[int(round((bearing(tl_lat, tl_lon, lat, lon) % 360) / 90)) % 4],  # side of the intersection
+                            "heading": heading,
+                            "speed": speed,
+                        })
+        return sorted(approaching, key=lambda bus: bus["eta"])
+
+
+def read_tl_info(file_path=TL_INFO_FILE_PATH):
+    """ Records of tl_info.json, one JSON object per line: {"id", "coordinates", "heading_range"} (shared by the real data processors) """
+    with open(file_path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def read_intersections(file_path=TL_INFO_FILE_PATH):
+    """ {id: (lat, lon)} of the intersections in tl_info.json """
+    return {tl_info["id"]: tuple(tl_info["coordinates"]) for tl_info in read_tl_info(file_path)}
+
+
 if __name__ == "__main__":
     # Argument parsing
     parser = argparse.ArgumentParser(description="Process bus data from a JSON file.")
     parser.add_argument("json_file", help="Path to the JSON file with bus data.")
+    parser.add_argument("--horizon", type=float, default=60, help="Seconds ahead to look for approaching buses.")
     args = parser.parse_args()
 
     bus_locator = BusLocator(json_file_path=args.json_file)
+    intersections = read_intersections()
 
     for i in range(1000000):
         time.sleep(1)
         bus_locator.get_bus_locations()
+        for tl_id, (tl_lat, tl_lon) in intersections.items():
+            print(f"** Buses approaching {tl_id}: {bus_locator.get_approaching_buses(tl_lat, tl_lon, args.horizon)}")
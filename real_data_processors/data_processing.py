@@ -5,12 +5,24 @@ import threading
 import time
 import argparse  # Para processar argumentos de linha de comando
 import sys
+from .bus_locator import read_tl_info
 
 SENSOR_DISTANCE = 60
 MINIMUM_SPEED = 1.1
 CACHE_TIMEOUT = 60
 OLD_DATA_TIMEOUT = 1
-TL_INFO_FILE_PATH = "tl_info.json"
+
+# Function to calculate distance between two coordinates using the Haversine formula
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1 
+    dlat = lat2 - lat1 
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a)) 
+    r = 6371000  # Earth radius in meters
+    distance = c * r
+    return distance
+
 
 # P33 location: 40.63245, -8.64859
 class DataProcessor:
@@ -41,16 +53,8 @@ class DataProcessor:
         processing_thread.start()
 
 
-    # Function to calculate distance between two coordinates using the Haversine formula
     def haversine(self, lon1, lat1, lon2, lat2):
-        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-        dlon = lon2 - lon1 
-        dlat = lat2 - lat1 
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a)) 
-        r = 6371000  # Earth radius in meters
-        distance = c * r
-        return distance
+        return haversine(lon1, lat1, lon2, lat2)
 
 
     def read_and_process_data(self, file_path):
@@ -63,11 +67,9 @@ class DataProcessor:
         print("Data processing completed!")
     
     def get_tl_heading_range(self):
-        with open(TL_INFO_FILE_PATH, "r") as file:
-            for line in file:
-                tl_info = json.loads(line)
-                if tl_info["coordinates"] == [self.traffic_light_lat, self.traffic_light_lon]:
-                    return tl_info["heading_range"][0], tl_info["heading_range"][1]    
+        for tl_info in read_tl_info():
+            if tl_info["coordinates"] == [self.traffic_light_lat, self.traffic_light_lon]:
+                return tl_info["heading_range"][0], tl_info["heading_range"][1]    
 
 
     def process_data(self, object):
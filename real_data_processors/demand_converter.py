@@ -0,0 +1,207 @@
+import os
+import sys
+import gzip
+import json
+import argparse
+import xml.etree.ElementTree as ET
+from math import degrees, atan2
+from datetime import datetime
+from collections import defaultdict
+from .data_processing import haversine
+from .bearing_calculator import bearing
+from .bus_locator import read_intersections, TL_INFO_FILE_PATH
+
+SENSOR_DISTANCE = 100       # Radius around an intersection where the vehicles are counted (m)
+INVALID_HEADING = 360       # Headings above this value are "not available" (e.g. 3601)
+APPROACHES = ["N", "E", "S", "W"]
+ENTITY_VTYPES = {
+    "Car": "sensor_car",
+    "Bus": "pt_bus",        # same type as the public transport lines (counted as public transport by the env)
+}
+
+
+def angle_difference(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+def approach_direction(heading):
+    """ Side of the intersection a vehicle driving with `heading` comes from (heading 0: from the south) """
+    return APPROACHES[int(round(((heading + 180) % 360) / 90)) % 4]
+
+
+def read_records(file_path):
+    """ Stream the records of a (gzipped) JSON lines feed file """
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with opener(file_path, "rt") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class ApproachCounter:
+    """
+    Count the distinct vehicles entering each intersection per approach direction and time bin.
+    A vehicle is counted once per approach, in the bin of its first report within the radius, and
+    forgotten after `open_bins` bins without reports, so the memory does not grow with the size of
+    the feed (the records must be roughly sorted by time).
+    """
+
+    def __init__(self, intersections, bin_size=300, radius=SENSOR_DISTANCE, open_bins=2, entity_types=("Car",)):
+        self.intersections = intersections
+        self.bin_size = bin_size
+        self.radius = radius
+        self.open_bins = open_bins
+        self.entity_types = set(entity_types)
+
+        self.last_seen = {}                 # (tl_id, approach, entity_type, entity_id): last bin with a report
+        self.counts = defaultdict(int)      # (bin, tl_id, approach, entity_type): vehicles
+        self.last_bin = None
+        self.stats = defaultdict(int)
+
+    def add(self, record):
+        """ Count one feed record """
+        self.stats["records"] += 1
+        if record.get("entityType") not in self.entity_types:
+            return
+        heading = record.get("heading")
+        if heading is None or abs(heading) > INVALID_HEADING:
+            self.stats["invalid_heading"] += 1
+            return
+
+        timestamp = datetime.fromisoformat(record["eventTimestamp"]["$date"].replace("Z", "+00:00"))
+        time_bin = int(timestamp.timestamp()) // self.bin_size
+        if self.last_bin is not None and time_bin <= self.last_bin - self.open_bins:
+            self.stats["late"] += 1     # its bin was already closed
+            return
+        if self.last_bin is None or time_bin > self.last_bin:
+            self.last_bin = time_bin
+            self._forget_vehicles(time_bin - self.open_bins)
+
+        lon, lat = record["location"]["coordinates"]
+        for tl_id, (tl_lat, tl_lon) in self.intersections.items():
+            if haversine(lon, lat, tl_lon, tl_lat) > self.radius:
+                continue
+            # Only the vehicles driving towards the intersection
+            if angle_difference(bearing(lat, lon, tl_lat, tl_lon), heading) >= 90:
+                continue
+            key = (tl_id, approach_direction(heading), record["entityType"], record["entityId"])
+            if key not in self.last_seen:
+                self.counts[(time_bin, *key[:3])] += 1
+            self.last_seen[key] = max(time_bin, self.last_seen.get(key, time_bin))
+            self.stats["counted"] += 1
+
+    def _forget_vehicles(self, up_to):
+        """ Forget the vehicles without reports after bin `up_to` (a later report is a new vehicle pass) """
+        for key in [key for key, time_bin in self.last_seen.items() if time_bin <= up_to]:
+            del self.last_seen[key]
+
+    def finish(self):
+        """ Return the counts """
+        return dict(self.counts)
+
+
+def _edge_heading(edge, end=True):
+    """ Compass heading of the first/last segment of an edge """
+    shape = edge.getShape()
+    (x1, y1), (x2, y2) = shape[-2:] if end else shape[:2]
+    return degrees(atan2(x2 - x1, y2 - y1)) % 360
+
+
+def map_approaches(net, intersections, vclass="passenger"):
+    """ {tl_id: {approach: (incoming edge, [outgoing edges])}} of the nearest traffic light node of each intersection """
+    nodes = [node for node in net.getNodes() if node.getType().startswith("traffic_light")]
+    mapping = {}
+    for tl_id, (lat, lon) in intersections.items():
+        x, y = net.convertLonLat2XY(lon, lat)
+        node = min(nodes, key=lambda node: (node.getCoord()[0] - x)**2 + (node.getCoord()[1] - y)**2)
+        incoming = [edge for edge in node.getIncoming() if edge.allows(vclass)]
+        outgoing = [edge for edge in node.getOutgoing() if edge.allows(vclass)]
+
+        mapping[tl_id] = {}
+        for approach in APPROACHES:
+            # Approach from the north: driving south (180 degrees)
+            heading = (APPROACHES.index(approach) * 90 + 180) % 360
+            edge = min(incoming, key=lambda edge: angle_difference(_edge_heading(edge), heading))
+            # No U-turns back to the approach
+            destinations = [out for out in outgoing if out.getToNode() != edge.getFromNode()] or outgoing
+            mapping[tl_id][approach] = (edge, destinations)
+    return mapping
+
+
+def write_flows(counts, mapping, output, bin_size, penetration=1.0, start_bin=None):
+    """ Write the counts as SUMO flows (one per approach and destination edge), the first bin starting at time 0 """
+    start_bin = min(time_bin for time_bin, _, _, _ in counts) if start_bin is None else start_bin
+
+    routes = ET.Element("routes")
+    ET.SubElement(routes, "vType", id=ENTITY_VTYPES["Car"], vClass="passenger")
+    flows = []
+    for (time_bin, tl_id, approach, entity_type), vehicles in sorted(counts.items()):
+        edge, destinations = mapping[tl_id][approach]
+        number = int(round(vehicles / penetration))
+        for i, destination in enumerate(destinations):
+            # Even split of the vehicles between the destinations
+            destination_number = number // len(destinations) + int(i < number % len(destinations))
+            if destination_number == 0:
+                continue
+            begin = (time_bin - start_bin) * bin_size
+            flows.append(ET.SubElement(routes, "flow",
+                id="%s_%s_%s_%d_%d" % (tl_id, approach, entity_type, time_bin - start_bin, i),
+                type=ENTITY_VTYPES[entity_type],
+                begin=str(begin), end=str(begin + bin_size), number=str(destination_number),
+                departLane="best", departSpeed="max",
+                **{"from": edge.getID(), "to": destination.getID()}
+            ))
+
+    ET.indent(routes, space="    ")
+    ET.ElementTree(routes).write(output, encoding="UTF-8", xml_declaration=True)
+    return len(flows)
+
+
+def write_config(base_config, output_config, flows_file):
+    """ Copy of a sumocfg with the passenger demand replaced by the sensor flows """
+    tree = ET.parse(base_config)
+    route_files = tree.getroot().find("input/route-files")
+    files = [file for file in route_files.get("value").split(",") if "passenger" not in file]
+    route_files.set("value", ",".join(files + [os.path.relpath(flows_file, os.path.dirname(output_config))]))
+    tree.write(output_config, encoding="UTF-8", xml_declaration=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert recorded sensor feeds into SUMO flows for aveiro_traffic.")
+    parser.add_argument("feed_files", nargs="+", help="JSON lines feed files (optionally .gz), in time order")
+    parser.add_argument("--tl_info", default=TL_INFO_FILE_PATH, help="intersections (id, coordinates) file")
+    parser.add_argument("--net", default="sumo_config/aveiro_traffic/osm.net.xml.gz", help="SUMO network")
+    parser.add_argument("--base_config", default="sumo_config/aveiro_traffic/osm.sumocfg", help="sumocfg whose passenger demand is replaced")
+    parser.add_argument("--output", default="sumo_config/aveiro_traffic/osm.sensor.flows.xml", help="output flows file")
+    parser.add_argument("--output_config", default="sumo_config/aveiro_traffic/osm.sensor.sumocfg", help="output sumocfg (simulation aveiro_traffic/osm.sensor)")
+    parser.add_argument("--bin_size", type=int, default=300, help="time bin of the flows (s)")
+    parser.add_argument("--radius", type=float, default=SENSOR_DISTANCE, help="counting radius around the intersections (m)")
+    parser.add_argument("--penetration", type=float, default=1.0, help="fraction of the vehicles reported by the feed (counts are divided by it)")
+    parser.add_argument("--entity_types", default="Car", help="comma separated entity types to convert (" + ", ".join(ENTITY_VTYPES) + ")")
+    args = parser.parse_args()
+
+    if 'SUMO_HOME' in os.environ:
+        sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
+    else:
+        sys.exit("please declare environment variable 'SUMO_HOME'")
+    import sumolib  # the geo conversion needs pyproj
+
+    intersections = read_intersections(args.tl_info)
+    counter = ApproachCounter(intersections, bin_size=args.bin_size, radius=args.radius, entity_types=args.entity_types.split(","))
+    for feed_file in args.feed_files:
+        print(f"Reading data from file: {feed_file}")
+        for record in read_records(feed_file):
+            counter.add(record)
+    counts = counter.finish()
+    print(f"Records: {dict(counter.stats)}")
+    if not counts:
+        sys.exit("no vehicle approaching the intersections")
+
+    mapping = map_approaches(sumolib.net.readNet(args.net), intersections)
+    for tl_id, approaches in mapping.items():
+        print(f"{tl_id}: " + ", ".join(f"{approach} <- {edge.getID()}" for approach, (edge, _) in approaches.items()))
+
+    num_flows = write_flows(counts, mapping, args.output, args.bin_size, args.penetration)
+    write_config(args.base_config, args.output_config, args.output)
+    print(f"{num_flows} flows written to {args.output} ({args.output_config})")
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import random
+import pstats
+import cProfile
+import optparse
+import numpy as np
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+from marl_tls.env import TLSEnv
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--simulation", action="store", type="string", default="cross/cross", help="path to the simulation")
+    optParser.add_option("--trace", action="store", type="string", default="data/traci_trace.gz", help="TraCI trace file")
+    optParser.add_option("--record", action="store_true", default=False, help="run SUMO and record the trace (default: replay it)")
+    optParser.add_option("--steps", action="store", type="int", default=1000, help="env steps of the episode")
+    optParser.add_option("--traffic_scale", action="store", type="float", default=2, help="Scale Traffic")
+    optParser.add_option("--seed", action="store", type="int", default=0, help="seed of the random actions")
+    optParser.add_option("--city_scale", action="store_true", default=False, help="fetch the detector data with TraCI subscriptions (large networks)")
+    optParser.add_option("--profile", action="store_true", default=False, help="print the cProfile statistics of the replayed episode")
+    options, args = optParser.parse_args()
+    return options
+
+
+def run(env, steps, seed):
+    """ One episode with seeded random actions: (elapsed time of the steps, [observations + rewards of each step]) """
+    rng = random.Random(seed)
+    env.reset()
+    outputs = []
+    start = time.time()
+    for _ in range(steps):
+        actions = {tls_id: rng.randrange(tls.num_actions) for tls_id, tls in env.list_tls.items()}
+        observations, rewards, _, _, _ = env.step(actions)
+        outputs.append(np.concatenate([np.concatenate([observations[tls_id] for tls_id in env.list_tls_id]), [rewards[tls_id] for tls_id in env.list_tls_id]]))
+    return time.time() - start, outputs
+
+
+if __name__ == "__main__":
+    options = get_options()
+    outputs_file = options.trace + ".outputs.npz"
+    env_kwargs = dict(
+        simulation_path=options.simulation,
+        traffic_scale=options.traffic_scale,
+        end=options.steps + 1,
+        city_scale=options.city_scale,
+        simulation_label="Replay",
+    )
+
+    if options.record:
+        env = TLSEnv(record_trace=options.trace, **env_kwargs)
+        elapsed, outputs = run(env, options.steps, options.seed)
+        env.close()
+        np.savez_compressed(outputs_file, outputs=np.array(outputs), elapsed=elapsed)
+        print(f"Recorded {options.steps} steps with SUMO: {elapsed / options.steps * 1000:.2f} ms/step, trace {os.path.getsize(options.trace)} bytes")
+        sys.exit()
+
+    env = TLSEnv(replay_trace=options.trace, **env_kwargs)
+    profiler = cProfile.Profile() if options.profile else None
+    if profiler is not None:
+        profiler.enable()
+    elapsed, outputs = run(env, options.steps, options.seed)
+    if profiler is not None:
+        profiler.disable()
+    env.close()
+
+    recorded = np.load(outputs_file)
+    print(f"Replayed {options.steps} steps: {elapsed / options.steps * 1000:.2f} ms/step (recording with SUMO: {float(recorded['elapsed']) / options.steps * 1000:.2f} ms/step)")
+    different = [step for step, (output, expected) in enumerate(zip(outputs, recorded["outputs"])) if not np.array_equal(output, expected)]
+    print("Outputs identical to the recording" if not different else f"Outputs differ from the recording at {len(different)} steps (first: {different[0]})")
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
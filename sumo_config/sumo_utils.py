@@ -1,5 +1,8 @@
 import xml.etree.ElementTree as ET
+import os
+import sys
 import random
+import subprocess
 import time
 
 def generate_route_file(filename):
@@ -48,6 +51,65 @@ guiShape="passenger"/>
         print("</routes>", file=routes)
 
 
+def generate_grid_network(directory, x_number, y_number, end=3600, period=None, detector_length=60, seed=42):
+    """ Generate a synthetic grid simulation (<directory>/grid.sumocfg) with a TLS and lanearea detectors at every grid junction """
+    import sumolib
+    from sumolib import checkBinary
 
+    os.makedirs(directory, exist_ok=True)
+    net_file = os.path.join(directory, "grid.net.xml")
+    trips_file = os.path.join(directory, "grid.trips.xml")
+    det_file = os.path.join(directory, "grid.det.xml")
 
+    ## Grid (junction ids prefixed with TLS), then traffic lights on the grid junctions only (not the fringe nodes)
+    subprocess.run([
+        checkBinary("netgenerate"), "--grid",
+        "--grid.x-number", str(x_number), "--grid.y-number", str(y_number),
+        "--grid.attach-length", "100",
+        "--prefix.junction", "TLS",
+        "--no-turnarounds", "true",
+        "-o", net_file
+    ], check=True, stdout=subprocess.DEVNULL)
+    net = sumolib.net.readNet(net_file)
+    junctions = [node.getID() for node in net.getNodes() if len(node.getIncoming()) == 4]
+    subprocess.run([
+        checkBinary("netconvert"),
+        "-s", net_file,
+        "--tls.set", ",".join(junctions),
+        "-o", net_file
+    ], check=True, stdout=subprocess.DEVNULL)
 
+    ## Detector ID: TLS<junction>_Det<detector_num> on every incoming lane
+    net = sumolib.net.readNet(net_file)
+    with open(det_file, "w") as detectors:
+        print("<additional>", file=detectors)
+        for junction_id in sorted(junctions):
+            lanes = [lane for edge in net.getNode(junction_id).getIncoming() for lane in edge.getLanes()]
+            for detector_num, lane in enumerate(lanes, start=1):
+                print('    <laneAreaDetector id="%s_Det%i" lane="%s" endPos="-1" file="NUL" length="%.2f" friendlyPos="x"/>' % (
+                    junction_id, detector_num, lane.getID(), min(detector_length, lane.getLength())), file=detectors)
+        print("</additional>", file=detectors)
+
+    ## Random demand proportional to the grid size
+    period = period if period is not None else 6.0 / len(junctions)
+    subprocess.run([
+        sys.executable, os.path.join(os.environ["SUMO_HOME"], "tools", "randomTrips.py"),
+        "-n", net_file, "-o", trips_file, "-r", os.path.join(directory, "grid.validated.rou.xml"),
+        "-e", str(end), "-p", str(period),
+        "--fringe-factor", "10", "--seed", str(seed), "--validate"
+    ], check=True, stdout=subprocess.DEVNULL)
+
+    with open(os.path.join(directory, "grid.sumocfg"), "w") as config:
+        print("""<configuration>
+    <input>
+        <net-file value="grid.net.xml"/>
+        <route-files value="grid.trips.xml"/>
+        <additional-files value="grid.det.xml"/>
+    </input>
+    <time>
+        <begin value="0"/>
+        <end value="%i"/>
+    </time>
+</configuration>""" % end, file=config)
+
+    return junctions
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import random
+import optparse
+import numpy as np
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+from marl_tls.env import TLSEnv
+from marl_tls.surrogate_env import calibrate, SurrogateVecEnv
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--simulation", action="store", type="string", default="aveiro_traffic/osm", help="path to the simulation")
+    optParser.add_option("--calibration", action="store", type="string", default=None, help="calibration file (calibrated and saved here if missing)")
+    optParser.add_option("--traffic_scale", action="store", type="float", default=2.5, help="Scale Traffic")
+    optParser.add_option("--steps", action="store", type="int", default=1000, help="simulation steps of each run")
+    optParser.add_option("--num_envs", action="store", type="int", default=64, help="surrogate environments stepped together")
+    options, args = optParser.parse_args()
+    return options
+
+
+def run_sumo(options):
+    """ Random actions in TLSEnv: (agent-steps/s, mean weighted waiting time per TLS and step) """
+    env = TLSEnv(simulation_path=options.simulation, traffic_scale=options.traffic_scale, end=options.steps, simulation_label="Surrogate_sumo")
+    env.reset()
+    rng = random.Random(0)
+    waiting = []
+    start = time.time()
+    for _ in range(options.steps):
+        _, _, _, _, infos = env.step({tls_id: rng.randrange(tls.num_actions) for tls_id, tls in env.list_tls.items()})
+        waiting.append(np.mean([private + tls.public_transport_weight * public for (private, public), tls in
+                                zip((infos[tls_id]["total_accumulated_waiting"] for tls_id in env.list_tls_id), env.list_tls.values())]))
+    elapsed = time.time() - start
+    agent_steps = options.steps * len(env.list_tls_id)
+    env.close()
+    return agent_steps / elapsed, np.mean(waiting)
+
+
+def run_surrogate(options, calibration):
+    """ Random actions in SurrogateVecEnv: (agent-steps/s, mean weighted waiting time per TLS and step) """
+    vec_env = SurrogateVecEnv(calibration, num_envs=options.num_envs, traffic_scale=options.traffic_scale, end=options.steps, seed=0)
+    vec_env.reset()
+    simulator = vec_env.simulator
+    waiting = []
+    start = time.time()
+    for _ in range(options.steps):
+        vec_env.step(np.random.randint(0, simulator.num_actions, (options.num_envs, simulator.num_tls)).ravel())
+        private, public = simulator.accumulated_waiting()
+        waiting.append((private + simulator.public_transport_weight * public).mean())
+    elapsed = time.time() - start
+    return vec_env.num_envs * options.steps / elapsed, np.mean(waiting)
+
+
+if __name__ == "__main__":
+    options = get_options()
+
+    calibration = options.calibration
+    if calibration is None or not os.path.exists(calibration):
+        print("Calibrating the surrogate...")
+        calibration = calibrate(options.simulation, traffic_scale=options.traffic_scale, output=calibration)
+
+    sumo_speed, sumo_waiting = run_sumo(options)
+    surrogate_speed, surrogate_waiting = run_surrogate(options, calibration)
+
+    print(f"{'':10s} {'agent-steps/s':>14s} {'waiting/TLS':>12s}")
+    print(f"{'SUMO':10s} {sumo_speed:14.0f} {sumo_waiting:12.1f}")
+    print(f"{'surrogate':10s} {surrogate_speed:14.0f} {surrogate_waiting:12.1f}")
+    print(f"Speedup: {surrogate_speed / sumo_speed:.0f}x")
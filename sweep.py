@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import optparse
+
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+from marl_tls.sweep import run_sweep
+
+## Default search space (see marl_tls.sweep.sample_params)
+DEFAULT_SPACE = {
+    "delta_time": [5, 10, 15],
+    "min_phase_time": [5, 10, 15],
+    "yellow_time": [3, 4, 5],
+    "public_transport_weight": [1, 2, 5, 10],
+    "learning_rate": {"low": 1e-4, "high": 1e-3, "log": True},
+    "n_steps": [512, 1024, 2048],
+    "batch_size": [64, 128, 256],
+    "gamma": {"low": 0.9, "high": 0.999},
+    "ent_coef": {"low": 1e-4, "high": 1e-2, "log": True},
+}
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--space", action="store", type="string", default=None, help="JSON file with the search space (default: DEFAULT_SPACE)")
+    optParser.add_option("--directory", action="store", type="string", default="data/sweep", help="trial database, models and logs (resumed if it exists)")
+    optParser.add_option("--simulation", action="store", type="string", default="cross/cross", help="path to the simulation")
+    optParser.add_option("--trials", action="store", type="int", default=20, help="number of trials")
+    optParser.add_option("--timesteps", action="store", type="int", default=100000, help="number of timesteps per trial")
+    optParser.add_option("--cpus_per_trial", action="store", type="int", default=1, help="CPUs pinned to each trial (one worker per CPU set)")
+    optParser.add_option("--metric", action="store", type="string", default="analysis/waiting_private_transport+analysis/waiting_public_transport", help="'+' separated analysis/* metrics to optimize")
+    optParser.add_option("--maximize", action="store_true", default=False, help="maximize the metric (e.g. analysis/last_reward)")
+    optParser.add_option("--report_interval", action="store", type="int", default=10000, help="timesteps between the pruning checks")
+    optParser.add_option("--startup_trials", action="store", type="int", default=3, help="completed trials before pruning")
+    optParser.add_option("--end", action="store", type="int", default=2250, help="simulation end time (unless in the search space)")
+    optParser.add_option("--seed", action="store", type="int", default=0, help="seed of the sampled configurations")
+    options, args = optParser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+
+    space = DEFAULT_SPACE
+    if options.space is not None:
+        with open(options.space, "r") as file:
+            space = json.load(file)
+
+    best = run_sweep(
+        space,
+        options.directory,
+        simulation=options.simulation,
+        num_trials=options.trials,
+        timesteps=options.timesteps,
+        cpus_per_trial=options.cpus_per_trial,
+        metric=options.metric,
+        maximize=options.maximize,
+        report_interval=options.report_interval,
+        startup_trials=options.startup_trials,
+        end=options.end,
+        seed=options.seed,
+    )
+
+    if best is None:
+        print("No completed trial")
+    else:
+        trial_id, params, value = best
+        print(f"Best trial {trial_id} ({value}): {params}")
+        print(f"Model: {os.path.join(options.directory, 'trial_%d.zip' % trial_id)}")
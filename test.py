@@ -1,8 +1,12 @@
+import os
 import gymnasium as gym
 import sys
+import numpy as np
 from stable_baselines3 import PPO
 from stable_baselines3.common.env_checker import check_env
 from marl_tls.env import TLSEnv
+from marl_tls.decision_ppo import get_decision_mask
+from marl_tls.bucket_env import BucketPPO
 import optparse
 
 def get_options():
@@ -12,19 +16,62 @@ def get_options():
     optParser.add_option("--simulation", action="store", type="string", default="cross/cross", help="path to the simulation")
     optParser.add_option("--traffic_scale", action="store", type="string", default="1", help="Scale Traffic")
     optParser.add_option("--render_mode", action="store", type="string", default="human", help="Render Mode")
+    optParser.add_option("--normalize_observations", action="store_true", default=False, help="running mean/variance normalization of the observations (as in training)")
+    optParser.add_option("--stack_frames", action="store", type="int", default=1, help="number of stacked observation frames (as in training)")
+    optParser.add_option("--record_rollouts", action="store", type="string", default=None, help="directory to record the transitions (memory-mapped dataset)")
+    optParser.add_option("--bucketed", action="store_true", default=False, help="model trained with one policy per bucket (train.py --bucketed)")
+    optParser.add_option("--decision_scheduling", action="store_true", default=False, help="only run the policy for agents that are not locked")
+    optParser.add_option("--end", action="store", type="int", default=2250, help="simulation end time")
+    optParser.add_option("--delta_time", action="store", type="int", default=5, help="time steps between the agent decisions")
+    optParser.add_option("--min_phase_time", action="store", type="int", default=5, help="minimum time of a phase")
+    optParser.add_option("--yellow_time", action="store", type="int", default=5, help="yellow time")
+    optParser.add_option("--public_transport_weight", action="store", type="float", default=5, help="weight of the public transport in the observations and reward")
+    optParser.add_option("--fidelity", action="store", type="choice", choices=["micro", "meso"], default="micro", help="micro or meso (mesoscopic pre-training, then --retrain_model with micro)")
+    optParser.add_option("--city_scale", action="store_true", default=False, help="fetch the detector data with TraCI subscriptions (large networks)")
+    optParser.add_option("--phase_check_interval", action="store", type="int", default=0, help="steps between the checks of the local TLS phases against SUMO (debugging)")
 
     options, args = optParser.parse_args()
+
+    ## The bucketed models run every agent at every step
+    if options.bucketed and options.decision_scheduling:
+        optParser.error("--bucketed does not support --decision_scheduling")
     return options
 
-def run(vec_env, model, end):
+def run(vec_env, model, end, decision_scheduling=False):
     obs = vec_env.reset()
     step = 0
+    policy_evaluations = 0
+    actions = np.zeros(vec_env.num_envs, dtype=np.int64)
+    mask = np.ones(vec_env.num_envs, dtype=bool) # every agent decides at the start
     while True:
-        actions, _states = model.predict(obs)
+        if not decision_scheduling:
+            actions, _states = model.predict(obs)
+            policy_evaluations += vec_env.num_envs
+        elif mask.any():
+            # Locked agents keep their last action (it is discarded by the environment)
+            actions[mask], _states = model.predict(obs[mask])
+            policy_evaluations += int(mask.sum())
         obs, rewards, dones, infos = vec_env.step(actions)
+        mask = get_decision_mask(infos, dones)
         step += 1
         if step >= end - 1: # end-1 because vec_env.reset() is called inside step() and starts a new simulation
             break
+    
+    print(f"Policy evaluations: {policy_evaluations} / {step * vec_env.num_envs} agent-steps")
+
+def report_phase_mismatches(tls_env):
+    """ Local TLS phases that differed from SUMO at the checks (--phase_check_interval) """
+    mismatches = {tls_id: tls.phase_mismatches for tls_id, tls in tls_env.list_tls.items() if tls.phase_mismatches}
+    print(f"Phase mismatches: {sum(mismatches.values())}" + (f" {mismatches}" if mismatches else ""))
+
+def run_bucketed(model, end):
+    vec_envs = model.bucket_env.vec_envs
+    obs = {bucket: vec_env.reset() for bucket, vec_env in vec_envs.items()}
+    for step in range(end - 1):
+        actions = model.predict(obs)
+        for bucket, vec_env in vec_envs.items():
+            vec_env.step_async(actions[bucket])
+        obs = {bucket: vec_env.step_wait()[0] for bucket, vec_env in vec_envs.items()}
 
 if __name__ == "__main__":
     options = get_options()
@@ -33,20 +80,54 @@ if __name__ == "__main__":
     simulation_path = options.simulation
     traffic_scale = options.traffic_scale
     render_mode = options.render_mode
-
-    model = PPO.load(load_model)
+    decision_scheduling = options.decision_scheduling
+    city_scale = options.city_scale
+    normalize_observations = options.normalize_observations
+    stack_frames = options.stack_frames
+    record_rollouts = options.record_rollouts
+    bucketed = options.bucketed
+    
+    end = options.end
     
-    end = 2250
+    ## Observation statistics are saved next to the model zip
+    observation_stats = load_model + "_obs_stats.npz"
+    if not os.path.exists(observation_stats):
+        if normalize_observations:
+            sys.exit(f"missing observation statistics {observation_stats} (saved by train.py --normalize_observations)")
+        observation_stats = None
     
-    vec_env = TLSEnv.get_vec_env(
-        TLSEnv,
+    env_kwargs = dict(
         render_mode=render_mode if render_mode == "human" else None,
         simulation_path=simulation_path,
         traffic_scale=traffic_scale,
         end=end,
+        normalize_observations=normalize_observations,
+        stack_frames=stack_frames,
+        observation_stats=observation_stats,
+        city_scale=city_scale,
+        delta_time=options.delta_time,
+        min_phase_time=options.min_phase_time,
+        yellow_time=options.yellow_time,
+        public_transport_weight=options.public_transport_weight,
+        fidelity=options.fidelity,
+        phase_check_interval=options.phase_check_interval,
+        update_observation_stats=False
     ) # new environment with human visualization
     
-    run(vec_env, model,end)
-    vec_env.close()
-    
-    
\ No newline at end of file
+    if bucketed:
+        env = TLSEnv(**env_kwargs)
+        if record_rollouts is not None:
+            env.start_recording(record_rollouts)
+        run_bucketed(BucketPPO.load(load_model, env), end)
+        if options.phase_check_interval:
+            report_phase_mismatches(env)
+        env.close()
+    else:
+        model = PPO.load(load_model)
+        vec_env = TLSEnv.get_vec_env(TLSEnv, **env_kwargs)
+        if record_rollouts is not None:
+            vec_env.tls_env.start_recording(record_rollouts)
+        run(vec_env, model, end, decision_scheduling)
+        if options.phase_check_interval:
+            report_phase_mismatches(vec_env.tls_env)
+        vec_env.close()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+## The tests import the repo modules (they need SUMO_HOME for the traci/sumolib packages, not a running SUMO)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
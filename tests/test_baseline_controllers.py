@@ -0,0 +1,38 @@
+import os
+import shutil
+import pytest
+import traci
+import traci.constants as tc
+from sumolib import checkBinary
+from marl_tls.env import TLSEnv
+from marl_tls.baseline_controllers import CONTROLLERS, run_baseline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.skipif(shutil.which(checkBinary("sumo")) is None, reason="needs the sumo binary")
+@pytest.mark.parametrize("controller", list(CONTROLLERS))
+def test_city_scale_collect(tmp_path, monkeypatch, controller):
+    """ The controller counts and the city-scale vehicle lists share the detector subscriptions """
+    ## The env regenerates the route file: run on a copy of the simulation
+    shutil.copytree(os.path.join(ROOT, "sumo_config", "cross"), tmp_path / "sumo_config" / "cross")
+    monkeypatch.chdir(tmp_path)
+
+    ## Last subscription of each detector: TraCI (1.20) replaces the variables of an earlier one
+    subscriptions = {}
+    subscribe = traci.lanearea.subscribe
+    def record_subscription(detector_id, variables, *args, **kwargs):
+        subscriptions[detector_id] = set(variables)
+        return subscribe(detector_id, variables, *args, **kwargs)
+    monkeypatch.setattr(traci.lanearea, "subscribe", record_subscription)
+
+    env = TLSEnv(render_mode=None, simulation_path="cross/cross", traffic_scale=2, end=60, city_scale=True, simulation_label="test_" + controller)
+    try:
+        stats = run_baseline(env, CONTROLLERS[controller](env), collect=True)
+    finally:
+        env.close()
+    assert stats["steps"] == 60
+    assert subscriptions and all(
+        variables >= {tc.LAST_STEP_VEHICLE_ID_LIST, tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_VEHICLE_HALTING_NUMBER}
+        for variables in subscriptions.values()
+    )
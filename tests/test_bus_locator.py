@@ -0,0 +1,51 @@
+from real_data_processors.bus_locator import BusLocator, CELL_SIZE
+
+TL_LAT, TL_LON = 40.0, -8.0
+
+
+def bus(bus_id, seconds, lat, lon=TL_LON, heading=0, speed=10, entity_type="Bus"):
+    return {
+        "entityType": entity_type,
+        "entityId": bus_id,
+        "eventTimestamp": {"$date": "2024-01-01T00:00:%02dZ" % seconds},
+        "location": {"coordinates": [lon, lat]},
+        "heading": heading,
+        "speed": speed,
+    }
+
+
+def approaching(locator, horizon=60):
+    return [(found["bus_id"], found["approach"]) for found in locator.get_approaching_buses(TL_LAT, TL_LON, horizon)]
+
+
+def test_only_the_buses_driving_towards_the_intersection():
+    locator = BusLocator(json_file_path=None)
+    locator.process_data(bus("north_bound", 0, 39.998))                  # 222 m south, driving north
+    locator.process_data(bus("south_bound", 0, 39.998, heading=180))     # driving away
+    locator.process_data(bus("stopped", 0, 39.999, speed=0))
+    locator.process_data(bus("no_heading", 0, 39.999, heading=3601))
+    locator.process_data(bus("far", 0, 39.9))                            # 11 km: beyond the horizon
+    locator.process_data(bus("west", 0, TL_LAT, lon=-8.001, heading=90, speed=5))
+    locator.process_data(bus("car", 0, 39.999, entity_type="Car"))
+
+    assert approaching(locator) == [("west", "W"), ("north_bound", "S")]     # by arrival time: 17 s, 22 s
+    assert approaching(locator, horizon=10) == []
+
+
+def test_grid_follows_the_buses():
+    locator = BusLocator(json_file_path=None)
+    locator.process_data(bus("b1", 0, 39.998))
+    first_cell = locator.bus_cell["b1"]
+    locator.process_data(bus("b1", 1, 39.998 + CELL_SIZE))
+    assert locator.bus_cell["b1"] != first_cell
+    assert first_cell not in locator.grid
+    assert locator.grid[locator.bus_cell["b1"]] == {"b1"}
+
+
+def test_expired_buses_are_dropped():
+    locator = BusLocator(json_file_path=None)
+    locator.process_data(bus("old", 0, 39.998))
+    locator.process_data(bus("new", 10, 39.997))        # more than DATA_TIMEOUT later
+    assert list(locator.bus_location) == ["new"]
+    assert "old" not in locator.bus_cell and "old" not in locator.bus_motion
+    assert approaching(locator) == [("new", "S")]
@@ -0,0 +1,86 @@
+import numpy as np
+import gymnasium as gym
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import DummyVecEnv
+from marl_tls.decision_ppo import DecisionRolloutBuffer, DecisionPPO
+
+
+def make_buffer(n_envs=1, gamma=0.9, gae_lambda=1.0):
+    return DecisionRolloutBuffer(10, spaces.Box(0, 30, (2,), dtype=np.int32), spaces.Discrete(2), gamma=gamma, gae_lambda=gae_lambda, n_envs=n_envs)
+
+
+def decide(buffer, mask, values):
+    mask = np.array(mask, dtype=bool)
+    n = int(mask.sum())
+    buffer.add_decisions(mask, np.zeros((n, 2)), np.zeros(n), th.tensor(values, dtype=th.float32), th.zeros(n))
+
+
+def test_locked_interval_is_discounted_per_env_step():
+    buffer = make_buffer()
+    decide(buffer, [True], [0.5])
+    buffer.add_rewards([1.0], [False])
+    buffer.add_rewards([2.0], [False])     # locked step
+    decide(buffer, [True], [0.2])
+    buffer.add_rewards([3.0], [False])
+    buffer.compute_returns_and_advantage(th.tensor([1.0]), np.array([False]))
+
+    # R0 = 1 + 0.9 * 2 over k = 2 steps, R1 = 3 over k = 1 step, bootstrap V = 1
+    g1 = 3 + 0.9 * 1.0
+    g0 = (1 + 0.9 * 2) + 0.9 ** 2 * g1
+    assert buffer.size == 2
+    np.testing.assert_allclose(buffer.steps[:2], [2, 1])
+    np.testing.assert_allclose(buffer.returns, [g0, g1], rtol=1e-6)
+    np.testing.assert_allclose(buffer.advantages, [g0 - 0.5, g1 - 0.2], rtol=1e-6)
+
+
+def test_episode_end_stops_bootstrapping():
+    buffer = make_buffer(gae_lambda=0.5)
+    decide(buffer, [True], [0.5])
+    buffer.add_rewards([1.0], [True])       # the episode ends
+    decide(buffer, [True], [0.3])
+    buffer.add_rewards([2.0], [False])
+    buffer.compute_returns_and_advantage(th.tensor([1.0]), np.array([False]))
+
+    a1 = 2 + 0.9 * 1.0 - 0.3
+    a0 = 1 - 0.5                            # no bootstrap across the episode boundary
+    np.testing.assert_allclose(buffer.advantages, [a0, a1], rtol=1e-6)
+
+
+def test_storage_follows_the_decisions():
+    buffer = make_buffer(n_envs=3)
+    decide(buffer, [True, True, True], [0, 0, 0])
+    for step in range(5):
+        buffer.add_rewards([1.0, 1.0, 1.0], [False] * 3)
+        decide(buffer, [False, True, False], [0])      # only the second agent decides again
+    buffer.compute_returns_and_advantage(th.zeros(3), np.zeros(3, dtype=bool))
+
+    assert buffer.num_samples == 3 + 5
+    np.testing.assert_allclose(buffer.steps[:3], [5, 1, 5])
+    assert len(list(buffer.get(batch_size=4))) == 2
+
+
+class LockedEnv(gym.Env):
+    """ Agent that only decides every third step """
+    observation_space = spaces.Box(0, 30, (2,), dtype=np.float32)
+    action_space = spaces.Discrete(2)
+
+    def reset(self, seed=None, options=None):
+        self.step_count = 0
+        return np.zeros(2, dtype=np.float32), {"needs_decision": True}
+
+    def step(self, action):
+        self.step_count += 1
+        return np.zeros(2, dtype=np.float32), 1.0, False, False, {"needs_decision": self.step_count % 3 == 0}
+
+
+def test_reloaded_model_decides_after_the_env_reset(tmp_path):
+    model = DecisionPPO("MlpPolicy", DummyVecEnv([LockedEnv, LockedEnv]), n_steps=4, batch_size=4, n_epochs=1)
+    model.learn(total_timesteps=4)
+    assert not model._last_decision_mask.any()      # both agents are locked after the 4th step
+    model.save(str(tmp_path / "model"))
+
+    model = DecisionPPO.load(str(tmp_path / "model"), DummyVecEnv([LockedEnv, LockedEnv]))
+    model.learn(total_timesteps=4, reset_num_timesteps=False)
+    ## Steps 1 and 4 of the new episodes are decisions of both agents
+    assert model.rollout_buffer.size == 4
@@ -0,0 +1,40 @@
+from real_data_processors.demand_converter import ApproachCounter
+
+START = 1704067200     # 2024-01-01T00:00:00Z, start of a 300 s bin
+INTERSECTIONS = {"TL1": (40.0, -8.0)}
+
+
+def report(vehicle_id, seconds, lat=39.9995, heading=0):
+    """ Car south of TL1 driving north (towards it) """
+    hours, rest = divmod(seconds, 3600)
+    return {
+        "entityType": "Car",
+        "entityId": vehicle_id,
+        "heading": heading,
+        "eventTimestamp": {"$date": "2024-01-01T%02d:%02d:%02dZ" % (hours, rest // 60, rest % 60)},
+        "location": {"coordinates": [-8.0, lat]},
+    }
+
+
+def test_vehicle_spanning_a_bin_boundary_is_counted_once():
+    counter = ApproachCounter(INTERSECTIONS, bin_size=300)
+    for seconds in (290, 295, 305, 320):
+        counter.add(report("car1", seconds))
+    counter.add(report("car2", 310))
+    counts = counter.finish()
+
+    first_bin = START // 300
+    assert counts == {(first_bin, "TL1", "S", "Car"): 1, (first_bin + 1, "TL1", "S", "Car"): 1}
+
+
+def test_vehicle_is_counted_again_after_it_is_forgotten():
+    counter = ApproachCounter(INTERSECTIONS, bin_size=300, open_bins=2)
+    counter.add(report("car1", 10))
+    counter.add(report("car2", 1000))       # bin 3: car1 has no report after bin 1
+    counter.add(report("car1", 1010))
+    counter.add(report("car3", 1020, heading=180))     # driving away from TL1
+    counts = counter.finish()
+
+    first_bin = START // 300
+    assert counts == {(first_bin, "TL1", "S", "Car"): 1, (first_bin + 3, "TL1", "S", "Car"): 2}
+    assert counter.stats["counted"] == 3
@@ -0,0 +1,71 @@
+import itertools
+import numpy as np
+from gymnasium import spaces
+from marl_tls.lookup_policy import LookupTablePolicy, save_lookup_policy
+from marl_tls import policy_compiler
+from marl_tls.policy_compiler import bin_values, compile_policy, sample_agreement
+
+BOUNDARIES = [1, 2, 4, 7, 11, 16]
+TLS_SHAPES = {"TLS1": (2, 4), "TLS2": (1, 2)}    # (num_detectors, num_phases)
+
+
+class BinnedModel:
+    """ Fake model (padded to 6 inputs) whose action only changes at the bin boundaries """
+    observation_space = spaces.Box(0, 30, (6,), dtype=np.float32)
+
+    def predict(self, observations, deterministic=True):
+        ## TLS1: [weight 0, weight 1, phase, available], TLS2: [weight 0, phase, available]
+        actions = (observations[:, 0] >= 4) ^ (observations[:, 2] >= 2)
+        invalid = observations[:, 1] >= 16     # padded action of TLS1
+        return np.where(invalid, 3, actions).astype(np.int64), None
+
+
+def test_index_enumerates_the_table(tmp_path):
+    path = str(tmp_path / "policy.json")
+    num_detectors, num_phases = TLS_SHAPES["TLS1"]
+    values = bin_values(BOUNDARIES)
+    num_entries = len(values) ** num_detectors * num_phases * 2
+    save_lookup_policy(path, {"TLS1": (num_detectors, num_phases, bytes(num_entries))}, BOUNDARIES)
+    policy = LookupTablePolicy(path)
+
+    indices = [
+        policy.index("TLS1", [values[bin0], values[bin1], phase, available])
+        for bin0, bin1, phase, available in itertools.product(range(len(values)), range(len(values)), range(num_phases), range(2))
+    ]
+    assert indices == list(range(num_entries))
+
+    ## Every weight of a bin has the index of the bin
+    assert policy.index("TLS1", [4, 0, 0, 0]) == policy.index("TLS1", [6.9, 0.5, 0, 0])
+    assert policy.index("TLS1", [30, 0, 0, 0]) == policy.index("TLS1", [16, 0, 0, 0])
+
+
+def test_compiled_tables_round_trip(tmp_path):
+    model = BinnedModel()
+    tables, skipped = compile_policy(model, TLS_SHAPES, BOUNDARIES)
+    assert skipped == {}
+    path = str(tmp_path / "policy.json")
+    save_lookup_policy(path, tables, BOUNDARIES)
+
+    policy = LookupTablePolicy(path)
+    assert policy.boundaries == BOUNDARIES
+    for tls_id, (num_detectors, num_phases) in TLS_SHAPES.items():
+        assert policy.tables[tls_id] == (num_detectors, num_phases, tables[tls_id][2])
+    assert sample_agreement(model, policy, TLS_SHAPES, samples=2000) == {"TLS1": 1.0, "TLS2": 1.0}
+
+    assert policy.act("TLS1", [5, 0, 0, 1]) == 1
+    assert policy.act("TLS1", [5, 0, 2, 1]) == 0
+    assert policy.act("TLS1", [5, 20, 0, 1]) == 0      # padded action: action 0
+    assert policy.act_all({"TLS2": [3.9, 0, 1]}) == {"TLS2": 0}
+
+
+def test_too_large_tables_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(policy_compiler, "MAX_TABLE_ENTRIES", 100)     # TLS1: 7 ** 2 * 4 * 2 = 392 entries, TLS2: 7 * 2 * 2 = 28
+    model = BinnedModel()
+    tables, skipped = compile_policy(model, TLS_SHAPES, BOUNDARIES)
+    assert skipped == {"TLS1": 392}
+    path = str(tmp_path / "policy.json")
+    save_lookup_policy(path, tables, BOUNDARIES)
+
+    policy = LookupTablePolicy(path)
+    assert list(policy.tables) == ["TLS2"]
+    assert sample_agreement(model, policy, {"TLS2": TLS_SHAPES["TLS2"]}, samples=500) == {"TLS2": 1.0}
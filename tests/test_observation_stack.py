@@ -0,0 +1,50 @@
+import numpy as np
+from gymnasium import spaces
+from marl_tls.observation_stack import ObservationStack
+
+
+def make_spaces():
+    return {
+        "A": spaces.Box(0, 30, (2,), dtype=np.float32),
+        "B": spaces.Box(0, 30, (3,), dtype=np.float32),
+    }
+
+
+def observations(value):
+    return {"A": np.full(2, value, dtype=np.float32), "B": np.full(3, 10 * value, dtype=np.float32)}
+
+
+def test_frames_are_stacked_oldest_first():
+    stack = ObservationStack(make_spaces(), stack_frames=3)
+    assert stack.observation_spaces["A"].shape == (6,)
+    assert stack.observation_spaces["B"].shape == (9,)
+
+    stacked = stack.reset(observations(1))
+    np.testing.assert_array_equal(stacked["A"], [1, 1, 1, 1, 1, 1])
+    stack.step(observations(2))
+    stacked = stack.step(observations(3))
+    np.testing.assert_array_equal(stacked["A"], [1, 1, 2, 2, 3, 3])
+    np.testing.assert_array_equal(stacked["B"], [10] * 3 + [20] * 3 + [30] * 3)
+
+    ## The ring buffer wraps around
+    stacked = stack.step(observations(4))
+    np.testing.assert_array_equal(stacked["A"], [2, 2, 3, 3, 4, 4])
+
+
+def test_saved_statistics_normalize_like_the_training_ones(tmp_path):
+    stack = ObservationStack(make_spaces(), normalize=True)
+    stack.reset(observations(1))
+    for value in range(2, 10):
+        stack.step(observations(value))
+    path = str(tmp_path / "obs_stats.npz")
+    stack.save(path)
+
+    loaded = ObservationStack(make_spaces(), normalize=True)
+    loaded.load(path)
+    loaded.training = False
+    stack.training = False
+    expected = stack.reset(observations(5))
+    stacked = loaded.reset(observations(5))
+    np.testing.assert_allclose(stacked["A"], expected["A"])
+    np.testing.assert_allclose(stacked["B"], expected["B"])
+    assert np.all(np.abs(stacked["B"]) <= stack.clip_obs)
@@ -0,0 +1,25 @@
+import numpy as np
+from gymnasium import spaces
+from marl_tls.rollout_recorder import RolloutRecorder, RolloutDataset
+
+
+def record(recorder, step):
+    recorder.record({"A": np.full(2, step, dtype=np.float32)}, {"A": step % 2}, {"A": float(step)}, {"A": False}, {"A": {"queue": step}})
+
+
+def test_finalized_chunks_are_readable_before_close(tmp_path):
+    recorder = RolloutRecorder(str(tmp_path), {"A": spaces.Box(0, 30, (2,), dtype=np.float32)}, chunk_size=4)
+    for step in range(6):
+        record(recorder, step)
+
+    ## Only the finalized chunk is listed while the second one is open
+    dataset = RolloutDataset(str(tmp_path))
+    assert dataset.chunks == {"A": [4]}
+    assert len(dataset) == 4
+
+    recorder.close()
+    dataset = RolloutDataset(str(tmp_path))
+    assert dataset.chunks == {"A": [4, 2]}
+    rewards = np.concatenate([chunk["reward"] for _, chunk in dataset.iter_chunks()])
+    np.testing.assert_array_equal(rewards, np.arange(6))
+    assert not (tmp_path / "metadata.json.tmp").exists()
@@ -0,0 +1,86 @@
+import pytest
+import traci
+from traci._trafficlight import Logic, Phase
+from marl_tls.smart_tls import SmartTLS
+
+PHASE_DURATIONS = [3, 1, 2]
+
+
+class FakeDetectorIndex:
+    detectors = {"TLS1": ["TLS1_Det0"]}
+
+
+def make_tls(monkeypatch, step_length=1, phase_check_interval=0):
+    """ SmartTLS on a fake TraCI: program "1" runs, phase 0 started at time 0 """
+    logics = [
+        Logic("0", 0, 0, [Phase(30, "G"), Phase(5, "y")]),
+        Logic("1", 0, 0, [Phase(duration, "G") for duration in PHASE_DURATIONS]),
+    ]
+    set_phases = []
+    monkeypatch.setattr(traci.trafficlight, "getProgram", lambda tls_id: "1")
+    monkeypatch.setattr(traci.trafficlight, "getAllProgramLogics", lambda tls_id: logics)
+    monkeypatch.setattr(traci.trafficlight, "getPhase", lambda tls_id: 0)
+    monkeypatch.setattr(traci.trafficlight, "getNextSwitch", lambda tls_id: PHASE_DURATIONS[0])
+    monkeypatch.setattr(traci.trafficlight, "setPhase", lambda tls_id, phase: set_phases.append(phase))
+    monkeypatch.setattr(traci.simulation, "getTime", lambda: 0)
+    monkeypatch.setattr(traci.simulation, "getDeltaT", lambda: step_length)
+    return SmartTLS("TLS1", detector_index=FakeDetectorIndex(), phase_check_interval=phase_check_interval), set_phases
+
+
+def test_durations_of_the_running_program(monkeypatch):
+    tls, _ = make_tls(monkeypatch)
+    assert tls.phase_durations == PHASE_DURATIONS
+    assert tls.num_phases == 3
+
+
+def test_phases_expire_as_in_sumo(monkeypatch):
+    tls, _ = make_tls(monkeypatch)
+    phases = []
+    for _ in range(7):
+        tls.on_simulation_step()
+        phases.append(tls.current_phase)
+    ## SUMO switches in the step that starts at the end of the phase
+    assert phases == [0, 0, 0, 1, 2, 2, 0]
+    assert tls.phase_end == 9
+
+    ## Several phases can expire in one long step
+    tls, _ = make_tls(monkeypatch, step_length=5)
+    tls.on_simulation_step()
+    assert (tls.current_phase, tls.phase_end) == (2, 6)
+
+
+def test_set_phase_restarts_the_duration(monkeypatch):
+    tls, set_phases = make_tls(monkeypatch)
+    tls.on_simulation_step()
+    tls.on_simulation_step()
+    tls._set_phase(1)
+    assert set_phases == [1]
+    assert (tls.current_phase, tls.phase_end) == (1, 3)
+
+    phases = []
+    for _ in range(3):
+        tls.on_simulation_step()
+        phases.append(tls.current_phase)
+    assert phases == [1, 2, 2]
+
+    ## The yellow phase of _go_to_phase is the next one
+    tls._go_to_phase(0)
+    assert set_phases == [1, 0]
+    assert (tls.aimed_phase, tls.action_available) == (0, False)
+
+
+def test_phase_mismatches_are_counted_and_resynchronized(monkeypatch):
+    tls, _ = make_tls(monkeypatch, phase_check_interval=2)
+    tls.on_simulation_step()
+    tls.on_simulation_step()
+    assert tls.phase_mismatches == 0
+
+    ## SUMO moved to phase 2 (e.g. a phase changed outside the env)
+    monkeypatch.setattr(traci.trafficlight, "getPhase", lambda tls_id: 2)
+    monkeypatch.setattr(traci.trafficlight, "getNextSwitch", lambda tls_id: 6)
+    monkeypatch.setattr(traci.simulation, "getTime", lambda: 4)
+    tls.on_simulation_step()
+    with pytest.warns(UserWarning, match="local phase 1 != SUMO phase 2"):
+        tls.on_simulation_step()
+    assert tls.phase_mismatches == 1
+    assert (tls.current_phase, tls.time, tls.phase_end) == (2, 4, 6)
@@ -0,0 +1,48 @@
+import numpy as np
+from marl_tls.surrogate_env import QueueSimulator
+
+PHASE_DURATIONS = [10, 3, 10, 3]
+
+
+def make_calibration():
+    """ One TLS with two detectors, each served by one green phase """
+    return {
+        "simulation": "test",
+        "traffic_scale": 1,
+        "tls": {
+            "TLS1": {
+                "detectors": ["TLS1_Det0", "TLS1_Det1"],
+                "phase_durations": PHASE_DURATIONS,
+                "served": [[True, False], [False, False], [False, True], [False, False]],
+                "car_arrivals": [0.1, 0.1],
+                "bus_arrivals": [0.0, 0.0],
+                "green_discharge": [0.5, 0.5],
+                "red_discharge": [0.0, 0.0],
+                "green_halting": [0.2, 0.2],
+                "red_halting": [1.0, 1.0],
+                "capacity": [20, 20],
+            }
+        },
+    }
+
+
+def test_program_phases_last_their_duration():
+    ## No decision after the first step: the signals follow the program
+    simulator = QueueSimulator(make_calibration(), delta_time=1000, seed=0)
+    phases = []
+    for _ in range(30):
+        simulator.step(np.zeros((1, 1), dtype=np.int64))
+        phases.append(int(simulator.phase[0, 0]))
+
+    expected = sum([[phase] * duration for phase, duration in enumerate(PHASE_DURATIONS)], [])
+    assert phases == (expected + expected)[:30]
+
+
+def test_set_phase_restarts_the_duration():
+    simulator = QueueSimulator(make_calibration(), delta_time=1000, seed=0)
+    simulator._set_phase(np.ones((1, 1), dtype=bool), 2)
+    phases = []
+    for _ in range(12):
+        simulator._advance_signals()
+        phases.append(int(simulator.phase[0, 0]))
+    assert phases == [2] * 10 + [3] * 2
@@ -0,0 +1,16 @@
+from marl_tls.sweep import TrialDatabase, WAITING, RUNNING, COMPLETE, FAILED
+
+
+def test_resume_requeues_only_the_interrupted_trials(tmp_path):
+    database = TrialDatabase(str(tmp_path / "trials.db"))
+    for trial_id in range(3):
+        database.add_trial(trial_id, {"delta_time": trial_id})
+    database.set_state(0, RUNNING, cpus=[0])
+    database.report(0, 0, 1.5)
+    database.set_state(1, FAILED)
+    database.set_state(2, COMPLETE, value=2.0)
+
+    database.resume()
+    assert [(trial_id, state) for trial_id, _, state, _ in database.trials()] == [(0, WAITING), (1, FAILED), (2, COMPLETE)]
+    database.set_state(0, COMPLETE, value=1.0)
+    assert database.completed_reports(0) == []      # the reports of the interrupted run are dropped
@@ -0,0 +1,62 @@
+import gzip
+import struct
+import pytest
+import traci
+from traci import connection
+from traci.exceptions import FatalTraCIError
+from marl_tls.traci_trace import RECORD_HEADER, START, SEND, RECV, ReplaySocket, TraceMismatch, TraceReplayer
+
+LABEL = "replay_test"
+
+## TraCI messages (as recorded from SUMO) of simulation.getTime() -> 12.5, trafficlight.getPhase("TLS1") -> 2 and close()
+GET_TIME = b"\x00\x00\x00\x0b\x07\xabf\x00\x00\x00\x00"
+GET_PHASE = b"\x00\x00\x00\x0f\x0b\xa2(\x00\x00\x00\x04TLS1"
+CLOSE = b"\x00\x00\x00\x06\x02\x7f"
+TIME = b"\x00\x00\x00\x1b\x07\xab\x00\x00\x00\x00\x00\x10\xbbf\x00\x00\x00\x00\x0b" + struct.pack("!d", 12.5)
+PHASE = b"\x00\x00\x00\x1b\x07\xa2\x00\x00\x00\x00\x00\x10\xb2(\x00\x00\x00\x04TLS1\x09" + struct.pack("!i", 2)
+CLOSED = b"\x00\x00\x00\x0b\x07\x7f\x00\x00\x00\x00\x00"
+
+
+@pytest.fixture
+def trace(tmp_path):
+    """ Trace of one connection """
+    path = str(tmp_path / "trace.gz")
+    records = [(START, b"sim"), (SEND, GET_TIME), (RECV, TIME[:10]), (RECV, TIME[10:]), (SEND, GET_PHASE), (RECV, PHASE), (SEND, CLOSE), (RECV, CLOSED)]
+    with gzip.open(path, "wb") as file:
+        for kind, data in records:
+            file.write(RECORD_HEADER.pack(kind, len(data)) + data)
+    yield path
+    connection._connections.pop(LABEL, None)
+
+
+def test_replay_socket_serves_the_responses_in_order():
+    replay_socket = ReplaySocket(GET_TIME + GET_PHASE, TIME + PHASE)
+    assert replay_socket.send(GET_TIME) == len(GET_TIME)
+    assert replay_socket.recv(4) + replay_socket.recv(len(TIME) - 4) == TIME
+    assert replay_socket.send(GET_PHASE) == len(GET_PHASE)
+    assert replay_socket.recv(1000) == PHASE
+    assert replay_socket.recv(4) == b""     # end of the trace
+
+    with pytest.raises(TraceMismatch, match="byte 0"):
+        ReplaySocket(GET_TIME, TIME).send(GET_PHASE)
+    assert ReplaySocket(GET_TIME, TIME, strict=False).send(GET_PHASE) == len(GET_PHASE)
+
+
+def test_replayed_connection_answers_like_sumo(trace):
+    replayer = TraceReplayer(trace)
+    assert replayer.sessions == [(GET_TIME + GET_PHASE + CLOSE, TIME + PHASE + CLOSED)]
+
+    replayer.connect(LABEL)
+    assert traci.getConnection(LABEL).getLabel() == LABEL
+    assert traci.simulation.getTime() == 12.5
+    assert traci.trafficlight.getPhase("TLS1") == 2
+    traci.close()
+
+    with pytest.raises(FatalTraCIError, match="no more connections"):
+        replayer.connect(LABEL)
+
+
+def test_changed_requests_do_not_match_the_trace(trace):
+    TraceReplayer(trace).connect(LABEL)
+    with pytest.raises(TraceMismatch):
+        traci.trafficlight.getPhase("TLS1")     # the trace starts with getTime
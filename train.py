@@ -1,8 +1,14 @@
+import os
 import gymnasium as gym
 from stable_baselines3 import PPO
 from stable_baselines3.common.env_checker import check_env
 from marl_tls.env import TLSEnv
 from marl_tls.analysis_callback import AnalysisCallback
+from marl_tls.decision_ppo import DecisionPPO
+from marl_tls.actor_learner import learn_actor_learner
+from marl_tls.bucket_env import BucketPPO
+from marl_tls.pipelined_env import PipelinedVecEnv
+from marl_tls.surrogate_env import calibrate, SurrogateVecEnv
 import optparse
 
 def get_options():
@@ -12,10 +18,113 @@ def get_options():
     optParser.add_option("--simulation", action="store", type="string", default="cross/cross", help="path to the simulation")
     optParser.add_option("--timesteps", action="store", type="int", default=100000, help="number of timesteps to train")
     optParser.add_option("--retrain_model", action="store", type="string", default=None, help="file to retrain the model")
+    optParser.add_option("--normalize_observations", action="store_true", default=False, help="running mean/variance normalization of the observations")
+    optParser.add_option("--stack_frames", action="store", type="int", default=1, help="number of stacked observation frames")
+    optParser.add_option("--num_actors", action="store", type="int", default=0, help="number of asynchronous actor processes (0: synchronous training)")
+    optParser.add_option("--num_envs", action="store", type="int", default=1, help="number of simulations stepped together (pipelined TraCI steps)")
+    optParser.add_option("--bucketed", action="store_true", default=False, help="one dense policy per (num_detectors, num_actions) bucket instead of padding")
+    optParser.add_option("--decision_scheduling", action="store_true", default=False, help="only run the policy for agents that are not locked")
+    optParser.add_option("--end", action="store", type="int", default=2250, help="simulation end time")
+    optParser.add_option("--delta_time", action="store", type="int", default=5, help="time steps between the agent decisions")
+    optParser.add_option("--min_phase_time", action="store", type="int", default=5, help="minimum time of a phase")
+    optParser.add_option("--yellow_time", action="store", type="int", default=5, help="yellow time")
+    optParser.add_option("--public_transport_weight", action="store", type="float", default=5, help="weight of the public transport in the observations and reward")
+    optParser.add_option("--fidelity", action="store", type="choice", choices=["micro", "meso"], default="micro", help="micro or meso (mesoscopic pre-training, then --retrain_model with micro)")
+    optParser.add_option("--surrogate", action="store_true", default=False, help="pre-train on the queue-model surrogate of the simulation (then --retrain_model without it)")
+    optParser.add_option("--surrogate_envs", action="store", type="int", default=16, help="surrogate environments stepped together")
+    optParser.add_option("--city_scale", action="store_true", default=False, help="fetch the detector data with TraCI subscriptions (large networks)")
 
     options, args = optParser.parse_args()
+
+    ## Options that the bucketed training does not implement
+    if options.bucketed and (options.decision_scheduling or options.num_actors > 0 or options.num_envs > 1):
+        optParser.error("--bucketed does not support --decision_scheduling, --num_actors nor --num_envs")
+
+    ## Every actor steps its own simulation: the pipelined envs are not used by the actor-learner training
+    if options.num_actors > 0 and options.num_envs > 1:
+        optParser.error("--num_actors does not support --num_envs")
+
+    ## The surrogate replaces SUMO: the options of the SUMO training do not apply to it
+    if options.surrogate:
+        sumo_options = {
+            "--decision_scheduling": options.decision_scheduling,
+            "--num_actors": options.num_actors > 0,
+            "--num_envs": options.num_envs > 1,
+            "--bucketed": options.bucketed,
+            "--fidelity": options.fidelity != "micro",
+            "--normalize_observations": options.normalize_observations,
+            "--stack_frames": options.stack_frames > 1,
+        }
+        ignored = [name for name, used in sumo_options.items() if used]
+        if ignored:
+            optParser.error("--surrogate does not support " + ", ".join(ignored))
     return options
 
+def train_bucketed(env_kwargs, save_model, retrain_model, timesteps):
+    """ Train one dense policy per bucket of agents with the same observation/action shape (no padding) """
+    env = TLSEnv(**env_kwargs)
+
+    if retrain_model is None:
+        model = BucketPPO(env, verbose=1, tensorboard_log="./data/logs")
+    else:
+        model = BucketPPO.load(retrain_model, env, tensorboard_log="./data/logs")
+    print("Buckets:", model.bucket_env.summary())
+
+    model.learn(total_timesteps=timesteps, reset_num_timesteps=retrain_model is None)
+    model.save(save_model)
+    env.save_observation_stats(save_model + "_obs_stats.npz")
+    env.close()
+
+def train_padded(env_kwargs, save_model, retrain_model, timesteps, algorithm, num_actors, num_envs):
+    """ Train one policy shared by all the agents (padded to the same observation/action spaces) """
+    if num_envs > 1:
+        vec_env = PipelinedVecEnv(num_envs, **env_kwargs)
+    else:
+        vec_env = TLSEnv.get_vec_env(TLSEnv, **env_kwargs) 
+
+    if retrain_model is None:
+        # Train a new model
+        model = algorithm("MlpPolicy", vec_env, verbose=1, tensorboard_log="./data/logs")
+    else:
+        # Retrain the model
+        model = algorithm.load(retrain_model, vec_env, tensorboard_log="./data/logs")   # the number of envs may differ (e.g. surrogate pre-training)
+
+    if num_actors > 0:
+        # Asynchronous actors (each one with its own simulation), the local env only provides the spaces
+        assert not env_kwargs["normalize_observations"] and algorithm is PPO, "actor-learner training does not support observation normalization nor decision scheduling"
+        vec_env.close()
+        learn_actor_learner(model, env_kwargs, timesteps, num_actors=num_actors, reset_num_timesteps=retrain_model is None)
+    else:
+        #model.learn(total_timesteps=timesteps, callback=AnalysisCallback(vec_env))
+        model.learn(total_timesteps=timesteps, reset_num_timesteps=retrain_model is None, callback=AnalysisCallback(vec_env))
+        vec_env.close()
+
+    model.save(save_model)
+    vec_env.tls_env.save_observation_stats(save_model + "_obs_stats.npz")
+
+def train_surrogate(env_kwargs, save_model, retrain_model, timesteps, num_envs):
+    """ Pre-train on the queue-model surrogate, calibrated once per simulation (data/<simulation>_surrogate.json) """
+    calibration = "data/" + env_kwargs["simulation_path"].replace("/", "_") + "_surrogate.json"
+    if not os.path.exists(calibration):
+        calibrate(env_kwargs["simulation_path"], output=calibration, city_scale=env_kwargs["city_scale"])
+
+    vec_env = SurrogateVecEnv(
+        calibration,
+        num_envs=num_envs,
+        delta_time=env_kwargs["delta_time"],
+        min_phase_time=env_kwargs["min_phase_time"],
+        yellow_time=env_kwargs["yellow_time"],
+        end=env_kwargs["end"],
+        public_transport_weight=env_kwargs["public_transport_weight"]
+    )
+
+    if retrain_model is None:
+        model = PPO("MlpPolicy", vec_env, verbose=1, tensorboard_log="./data/logs")
+    else:
+        model = PPO.load(retrain_model, vec_env, tensorboard_log="./data/logs")
+    model.learn(total_timesteps=timesteps, reset_num_timesteps=retrain_model is None, callback=AnalysisCallback(vec_env))
+    model.save(save_model)
+
 if __name__ == "__main__":
     options = get_options()
     
@@ -23,25 +132,38 @@ if __name__ == "__main__":
     simulation_path = options.simulation
     timesteps = options.timesteps
     retrain_model = options.retrain_model
+    normalize_observations = options.normalize_observations
+    stack_frames = options.stack_frames
+    num_actors = options.num_actors
+    num_envs = options.num_envs
+    bucketed = options.bucketed
+    city_scale = options.city_scale
+    algorithm = DecisionPPO if options.decision_scheduling else PPO
 
-    end = 2250
+    end = options.end
+    
+    ## Observation statistics are saved next to the model zip
+    observation_stats = None
+    if retrain_model is not None and os.path.exists(retrain_model + "_obs_stats.npz"):
+        observation_stats = retrain_model + "_obs_stats.npz"
 
-    vec_env = TLSEnv.get_vec_env(
-        TLSEnv,
+    env_kwargs = dict(
         simulation_path=simulation_path,
-        end=end
-    ) 
-
-    if retrain_model is None:
-        # Train a new model
-        model = PPO("MlpPolicy", vec_env, verbose=1, tensorboard_log="./data/logs")
-        #model.learn(total_timesteps=timesteps, callback=AnalysisCallback(vec_env))
-        model.learn(total_timesteps=timesteps, callback=AnalysisCallback(vec_env))
+        end=end,
+        normalize_observations=normalize_observations,
+        stack_frames=stack_frames,
+        observation_stats=observation_stats,
+        city_scale=city_scale,
+        delta_time=options.delta_time,
+        min_phase_time=options.min_phase_time,
+        yellow_time=options.yellow_time,
+        public_transport_weight=options.public_transport_weight,
+        fidelity=options.fidelity
+    )
+    
+    if options.surrogate:
+        train_surrogate(env_kwargs, save_model, retrain_model, timesteps, options.surrogate_envs)
+    elif bucketed:
+        train_bucketed(env_kwargs, save_model, retrain_model, timesteps)
     else:
-        # Retrain the model
-        model = PPO.load(retrain_model, tensorboard_log="./data/logs")
-        model.set_env(vec_env)
-        model.learn(total_timesteps=timesteps, reset_num_timesteps=False, callback=AnalysisCallback(vec_env))
-
-    model.save(save_model)
-    vec_env.close()
\ No newline at end of file
+        train_padded(env_kwargs, save_model, retrain_model, timesteps, algorithm, num_actors, num_envs)